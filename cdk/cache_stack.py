@@ -0,0 +1,79 @@
+from aws_cdk import (
+    aws_ec2 as ec2,
+    aws_elasticache as elasticache,
+    core
+    )
+
+from cdk.context import get_context
+from cdk.vpc_stack import data_tier, subnet_ids
+
+
+class CacheStack(core.Stack):
+
+    def __init__(self, scope: core.Construct, id: str, **kwargs) -> None:
+        super().__init__(scope, id, **kwargs)
+        
+        # Node type and count (cdk -c cache_node_type=cache.m5.large)
+        node_type = get_context(self, "cache_node_type", "cache.t3.micro")
+        node_count = get_context(self, "cache_node_count", 2)
+        
+        # CacheSecurityGroup
+        cache_security_group = ec2.CfnSecurityGroup(self, "CacheSecurityGroup",
+            group_description = "Redis traffic",
+            vpc_id = core.Fn.import_value("VPC"),
+            security_group_ingress = [
+            {
+              "ipProtocol" : "tcp",
+              "fromPort" : 6379,
+              "toPort" : 6379,
+              "sourceSecurityGroupId" : core.Fn.import_value("WebSecurityGroupOutput"),
+            },
+            {
+              "ipProtocol" : "tcp",
+              "fromPort" : 6379,
+              "toPort" : 6379,
+              "sourceSecurityGroupId" : core.Fn.import_value("LambdaSecurityGroupOutput"),
+            }
+            ],
+            security_group_egress = [
+            {
+              "ipProtocol" : "tcp",
+              "fromPort" : 0,
+              "toPort" : 65535,
+              "cidrIp" : "0.0.0.0/0"
+            }
+            ],
+        )
+        
+        # CacheSubnetGroup
+        cache_subnet_group = elasticache.CfnSubnetGroup(self, "CacheSubnetGroup",
+            description = "CacheSubnetGroup",
+            subnet_ids = subnet_ids(data_tier(self))
+        )
+        
+        # CacheReplicationGroup
+        cache_replication_group = elasticache.CfnReplicationGroup(self, "CacheReplicationGroup",
+            replication_group_description = "Session and query cache for the photos app",
+            engine = "redis",
+            cache_node_type = node_type,
+            num_cache_clusters = node_count,
+            automatic_failover_enabled = node_count > 1,
+            multi_az_enabled = node_count > 1,
+            cache_subnet_group_name = cache_subnet_group.ref,
+            security_group_ids = [
+                cache_security_group.ref
+            ]
+        )
+        
+        # Output
+        core.CfnOutput(self, "CacheEndpointOutput",
+            value = cache_replication_group.attr_primary_end_point_address,
+            description = "Redis primary endpoint",
+            export_name = "CacheEndpoint"
+        )
+        
+        core.CfnOutput(self, "CacheReaderEndpointOutput",
+            value = cache_replication_group.attr_reader_end_point_address,
+            description = "Redis reader endpoint",
+            export_name = "CacheReaderEndpoint"
+        )
@@ -1,27 +1,253 @@
+import hashlib
+import json
+
 from aws_cdk import (
     aws_iam as iam,
     aws_cloudfront as cloudfront,
     aws_elasticloadbalancingv2 as elv2,
     aws_apigateway as apigw,
+    aws_secretsmanager as secretsmanager,
     core
 )
 
+from cdk import lb_profile
+from cdk.constants import ORIGIN_VERIFY_HEADER
+from cdk.context import get_context
+from cdk.vpc_stack import subnet_ids
+
 
 class CdnStack(core.Stack):
 
     def __init__(self, scope: core.Construct, id: str, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
         
+        # "apigateway" proxies through WebProxyApi, "alb" uses the ALB as the origin
+        origin_mode = get_context(self, "cdn_origin_mode", "apigateway")
+        if origin_mode not in ("apigateway", "alb"):
+            raise ValueError("cdn_origin_mode must be 'apigateway' or 'alb', got %r" % (origin_mode,))
         
-        # Api
-        api = apigw.CfnRestApi(self, "Api",
-            name = "WebProxyApi",
-            binary_media_types = ["*"]
+        # LoadBalancer, tuned by the same lb_profile as WebStack's target group
+        loadbalancer = elv2.CfnLoadBalancer(self, 'LoadBalancer',
+            subnets = subnet_ids("Public"),
+            load_balancer_attributes = lb_profile.load_balancer_attributes(lb_profile.load_balancing_profile(self)),
+            security_groups = [core.Fn.import_value("WebSecurityGroupOutput"),]
+        )
+        
+        if origin_mode == "apigateway":
+            # Stage cache and throttling (cdk -c apigw_cache_enabled=true)
+            cache_enabled = get_context(self, "apigw_cache_enabled", False)
+            cache_cluster_size = get_context(self, "apigw_cache_cluster_size", "0.5")
+            cache_ttl = get_context(self, "apigw_cache_ttl", 300)
+            root_cache_ttl = get_context(self, "apigw_root_cache_ttl", cache_ttl)
+            # Pages differ per signed-in user, so the session cookie is part of the key
+            cache_key_headers = get_context(self, "apigw_cache_key_headers", ["Cookie"])
+            cache_key_querystrings = get_context(self, "apigw_cache_key_querystrings", [])
+            throttle_burst_limit = get_context(self, "apigw_throttle_burst_limit", 200)
+            throttle_rate_limit = get_context(self, "apigw_throttle_rate_limit", 100)
+            
+            cache_key_parameters = (
+                ["method.request.header.%s" % (name) for name in cache_key_headers] +
+                ["method.request.querystring.%s" % (name) for name in cache_key_querystrings]
+            )
+            
+            # Api
+            api = apigw.CfnRestApi(self, "Api",
+                name = "WebProxyApi",
+                binary_media_types = ["*"]
+            )
+            
+            # CloudWatchRole
+            cloud_watch_role = iam.CfnRole(self, "CloudWatchRole",
+                role_name= "cloud-watch-lambda-execution-role",
+                assume_role_policy_document = {
+                    "Version": "2012-10-17",
+                    "Statement": [
+                    {
+                      "Effect": "Allow",
+                      "Principal": {
+                        "Service": [
+                          "apigateway.amazonaws.com"
+                        ]
+                      },
+                      "Action": [
+                        "sts:AssumeRole"
+                      ]
+                    }]
+                },
+                path = "/",
+                managed_policy_arns = [
+                    "arn:aws:iam::aws:policy/service-role/AmazonAPIGatewayPushToCloudWatchLogs",
+                    "arn:aws:iam::aws:policy/AWSXrayWriteOnlyAccess"
+                ],
+            )
+        
+            # Account
+            account = apigw.CfnAccount(self, "Account",
+                cloud_watch_role_arn = cloud_watch_role.attr_arn
+            )
+        
+            #Resource
+            resource = apigw.CfnResource(self, "Resource",
+                parent_id = api.attr_root_resource_id,
+                rest_api_id = api.ref,
+                path_part = "{proxy+}"
+            )
+        
+            # RootMethod
+            root_method = apigw.CfnMethod(self, "RootMethod",
+                http_method = "ANY",
+                resource_id = api.attr_root_resource_id,
+                rest_api_id = api.ref,
+                authorization_type = "None",
+                request_parameters = {
+                    parameter: False for parameter in cache_key_parameters
+                },
+                integration = {
+                    "cacheKeyParameters" : cache_key_parameters,
+                    "integrationHttpMethod" : "ANY",
+                    "type" : "HTTP_PROXY",
+                    "uri" : "http://" + loadbalancer.attr_dns_name, 
+                    "passthroughBehavior" : "WHEN_NO_MATCH",
+                    "integrationResponses" : [{ 
+                        "statusCode" : "200"
+                    }]
+                }
+            )
+        
+            # ProxyMethod
+            proxy_method = apigw.CfnMethod(self, "ProxyMethod",
+                http_method = "ANY",
+                resource_id = resource.ref,
+                rest_api_id = api.ref,
+                authorization_type = "None",
+                request_parameters = dict({
+                    "method.request.path.proxy": True
+                }, **{parameter: False for parameter in cache_key_parameters}),
+                integration = {
+                    "cacheKeyParameters" : [
+                        "method.request.path.proxy"
+                    ] + cache_key_parameters,
+                    "requestParameters" : {
+                        "integration.request.path.proxy" : "method.request.path.proxy"
+                    },
+                    "integrationHttpMethod" : "ANY",
+                    "type" : "HTTP_PROXY",
+                    "uri" : "http://" + loadbalancer.attr_dns_name + "/{proxy}", 
+                    "passthroughBehavior" : "WHEN_NO_MATCH",
+                    "integrationResponses" : [{ 
+                        "statusCode" : "200"
+                    }]
+                }
+            )
+
+            # Deployment, its logical id follows the method settings so that a
+            # change to them publishes a new deployment to the Prod stage
+            method_settings_hash = hashlib.sha256(json.dumps(self.resolve([
+                root_method.request_parameters, root_method.integration,
+                proxy_method.request_parameters, proxy_method.integration
+            ]), sort_keys = True).encode()).hexdigest()[:8]
+            deployment = apigw.CfnDeployment(self, "Deployment%s" % (method_settings_hash),
+                rest_api_id = api.ref
+            )
+            deployment.add_depends_on(root_method)
+            deployment.add_depends_on(proxy_method)
+            
+
+            # ProdStage
+            prod_stage = apigw.CfnStage(self, "ProdStage",
+                stage_name = "Prod",
+                description = "Prod Stage",
+                rest_api_id = api.ref,
+                deployment_id = deployment.ref,
+                tracing_enabled = True,
+                cache_cluster_enabled = cache_enabled,
+                cache_cluster_size = cache_cluster_size if cache_enabled else None,
+                method_settings = [
+                {
+                    "resourcePath" : "/*",
+                    "httpMethod" : "*",
+                    "throttlingBurstLimit" : throttle_burst_limit,
+                    "throttlingRateLimit" : throttle_rate_limit,
+                    "cachingEnabled" : False
+                },
+                {
+                    # API Gateway only serves GET requests of an ANY method from the cache
+                    "resourcePath" : "/",
+                    "httpMethod" : "ANY",
+                    "throttlingBurstLimit" : throttle_burst_limit,
+                    "throttlingRateLimit" : throttle_rate_limit,
+                    "cachingEnabled" : cache_enabled,
+                    "cacheTtlInSeconds" : root_cache_ttl
+                },
+                {
+                    "resourcePath" : "/~1{proxy+}",
+                    "httpMethod" : "ANY",
+                    "throttlingBurstLimit" : throttle_burst_limit,
+                    "throttlingRateLimit" : throttle_rate_limit,
+                    "cachingEnabled" : cache_enabled,
+                    "cacheTtlInSeconds" : cache_ttl
+                }]
+            )
+            
+            website_origin = {
+                "domainName" : "%s.execute-api.%s.amazonaws.com" % (api.ref, core.Aws.REGION),
+                "id" : "website",
+                "originPath" : "/Prod",
+                "customOriginConfig" : { "originProtocolPolicy" : "https-only" },
+            }
+        else:
+            # OriginVerifySecret, generated per deployment and read by WebStack,
+            # whose listener rejects requests without it
+            origin_verify_secret = secretsmanager.CfnSecret(self, "OriginVerifySecret",
+                description = "Value of the %s header CloudFront sends to the ALB" % (ORIGIN_VERIFY_HEADER),
+                generate_secret_string = {
+                    "passwordLength" : 32,
+                    "excludePunctuation" : True
+                }
+            )
+            
+            website_origin = {
+                "domainName" : loadbalancer.attr_dns_name,
+                "id" : "website",
+                "customOriginConfig" : {
+                    "originProtocolPolicy" : "http-only",
+                    "originReadTimeout" : 60
+                },
+                "originCustomHeaders" : [{
+                    "headerName" : ORIGIN_VERIFY_HEADER,
+                    "headerValue" : "{{resolve:secretsmanager:%s:SecretString}}" % (origin_verify_secret.ref)
+                }],
+            }
+        
+        # Path patterns served with a long TTL and no cookies in the cache key:
+        # the app's own assets come from the web fleet, uploaded images straight
+        # from the image bucket. Static patterns come first so /static/*.png
+        # still reaches the app.
+        static_path_patterns = get_context(self, "cdn_static_path_patterns", [
+            "/static/*",
+            "*.css",
+            "*.js",
+        ])
+        media_path_patterns = get_context(self, "cdn_media_path_patterns", [
+            "*.jpg",
+            "*.jpeg",
+            "*.png",
+            "*.gif",
+        ])
+        static_ttl = get_context(self, "cdn_static_ttl", 86400)
+        
+        # MediaOriginAccessIdentity
+        media_origin_access_identity = cloudfront.CfnCloudFrontOriginAccessIdentity(self, "MediaOriginAccessIdentity",
+            cloud_front_origin_access_identity_config = {
+                "comment" : "Read access to the image bucket for WebpageCdn"
+            }
         )
         
         # WebpageCDN
         webpage_cdn = cloudfront.CfnDistribution(self, 'WebpageCdn',
             distribution_config = {
+                # Dynamic pages: the origin decides through Cache-Control,
+                # keyed only on what Flask actually reads.
                 "defaultCacheBehavior" : {
                     "allowedMethods" : [
                         "DELETE",
@@ -32,144 +258,57 @@ class CdnStack(core.Stack):
                         "POST",
                         "PUT"
                     ],
-                    "maxTTL" : 0,
+                    "cachedMethods" : ["GET", "HEAD"],
+                    "maxTTL" : 31536000,
                     "minTTL" : 0,
                     "defaultTTL" : 0,
+                    "compress" : True,
                     "forwardedValues" : {
                         "queryString" : True,
                         "cookies" : {
-                            "forward" : "all"
+                            "forward" : "whitelist",
+                            "whitelistedNames" : ["session"]
                         },
                         "headers" : [
-                            "Accept",
-                            "Referer",
-                            "Athorization",
-                            "Content",
+                            "Authorization",
                         ]
                     },
                     "targetOriginId" : "website",
                     "viewerProtocolPolicy" : "redirect-to-https",
                 },
+                "cacheBehaviors" : [{
+                    "pathPattern" : path_pattern,
+                    "allowedMethods" : ["GET", "HEAD"],
+                    "cachedMethods" : ["GET", "HEAD"],
+                    "minTTL" : 0,
+                    "defaultTTL" : static_ttl,
+                    "maxTTL" : 31536000,
+                    "compress" : True,
+                    "forwardedValues" : {
+                        "queryString" : False,
+                        "cookies" : {
+                            "forward" : "none"
+                        }
+                    },
+                    "targetOriginId" : origin_id,
+                    "viewerProtocolPolicy" : "redirect-to-https",
+                } for path_patterns, origin_id in [(static_path_patterns, "website"), (media_path_patterns, "media")]
+                  for path_pattern in path_patterns],
                 "enabled" : True,
-                "origins" : [{
-                    "domainName" : "%s.execute-api.%s.amazonaws.com" % (api.ref, core.Aws.REGION),
-                    "id" : "website",
-                    "originPath" : "/Prod",
-                    "customOriginConfig" : { "originProtocolPolicy" : "https-only" },
-                }],
-                "priceClass" : "PriceClass_All"
-            }
-        )
-        
-        # LoadBalancer
-        loadbalancer = elv2.CfnLoadBalancer(self, 'LoadBalancer',
-            subnets = [
-                core.Fn.import_value("PublicSubnet1"),
-                core.Fn.import_value("PublicSubnet2"),
-            ],
-            load_balancer_attributes = [{
-                "key" : "idle_timeout.timeout_seconds",
-                "value" : "50"
-            }],
-            security_groups = [core.Fn.import_value("WebSecurityGroupOutput"),]
-        )
-        
-        # CloudWatchRole
-        cloud_watch_role = iam.CfnRole(self, "CloudWatchRole",
-            role_name= "cloud-watch-lambda-execution-role",
-            assume_role_policy_document = {
-                "Version": "2012-10-17",
-                "Statement": [
-                {
-                  "Effect": "Allow",
-                  "Principal": {
-                    "Service": [
-                      "apigateway.amazonaws.com"
-                    ]
-                  },
-                  "Action": [
-                    "sts:AssumeRole"
-                  ]
-                }]
-            },
-            path = "/",
-            managed_policy_arns = [
-                "arn:aws:iam::aws:policy/service-role/AmazonAPIGatewayPushToCloudWatchLogs",
-                "arn:aws:iam::aws:policy/AWSXrayWriteOnlyAccess"
-            ],
-        )
-        
-        # Account
-        account = apigw.CfnAccount(self, "Account",
-            cloud_watch_role_arn = cloud_watch_role.attr_arn
-        )
-        
-        #Resource
-        resource = apigw.CfnResource(self, "Resource",
-            parent_id = api.attr_root_resource_id,
-            rest_api_id = api.ref,
-            path_part = "{proxy+}"
-        )
-        
-        # RootMethod
-        root_method = apigw.CfnMethod(self, "RootMethod",
-            http_method = "ANY",
-            resource_id = api.attr_root_resource_id,
-            rest_api_id = api.ref,
-            authorization_type = "None",
-            integration = {
-                "integrationHttpMethod" : "ANY",
-                "type" : "HTTP_PROXY",
-                "uri" : "http://" + loadbalancer.attr_dns_name, 
-                "passthroughBehavior" : "WHEN_NO_MATCH",
-                "integrationResponses" : [{ 
-                    "statusCode" : "200"
-                }]
-            }
-        )
-        
-        # ProxyMethod
-        proxy_method = apigw.CfnMethod(self, "ProxyMethod",
-            http_method = "ANY",
-            resource_id = resource.ref,
-            rest_api_id = api.ref,
-            authorization_type = "None",
-            request_parameters = {
-                "method.request.path.proxy": True
-            },
-            integration = {
-                "cacheKeyParameters" : [
-                    "method.request.path.proxy"
+                "origins" : [
+                    website_origin,
+                    {
+                        # Regional endpoint: the global one redirects outside us-east-1
+                        "domainName" : "imagebucketsns%s.s3.%s.amazonaws.com" % (core.Aws.ACCOUNT_ID, core.Aws.REGION),
+                        "id" : "media",
+                        "s3OriginConfig" : {
+                            "originAccessIdentity" : "origin-access-identity/cloudfront/%s" % (media_origin_access_identity.ref)
+                        },
+                    }
                 ],
-                "requestParameters" : {
-                    "integration.request.path.proxy" : "method.request.path.proxy"
-                },
-                "integrationHttpMethod" : "ANY",
-                "type" : "HTTP_PROXY",
-                "uri" : "http://" + loadbalancer.attr_dns_name + "/{proxy}", 
-                "passthroughBehavior" : "WHEN_NO_MATCH",
-                "integrationResponses" : [{ 
-                    "statusCode" : "200"
-                }]
+                "priceClass" : "PriceClass_All"
             }
         )
-
-        # Deployment
-        deployment = apigw.CfnDeployment(self, "Deployment",
-            rest_api_id = api.ref
-        )
-        deployment.add_depends_on(root_method)
-        deployment.add_depends_on(proxy_method)
-            
-
-        # ProdStage
-        prod_stage = apigw.CfnStage(self, "ProdStage",
-            stage_name = "Prod",
-            description = "Prod Stage",
-            rest_api_id = api.ref,
-            deployment_id = deployment.ref,
-            tracing_enabled = True
-        )
         
         # Output
         core.CfnOutput(self, "AlbDNSName",
@@ -184,7 +323,26 @@ class CdnStack(core.Stack):
           export_name = "DomainName"
         )
         
+        core.CfnOutput(self, "MediaOriginAccessIdentityOutput",
+          value = media_origin_access_identity.attr_s3_canonical_user_id,
+          description = "Canonical user of the CloudFront identity reading the image bucket",
+          export_name = "MediaOriginAccessIdentity"
+        )
+        
         core.CfnOutput(self, "LoadBalancerArn",
           value = loadbalancer.ref,
           export_name = "LoadBalancerArn"
-        )
\ No newline at end of file
+        )
+        
+        core.CfnOutput(self, "LoadBalancerFullName",
+          value = loadbalancer.attr_load_balancer_full_name,
+          description = "ALB full name used by the web fleet scaling policy",
+          export_name = "LoadBalancerFullName"
+        )
+        
+        if origin_mode == "alb":
+            core.CfnOutput(self, "OriginVerifySecretArn",
+              value = origin_verify_secret.ref,
+              description = "Secret holding the %s header value" % (ORIGIN_VERIFY_HEADER),
+              export_name = "OriginVerifySecretArn"
+            )
@@ -0,0 +1,154 @@
+"""Typed builder for ``AWS::CloudFormation::Init`` metadata.
+
+Configs are plain objects rendered to the dict layout cfn-init reads, so the
+same definitions can be attached to instances, a launch template or
+flattened into an image build. ``InitRegistry`` keeps one copy of each
+distinct metadata in the template and points every other resource that
+would carry the same content at it.
+"""
+import json
+import textwrap
+
+
+def _flag(value):
+    return "true" if value else "false"
+
+
+class InitFile:
+
+    def __init__(self, path, content, mode="000400", owner="root", group="root"):
+        self.path = path
+        self.content = textwrap.dedent(content).lstrip("\n")
+        self.mode = mode
+        self.owner = owner
+        self.group = group
+
+    def render(self):
+        return {
+            "content": self.content,
+            "mode": self.mode,
+            "owner": self.owner,
+            "group": self.group
+        }
+
+
+class InitCommand:
+
+    def __init__(self, key, command, cwd=None, ignore_errors=None):
+        self.key = key
+        self.command = command
+        self.cwd = cwd
+        self.ignore_errors = ignore_errors
+
+    def render(self):
+        command = {"command": self.command}
+        if self.cwd is not None:
+            command["cwd"] = self.cwd
+        if self.ignore_errors is not None:
+            command["ignoreErrors"] = _flag(self.ignore_errors)
+        return command
+
+    def to_bash(self):
+        line = self.command.strip()
+        if self.cwd is not None:
+            line = "cd %s && %s" % (self.cwd, line)
+        if self.ignore_errors:
+            line = "(%s) || true" % line
+        return line
+
+
+class InitService:
+
+    def __init__(self, name, enabled=True, ensure_running=True, files=()):
+        self.name = name
+        self.enabled = enabled
+        self.ensure_running = ensure_running
+        self.files = list(files)
+
+    def render(self):
+        service = {"enabled": _flag(self.enabled), "ensureRunning": _flag(self.ensure_running)}
+        if self.files:
+            service["files"] = list(self.files)
+        return service
+
+
+class InitConfig:
+
+    def __init__(self, packages=(), sources=None, files=(), commands=(), services=(),
+                 service_manager="sysvinit"):
+        self.packages = list(packages)
+        self.sources = dict(sources or {})
+        self.files = list(files)
+        self.commands = list(commands)
+        self.services = list(services)
+        self.service_manager = service_manager
+
+    def render(self):
+        config = {}
+        if self.packages:
+            config["packages"] = {"yum": {name: [] for name in self.packages}}
+        if self.sources:
+            config["sources"] = dict(self.sources)
+        if self.files:
+            config["files"] = {init_file.path: init_file.render() for init_file in self.files}
+        if self.commands:
+            config["commands"] = {command.key: command.render() for command in self.commands}
+        if self.services:
+            config["services"] = {self.service_manager: {service.name: service.render() for service in self.services}}
+        return config
+
+
+class CloudFormationInit:
+    """Config sets plus named configs, rendered for the resource cfn-init reads.
+
+    ``configs`` may hold a callable taking the resource's logical id for a
+    config whose content names it, such as the cfn-auto-reloader hook.
+    """
+
+    def __init__(self, config_sets, configs, authentication=None):
+        self.config_sets = config_sets
+        self.configs = configs
+        self.authentication = authentication
+        self._rendered = {}
+
+    def config(self, name, resource):
+        config = self.configs[name]
+        return config(resource) if callable(config) else config
+
+    def render(self, resource):
+        if resource not in self._rendered:
+            metadata = {}
+            if self.authentication:
+                metadata["AWS::CloudFormation::Authentication"] = self.authentication
+            init = {"configSets": {name: list(configs) for name, configs in self.config_sets.items()}}
+            for name in self.configs:
+                init[name] = self.config(name, resource).render()
+            metadata["AWS::CloudFormation::Init"] = init
+            self._rendered[resource] = metadata
+        return self._rendered[resource]
+
+    def key(self):
+        """Content identity, independent of the resource the metadata ends up on."""
+        return json.dumps(self.render("{Resource}"), sort_keys=True)
+
+
+class InitRegistry:
+    """Attach each distinct Init once per template.
+
+    The first resource registered with a given content carries the metadata;
+    later resources with the same content get no copy and run cfn-init
+    against the first one instead.
+    """
+
+    def __init__(self):
+        self._holders = {}
+
+    def resource_for(self, resource, init):
+        """Logical id that ``resource`` runs ``cfn-init --resource`` against."""
+        return self._holders.setdefault(init.key(), resource)
+
+    def attach(self, construct, init):
+        """Set the metadata on the L1 ``construct`` if it is the holder of ``init``."""
+        resource = construct.node.id
+        if self.resource_for(resource, init) == resource:
+            construct.cfn_options.metadata = init.render(resource)
@@ -0,0 +1,4 @@
+# Header CloudFront adds to requests it sends straight to the ALB. Its value
+# is the OriginVerifySecret generated by CdnStack, WebStack's listener
+# rejects requests without it.
+ORIGIN_VERIFY_HEADER = "X-Origin-Verify"
@@ -0,0 +1,19 @@
+import json
+
+
+def get_context(scope, key, default=None):
+    """Read ``key`` from the app context (cdk.json or ``cdk -c key=value``).
+
+    Values passed on the command line always arrive as strings, so they are
+    coerced to the type of ``default`` when one is given.
+    """
+    value = scope.node.try_get_context(key)
+    if value is None:
+        return default
+    if isinstance(value, str) and default is not None and not isinstance(default, str):
+        if isinstance(default, bool):
+            return value.lower() in ("1", "true", "yes", "on")
+        if isinstance(default, (dict, list)):
+            return json.loads(value)
+        return type(default)(value)
+    return value
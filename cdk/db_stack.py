@@ -5,9 +5,61 @@ from aws_cdk import (
     aws_s3 as s3,
     aws_cloud9 as cloud9,
     aws_rds as rds,
+    aws_secretsmanager as secretsmanager,
     core
     )
 
+from cdk.context import get_context
+from cdk.vpc_stack import data_tier, subnet_ids
+
+# Engine of provisioned clusters whose profile names none. The serverless
+# profiles' "aurora" (MySQL 5.6) is retired outside Serverless v1, and
+# Aurora MySQL 3 starts at db.t3.medium.
+PROVISIONED_ENGINE = {
+    "engine": "aurora-mysql",
+    "engine_version": "8.0.mysql_aurora.3.10.0",
+    "instance_class": "db.t3.medium",
+}
+
+# Capacity profiles, selected with cdk -c db_profile=<name>. Serverless v1
+# capacities must be powers of two between 1 and 256 ACUs.
+DB_PROFILES = {
+    # Cheapest: pauses when idle, first request after a pause waits for resume
+    "dev-autopause": {
+        "engine_mode": "serverless",
+        "min_capacity": 2,
+        "max_capacity": 4,
+        "auto_pause": True,
+        "seconds_until_auto_pause": 300,
+        "timeout_action": "RollbackCapacityChange",
+    },
+    # Never pauses and keeps enough capacity warm for steady traffic
+    "prod-warm": {
+        "engine_mode": "serverless",
+        "min_capacity": 4,
+        "max_capacity": 16,
+        "auto_pause": False,
+        "timeout_action": "ForceApplyCapacityChange",
+    },
+    # Small floor, high ceiling, scales even when connections are busy
+    "burst": {
+        "engine_mode": "serverless",
+        "min_capacity": 2,
+        "max_capacity": 64,
+        "auto_pause": False,
+        "timeout_action": "ForceApplyCapacityChange",
+    },
+    # Aurora Serverless v2 runs as provisioned db.serverless instances
+    "serverless-v2": {
+        "engine_mode": "provisioned",
+        "engine": PROVISIONED_ENGINE["engine"],
+        "engine_version": PROVISIONED_ENGINE["engine_version"],
+        "instance_class": "db.serverless",
+        "min_capacity": 0.5,
+        "max_capacity": 16,
+    },
+}
+
 
 class DBStack(core.Stack):
 
@@ -23,6 +75,53 @@ class DBStack(core.Stack):
             constraint_description = "the password must be between 1 and 41 characters",
             default = "DBPassword"
         )
+        
+        # Performance profile, individual keys can be overridden with db_profile_overrides
+        profile_name = get_context(self, "db_profile", "dev-autopause")
+        if profile_name not in DB_PROFILES:
+            raise ValueError("Unknown db_profile %r, expected one of %s"
+                             % (profile_name, ", ".join(sorted(DB_PROFILES))))
+        profile = dict(DB_PROFILES[profile_name])
+        overrides = get_context(self, "db_profile_overrides", {})
+        
+        # "serverless" (Aurora Serverless v1) or "provisioned" with a writer and readers
+        engine_mode = get_context(self, "db_engine_mode", overrides.get("engine_mode", profile["engine_mode"]))
+        if engine_mode not in ("serverless", "provisioned"):
+            raise ValueError("db_engine_mode must be 'serverless' or 'provisioned', got %r" % (engine_mode,))
+        if engine_mode == "serverless" and profile["engine_mode"] != "serverless":
+            raise ValueError("db_profile %r has no Serverless v1 scaling settings, it needs db_engine_mode=provisioned"
+                             % (profile_name,))
+        if engine_mode == "provisioned":
+            profile = dict(PROVISIONED_ENGINE, **profile)
+        unknown = set(overrides) - set(profile)
+        if unknown:
+            raise ValueError("Unknown db_profile_overrides keys for %s: %s" % (profile_name, ", ".join(sorted(unknown))))
+        profile.update(overrides)
+        engine = profile.get("engine", "aurora")
+        instance_class = get_context(self, "db_instance_class", profile.get("instance_class"))
+        reader_count = get_context(self, "db_reader_count", 1)
+        serverless_v2 = instance_class == "db.serverless"
+        
+        if engine_mode == "serverless":
+            scaling_configuration = {
+                "autoPause" : profile["auto_pause"],
+                "maxCapacity" : profile["max_capacity"],
+                "minCapacity" : profile["min_capacity"],
+                "timeoutAction" : profile["timeout_action"]
+            }
+            if profile["auto_pause"]:
+                scaling_configuration["secondsUntilAutoPause"] = profile["seconds_until_auto_pause"]
+        else:
+            scaling_configuration = None
+        
+        # RDS Proxy settings (cdk -c db_proxy_enabled=true)
+        proxy_enabled = get_context(self, "db_proxy_enabled", False)
+        proxy_max_connections_percent = get_context(self, "db_proxy_max_connections_percent", 90)
+        proxy_max_idle_connections_percent = get_context(self, "db_proxy_max_idle_connections_percent", 50)
+        proxy_iam_auth = get_context(self, "db_proxy_iam_auth", False)
+        if proxy_enabled and engine_mode == "serverless":
+            raise ValueError("RDS Proxy cannot target an Aurora Serverless v1 cluster, "
+                             "db_proxy_enabled needs a provisioned cluster")
 
         # DBSecurityGroup:
         db_security_group = ec2.CfnSecurityGroup(self, "DBSecurityGroup",
@@ -61,10 +160,7 @@ class DBStack(core.Stack):
         # MyDBSubnetGroup
         my_db_subnet_group = rds.CfnDBSubnetGroup(self, "DBSubnetGroup",
             db_subnet_group_description = "MyDBSubnetGroup",
-            subnet_ids = [
-                    core.Fn.import_value("PrivateSubnet1"),
-                    core.Fn.import_value("PrivateSubnet2")
-            ]
+            subnet_ids = subnet_ids(data_tier(self))
         )
         
         # RDSCluster
@@ -73,23 +169,223 @@ class DBStack(core.Stack):
             database_name = "Photos",
             master_username = "master",
             master_user_password = db_password_parameters.value_as_string,
-            engine_mode = "serverless",
-            scaling_configuration = {
-                "autoPause" : True,
-                "maxCapacity" : 4,
-                "minCapacity" : 2
-            } ,
-            engine = "aurora",
+            engine_mode = engine_mode,
+            scaling_configuration = scaling_configuration,
+            engine = engine,
+            engine_version = profile.get("engine_version"),
             db_subnet_group_name = my_db_subnet_group.ref,
             vpc_security_group_ids = [
                 db_security_group.ref
             ]
         )
         rds_cluster.apply_removal_policy(core.RemovalPolicy.DESTROY)
+        if serverless_v2:
+            rds_cluster.add_property_override("ServerlessV2ScalingConfiguration", {
+                "MinCapacity" : profile["min_capacity"],
+                "MaxCapacity" : profile["max_capacity"]
+            })
+        
+        db_endpoint = rds_cluster.attr_endpoint_address
+        # Serverless v1 has no replicas, readers share the writer endpoint
+        db_reader_endpoint = rds_cluster.attr_endpoint_address
+        db_instances = []
+        if engine_mode == "provisioned":
+            # RDSWriterInstance
+            rds_writer_instance = rds.CfnDBInstance(self, "RDSWriterInstance",
+                db_cluster_identifier = rds_cluster.ref,
+                db_instance_class = instance_class,
+                engine = engine,
+                promotion_tier = 0,
+                publicly_accessible = False
+            )
+            rds_writer_instance.apply_removal_policy(core.RemovalPolicy.DESTROY)
+            db_instances.append(rds_writer_instance)
+            
+            # RDSReaderInstance1..N
+            for index in range(1, reader_count + 1):
+                rds_reader_instance = rds.CfnDBInstance(self, "RDSReaderInstance%d" % (index),
+                    db_cluster_identifier = rds_cluster.ref,
+                    db_instance_class = instance_class,
+                    engine = engine,
+                    promotion_tier = 1,
+                    publicly_accessible = False
+                )
+                rds_reader_instance.add_depends_on(rds_writer_instance)
+                rds_reader_instance.apply_removal_policy(core.RemovalPolicy.DESTROY)
+                db_instances.append(rds_reader_instance)
+            
+            if reader_count:
+                db_reader_endpoint = rds_cluster.attr_read_endpoint_address
+        
+        if proxy_enabled:
+            # DBProxySecret, credentials the proxy uses for the application user. The
+            # password is generated rather than shared with the master user, the
+            # web_user account has to be created with it
+            db_proxy_secret = secretsmanager.CfnSecret(self, "DBProxySecret",
+                description = "web_user credentials for the edx-photos RDS Proxy",
+                generate_secret_string = {
+                    "secretStringTemplate" : '{"username": "web_user"}',
+                    "generateStringKey" : "password",
+                    "passwordLength" : 32,
+                    "excludePunctuation" : True
+                }
+            )
+            
+            # DBProxyRole
+            db_proxy_role = iam.CfnRole(self, "DBProxyRole",
+                assume_role_policy_document = {
+                    "Version": "2012-10-17",
+                    "Statement": [
+                    {
+                      "Effect": "Allow",
+                      "Principal": {
+                        "Service": [
+                          "rds.amazonaws.com"
+                        ]
+                      },
+                      "Action": [
+                        "sts:AssumeRole"
+                      ]
+                    }]
+                },
+                policies = [
+                {
+                    "policyName" : "root",
+                    "policyDocument" : {
+                    "Version":"2012-10-17",
+                    "Statement" : [
+                    {
+                      "Effect": "Allow",
+                      "Action" : [
+                        "secretsmanager:GetSecretValue"
+                      ],
+                        "Resource": db_proxy_secret.ref
+                    },
+                    ]}
+                }]
+            )
+            
+            # DBSecurityGroupProxyIngress, the proxy shares the DB security group
+            db_security_group_proxy_ingress = ec2.CfnSecurityGroupIngress(self, "DBSecurityGroupProxyIngress",
+                group_id = db_security_group.ref,
+                ip_protocol = "tcp",
+                from_port = 3306,
+                to_port = 3306,
+                source_security_group_id = db_security_group.ref
+            )
+            
+            # DBProxy
+            db_proxy = rds.CfnDBProxy(self, "DBProxy",
+                db_proxy_name = "edx-photos-proxy",
+                engine_family = "MYSQL",
+                role_arn = db_proxy_role.attr_arn,
+                auth = [{
+                    "authScheme" : "SECRETS",
+                    "secretArn" : db_proxy_secret.ref,
+                    "iamAuth" : "REQUIRED" if proxy_iam_auth else "DISABLED"
+                }],
+                # IAM authentication only works over TLS
+                require_tls = proxy_iam_auth,
+                vpc_subnet_ids = subnet_ids(data_tier(self)),
+                vpc_security_group_ids = [
+                    db_security_group.ref
+                ]
+            )
+            
+            # DBProxyTargetGroup
+            db_proxy_target_group = rds.CfnDBProxyTargetGroup(self, "DBProxyTargetGroup",
+                db_proxy_name = db_proxy.ref,
+                target_group_name = "default",
+                db_cluster_identifiers = [rds_cluster.ref],
+                connection_pool_configuration_info = {
+                    "maxConnectionsPercent" : proxy_max_connections_percent,
+                    "maxIdleConnectionsPercent" : proxy_max_idle_connections_percent
+                }
+            )
+            # Targets can only be registered once the cluster has instances
+            for db_instance in db_instances:
+                db_proxy_target_group.add_depends_on(db_instance)
+            
+            if proxy_iam_auth:
+                # DBProxyConnectPolicy, lets the web instances connect as web_user. The
+                # dbuser ARN takes the proxy resource id, the last field of its ARN
+                db_proxy_resource_id = core.Fn.select(6, core.Fn.split(":", db_proxy.attr_db_proxy_arn))
+                db_proxy_connect_policy = iam.CfnPolicy(self, "DBProxyConnectPolicy",
+                    policy_name = "edx-photos-proxy-connect",
+                    policy_document = {
+                        "Version": "2012-10-17",
+                        "Statement": [
+                        {
+                          "Effect": "Allow",
+                          "Action": [
+                            "rds-db:connect"
+                          ],
+                          "Resource": "arn:aws:rds-db:%s:%s:dbuser:%s/web_user" % (
+                              core.Aws.REGION, core.Aws.ACCOUNT_ID, db_proxy_resource_id)
+                        }]
+                    },
+                    roles = [core.Fn.import_value("WebServerRoleOutput")]
+                )
+            
+            db_proxy_endpoint = db_proxy.attr_endpoint
+            db_proxy_reader_endpoint_address = db_proxy.attr_endpoint
+            if engine_mode == "provisioned" and reader_count:
+                # DBProxyReaderEndpoint
+                db_proxy_reader_endpoint = rds.CfnDBProxyEndpoint(self, "DBProxyReaderEndpoint",
+                    db_proxy_endpoint_name = "edx-photos-proxy-reader",
+                    db_proxy_name = db_proxy.ref,
+                    target_role = "READ_ONLY",
+                    vpc_subnet_ids = subnet_ids(data_tier(self)),
+                    vpc_security_group_ids = [
+                        db_security_group.ref
+                    ]
+                )
+                db_proxy_reader_endpoint.add_depends_on(db_proxy_target_group)
+                db_proxy_reader_endpoint_address = db_proxy_reader_endpoint.attr_endpoint
         
         # Output
         core.CfnOutput(self, "MyDBEndpoint",
-            value = rds_cluster.attr_endpoint_address,
+            value = db_endpoint,
             description = "MyDB Endpoint",
             export_name = "MyDBEndpoint"
-        )
\ No newline at end of file
+        )
+        
+        core.CfnOutput(self, "MyDBReaderEndpoint",
+            value = db_reader_endpoint,
+            description = "MyDB read-only endpoint for gallery queries",
+            export_name = "MyDBReaderEndpoint"
+        )
+        
+        core.CfnOutput(self, "MyDBClusterEndpoint",
+            value = rds_cluster.attr_endpoint_address,
+            description = "MyDB cluster writer endpoint",
+            export_name = "MyDBClusterEndpoint"
+        )
+        
+        # The proxy gets its own exports: changing the value of MyDBEndpoint
+        # while SnssqsStack imports it would fail the DBStack update
+        if proxy_enabled:
+            core.CfnOutput(self, "MyDBProxyEndpoint",
+                value = db_proxy_endpoint,
+                description = "RDS Proxy endpoint in front of MyDB",
+                export_name = "MyDBProxyEndpoint"
+            )
+            
+            core.CfnOutput(self, "MyDBProxyReaderEndpoint",
+                value = db_proxy_reader_endpoint_address,
+                description = "RDS Proxy read-only endpoint, the proxy endpoint without readers",
+                export_name = "MyDBProxyReaderEndpoint"
+            )
+            
+            core.CfnOutput(self, "DBProxySecretArn",
+                value = db_proxy_secret.ref,
+                description = "Secret holding the web_user credentials the RDS Proxy accepts",
+                export_name = "DBProxySecretArn"
+            )
+            
+            if proxy_iam_auth:
+                core.CfnOutput(self, "DBProxyResourceId",
+                    value = db_proxy_resource_id,
+                    description = "RDS Proxy resource id, for rds-db:connect grants",
+                    export_name = "DBProxyResourceId"
+                )
\ No newline at end of file
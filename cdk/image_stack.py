@@ -0,0 +1,121 @@
+from aws_cdk import (
+    aws_iam as iam,
+    aws_imagebuilder as imagebuilder,
+    core
+    )
+
+from cdk import web_init, web_tuning
+from cdk.context import get_context
+
+
+class ImageStack(core.Stack):
+
+    def __init__(self, scope: core.Construct, id: str, **kwargs) -> None:
+        super().__init__(scope, id, **kwargs)
+
+        # Bake for the same instance profile as WebStack
+        profile = web_tuning.instance_profile(
+            get_context(self, "web_instance_profile", "burstable"),
+            instance_type = get_context(self, "web_instance_type"),
+            platform = get_context(self, "web_platform"))
+
+        # Parameters
+        LatestAmiId = core.CfnParameter(self, "LatestAmiId",
+            type = "AWS::SSM::Parameter::Value<AWS::EC2::Image::Id>",
+            default = profile["ami_parameter"]
+        )
+
+        # Image Builder components and recipes are immutable, bump this
+        # (cdk -c web_image_version=1.0.1) whenever the install steps change.
+        image_version = get_context(self, "web_image_version", "1.0.0")
+
+        # S3 Bucket
+        source_bucket = "sourcebucketname%s" % (core.Aws.ACCOUNT_ID)
+
+        # ImageBuilderRole
+        image_builder_role = iam.CfnRole(self, "ImageBuilderRole",
+            assume_role_policy_document = {
+                "Version": "2012-10-17",
+                "Statement": [
+                {
+                  "Effect": "Allow",
+                  "Principal": {
+                    "Service": [
+                      "ec2.amazonaws.com"
+                    ]
+                  },
+                  "Action": [
+                    "sts:AssumeRole"
+                  ]
+                }]
+            },
+            path = "/",
+            managed_policy_arns = [
+                "arn:aws:iam::aws:policy/EC2InstanceProfileForImageBuilder",
+                "arn:aws:iam::aws:policy/AmazonSSMManagedInstanceCore",
+                "arn:aws:iam::aws:policy/AmazonS3ReadOnlyAccess"
+            ]
+        )
+
+        # ImageBuilderInstanceProfile
+        image_builder_instance_profile = iam.CfnInstanceProfile(self, "ImageBuilderInstanceProfile",
+            path = "/",
+            roles = [image_builder_role.ref]
+        )
+
+        # WebServerComponent, generated from the same Init configs WebStack uses
+        web_server_component = imagebuilder.CfnComponent(self, "WebServerComponent",
+            name = "edx-web-server",
+            platform = "Linux",
+            version = image_version,
+            description = "Packages and application bundle for the web fleet",
+            data = self.to_json_string({
+                "name": "edx-web-server",
+                "schemaVersion": 1.0,
+                "phases": [{
+                    "name": "build",
+                    "steps": [{
+                        "name": "InstallAndBuild",
+                        "action": "ExecuteBash",
+                        "inputs": {
+                            "commands": web_init.bake_commands(source_bucket, profile["platform"], profile["architecture"])
+                        }
+                    }]
+                }]
+            })
+        )
+
+        # WebServerRecipe
+        web_server_recipe = imagebuilder.CfnImageRecipe(self, "WebServerRecipe",
+            name = "edx-web-server",
+            version = image_version,
+            parent_image = LatestAmiId.value_as_string,
+            components = [{
+                "componentArn" : web_server_component.attr_arn
+            }]
+        )
+
+        # WebServerInfrastructure
+        web_server_infrastructure = imagebuilder.CfnInfrastructureConfiguration(self, "WebServerInfrastructure",
+            name = "edx-web-server",
+            instance_profile_name = image_builder_instance_profile.ref,
+            instance_types = ["t3.small" if profile["architecture"] == "x86_64" else "t4g.small"],
+            subnet_id = core.Fn.import_value("PrivateSubnet1"),
+            security_group_ids = [core.Fn.import_value("WebSecurityGroupOutput")],
+            terminate_instance_on_failure = True
+        )
+
+        # WebServerPipeline, run on demand and pass the AMI to WebStack as web_ami_id
+        web_server_pipeline = imagebuilder.CfnImagePipeline(self, "WebServerPipeline",
+            name = "edx-web-server",
+            image_recipe_arn = web_server_recipe.attr_arn,
+            infrastructure_configuration_arn = web_server_infrastructure.attr_arn,
+            status = "ENABLED"
+        )
+
+        # Output
+        core.CfnOutput(self, "WebServerPipelineOutput",
+            value = web_server_pipeline.attr_arn,
+            description = "Web server image pipeline",
+            export_name = "WebServerPipeline"
+        )
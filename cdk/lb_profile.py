@@ -0,0 +1,91 @@
+"""Load-balancing profiles shared by the ALB and the web target groups.
+
+A profile holds the load balancer settings (HTTP/2, idle timeout) that
+CdnStack applies to the ALB and the target group settings (routing
+algorithm, slow start, deregistration delay, health checks, stickiness)
+that WebStack applies to the web target group. Both stacks read the same
+``lb_profile`` context, so WebStack can also size nginx's keepalive from
+the ALB's idle timeout.
+"""
+from cdk.context import get_context
+
+LB_PROFILES = {
+    # Round robin with 15s health checks, what the stacks used before profiles
+    "default": {
+        "http2": True,
+        "idle_timeout": 50,
+        "algorithm": "round_robin",
+        "slow_start": 0,
+        "deregistration_delay": 30,
+        "health_check_interval": 15,
+        "health_check_timeout": 10,
+        "healthy_threshold": 2,
+        "unhealthy_threshold": 2,
+        "stickiness": False,
+        "stickiness_duration": 86400,
+    },
+    # A new instance's share of requests ramps up over a minute once healthy
+    "slow-start": {
+        "algorithm": "round_robin",
+        "slow_start": 60,
+    },
+    # Each request goes to the target with the fewest in flight, so slow
+    # requests do not pile up on one node
+    "least-outstanding": {
+        "algorithm": "least_outstanding_requests",
+        "slow_start": 0,
+    },
+}
+
+
+def load_balancing_profile(scope):
+    """Settings for the ALB and its target group (cdk -c lb_profile=slow-start).
+
+    Named profiles only list what differs from ``default``; single values
+    can be changed with ``lb_profile_overrides``.
+    """
+    profile_name = get_context(scope, "lb_profile", "default")
+    if profile_name not in LB_PROFILES:
+        raise ValueError("Unknown lb_profile %r, expected one of %s"
+                         % (profile_name, ", ".join(sorted(LB_PROFILES))))
+    profile = dict(LB_PROFILES["default"], **LB_PROFILES[profile_name])
+    overrides = get_context(scope, "lb_profile_overrides", {})
+    unknown = set(overrides) - set(profile)
+    if unknown:
+        raise ValueError("Unknown lb_profile_overrides keys: %s" % ", ".join(sorted(unknown)))
+    profile.update(overrides)
+
+    if profile["algorithm"] not in ("round_robin", "least_outstanding_requests"):
+        raise ValueError("algorithm must be 'round_robin' or 'least_outstanding_requests', got %r"
+                         % (profile["algorithm"],))
+    if profile["slow_start"] and not 30 <= profile["slow_start"] <= 900:
+        raise ValueError("slow_start must be 0 or between 30 and 900 seconds, got %r" % (profile["slow_start"],))
+    if profile["slow_start"] and profile["algorithm"] == "least_outstanding_requests":
+        raise ValueError("Target groups cannot combine slow_start with least_outstanding_requests")
+    if profile["health_check_timeout"] >= profile["health_check_interval"]:
+        raise ValueError("health_check_timeout must be shorter than health_check_interval")
+    return profile
+
+
+def load_balancer_attributes(profile):
+    """``LoadBalancerAttributes`` of the ALB for ``profile``."""
+    return [
+        {"key": "idle_timeout.timeout_seconds", "value": str(profile["idle_timeout"])},
+        {"key": "routing.http2.enabled", "value": str(profile["http2"]).lower()}
+    ]
+
+
+def target_group_attributes(profile):
+    """``TargetGroupAttributes`` for ``profile``; the cookie settings only when sticky."""
+    attributes = [
+        {"key": "deregistration_delay.timeout_seconds", "value": str(profile["deregistration_delay"])},
+        {"key": "load_balancing.algorithm.type", "value": profile["algorithm"]},
+        {"key": "slow_start.duration_seconds", "value": str(profile["slow_start"])},
+        {"key": "stickiness.enabled", "value": str(profile["stickiness"]).lower()}
+    ]
+    if profile["stickiness"]:
+        attributes += [
+            {"key": "stickiness.type", "value": "lb_cookie"},
+            {"key": "stickiness.lb_cookie.duration_seconds", "value": str(profile["stickiness_duration"])}
+        ]
+    return attributes
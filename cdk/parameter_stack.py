@@ -3,6 +3,8 @@ from aws_cdk import (
     core
     )
 
+from cdk.context import get_context
+
 class ParametersStack(core.Stack):
 
     def __init__(self, scope: core.Construct, id: str, **kwargs) -> None:
@@ -31,8 +33,19 @@ class ParametersStack(core.Stack):
         )
         MyDBEndpoint = core.CfnParameter(self,"MyDBEndpoint",
             type = "String",
+            description = "DBStack MyDBEndpoint output, or MyDBProxyEndpoint when the proxy is enabled",
             default = "MyDBEndpoint"
         )
+        MyDBReaderEndpoint = core.CfnParameter(self,"MyDBReaderEndpoint",
+            type = "String",
+            description = "DBStack MyDBReaderEndpoint output, or MyDBProxyReaderEndpoint, used for read-heavy queries",
+            default = "MyDBReaderEndpoint"
+        )
+        CacheEndpoint = core.CfnParameter(self,"CacheEndpoint",
+            type = "String",
+            description = "CacheStack CacheEndpoint output",
+            default = "CacheEndpoint"
+        )
         ImageS3Bucket = core.CfnParameter(self,"ImageS3Bucket",
             type = "String",
             default = "ImageS3Bucket"
@@ -82,17 +95,33 @@ class ParametersStack(core.Stack):
             type = "String",
             value = MyDBEndpoint.value_as_string
         )
+        # DBReaderHostParameter
+        DBReaderHostParameter = ssm.CfnParameter(self,"DBReaderHostParameter",
+            name ="edx-DATABASE_READER_HOST",
+            type = "String",
+            value = MyDBReaderEndpoint.value_as_string
+        )
+        # CacheHostParameter
+        CacheHostParameter = ssm.CfnParameter(self,"CacheHostParameter",
+            name ="edx-CACHE_HOST",
+            type = "String",
+            value = CacheEndpoint.value_as_string
+        )
         # DBUserParameter
         DBUserParameter = ssm.CfnParameter(self,"DBUserParameter",
             name ="edx-DATABASE_USER",
             type = "String",
             value = "web_user"
         )
-        # DBPasswordParameter
+        # DBPasswordParameter, behind the RDS Proxy web_user signs in with the
+        # password DBStack generated for it (cdk -c db_proxy_enabled=true)
+        db_password = DBPassword_parameters.value_as_string
+        if get_context(self, "db_proxy_enabled", False):
+            db_password = "{{resolve:secretsmanager:%s:SecretString:password}}" % (core.Fn.import_value("DBProxySecretArn"))
         DBPasswordParameter = ssm.CfnParameter(self,"DBPasswordParameter",
             name ="edx-DATABASE_PASSWORD",
             type = "String",
-            value = DBPassword_parameters.value_as_string
+            value = db_password
         )
         # DBNameParameter
         DBNameParameter = ssm.CfnParameter(self,"DBNameParameter",
@@ -0,0 +1,63 @@
+import importlib
+
+# Stack id, module, class and the stacks whose exports it imports, in
+# deploy order. `python -m tools.graph` compares this list with the imports
+# found in the synthesized templates and fails on any it leaves out.
+STACKS = [
+    # VPC, PublicSubnet1 and EdxProjectCloud9Sg for the nested stack parameters
+    ("cdk", "cdk.cdk_stack", "CdkStack", ["VpcStack", "Cloud9Stack"]),
+    ("VpcStack", "cdk.vpc_stack", "VpcStack", []),
+    ("IAMStack", "cdk.iam_stack", "IAMStack", []),
+    ("CognitoStack", "cdk.cognito_stack", "CognitoStack", []),
+    ("SecurityStack", "cdk.security_stack", "SecurityStack", ["VpcStack"]),
+    ("Cloud9Stack", "cdk.cloud9_stack", "Cloud9Stack", ["VpcStack"]),
+    ("CdnStack", "cdk.cdn_stack", "CdnStack", ["VpcStack", "SecurityStack"]),
+    ("DBStack", "cdk.db_stack", "DBStack", ["VpcStack", "SecurityStack", "Cloud9Stack"]),
+    # Only imports DBProxySecretArn with db_proxy_enabled
+    ("ParametersStack", "cdk.parameter_stack", "ParametersStack", ["DBStack"]),
+    ("CacheStack", "cdk.cache_stack", "CacheStack", ["VpcStack", "SecurityStack"]),
+    ("SnssqsStack", "cdk.snssqs_stack", "SnssqsStack", ["VpcStack", "SecurityStack", "CdnStack", "DBStack", "CacheStack"]),
+    ("WebStack", "cdk.web_stack", "WebStack", ["VpcStack", "SecurityStack", "CdnStack"]),
+    ("ImageStack", "cdk.image_stack", "ImageStack", ["VpcStack", "SecurityStack"]),
+]
+
+
+def resolve(names, with_dependencies=True):
+    """Stack ids to build for ``names`` (all stacks when empty), in registry order."""
+    entries = {stack_id: dependencies for stack_id, _, _, dependencies in STACKS}
+    if not names:
+        return list(entries)
+    unknown = [name for name in names if name not in entries]
+    if unknown:
+        raise KeyError("Unknown stacks %s, expected some of %s" % (", ".join(unknown), ", ".join(entries)))
+    selected = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name in selected:
+            continue
+        selected.add(name)
+        if with_dependencies:
+            pending.extend(entries[name])
+    return [stack_id for stack_id in entries if stack_id in selected]
+
+
+def build(app, names=None, with_dependencies=True):
+    """Import and construct only the stacks in ``resolve(names)``; returns them by id."""
+    wanted = set(resolve(names, with_dependencies))
+    stacks = {}
+    for stack_id, module, class_name, _ in STACKS:
+        if stack_id in wanted:
+            stack_class = getattr(importlib.import_module(module), class_name)
+            stacks[stack_id] = stack_class(app, stack_id)
+    return stacks
+
+
+def requested_stacks(app):
+    """Stack ids from ``cdk -c stacks=CdnStack,WebStack`` (a list in cdk.json also works)."""
+    value = app.node.try_get_context("stacks")
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    return [name.strip() for name in value if name.strip()]
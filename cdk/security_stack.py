@@ -4,6 +4,8 @@ from aws_cdk import (
     core
     )
 
+from cdk.context import get_context
+
 class SecurityStack(core.Stack):
 
   def __init__(self, scope: core.Construct, id: str, **kwargs) -> None:
@@ -86,17 +88,27 @@ class SecurityStack(core.Stack):
     )
     
     # WebSecurityGroup
+    # With cdn_origin_mode=alb, the CloudFront origin-facing prefix list of the
+    # region (cdk -c cloudfront_prefix_list_id=pl-...) can replace 0.0.0.0/0.
+    cloudfront_prefix_list_id = get_context(self, "cloudfront_prefix_list_id")
+    if cloudfront_prefix_list_id and get_context(self, "cdn_origin_mode", "apigateway") != "alb":
+      # API Gateway reaches the ALB from addresses outside the prefix list
+      raise ValueError("cloudfront_prefix_list_id needs cdn_origin_mode=alb, "
+                       "API Gateway does not connect from CloudFront addresses")
+    if cloudfront_prefix_list_id:
+      http_source = {"sourcePrefixListId" : cloudfront_prefix_list_id}
+    else:
+      http_source = {"cidrIp" : "0.0.0.0/0"}
     web_security_group = ec2.CfnSecurityGroup(self, "WebSecurityGroup",
       group_name = "web-server-sg",
       group_description =  "HTTP traffic",
       vpc_id = core.Fn.import_value("VPC"),
       security_group_ingress = [
-        {
+        dict({
           "ipProtocol" : "tcp",
           "fromPort" : 80,
-          "toPort" : 80,
-          "cidrIp" : "0.0.0.0/0"
-        }
+          "toPort" : 80
+        }, **http_source)
       ],
       security_group_egress = [
         {
@@ -108,6 +120,16 @@ class SecurityStack(core.Stack):
       ],
     )
     
+    if cloudfront_prefix_list_id:
+      # The ALB and the web instances share the group, keep ALB -> instance traffic
+      web_security_group_self_ingress = ec2.CfnSecurityGroupIngress(self, "WebSecurityGroupSelfIngress",
+        group_id = web_security_group.ref,
+        ip_protocol = "tcp",
+        from_port = 80,
+        to_port = 80,
+        source_security_group_id = web_security_group.ref
+      )
+    
     # LambdaSecurityGroup
     lambda_security_group = ec2.CfnSecurityGroup(self, "LambdaSecurityGroup",
       group_name = "labels-lambda-sg",
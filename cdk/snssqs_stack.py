@@ -1,3 +1,6 @@
+import hashlib
+import json
+
 from aws_cdk import (
     aws_sns as sns,
     aws_iam as iam,
@@ -7,6 +10,9 @@ from aws_cdk import (
     core
 )
 
+from cdk.context import get_context
+from cdk.vpc_stack import subnet_ids
+
 
 class SnssqsStack(core.Stack):
 
@@ -24,6 +30,42 @@ class SnssqsStack(core.Stack):
             default = "DBPassword"
         )
         
+        # UploadQueue consumer batching (cdk -c labels_batch_size=50)
+        batch_size = get_context(self, "labels_batch_size", 10)
+        batching_window = get_context(self, "labels_batching_window", 5)
+        max_receive_count = get_context(self, "labels_max_receive_count", 5)
+        # Every LabelsLambda execution holds a DB connection, cap them to what Aurora absorbs
+        reserved_concurrency = get_context(self, "labels_reserved_concurrency", 10)
+        provisioned_concurrency = get_context(self, "labels_provisioned_concurrency", 0)
+        # DBStack settings: behind the RDS Proxy web_user signs in with the proxy's
+        # generated secret, and with IAM auth the role needs rds-db:connect
+        db_proxy_enabled = get_context(self, "db_proxy_enabled", False)
+        db_proxy_iam_auth = get_context(self, "db_proxy_iam_auth", False)
+        # S3 object version of lambda.zip, so a new upload updates the function code
+        code_version = get_context(self, "labels_code_version", "")
+        if provisioned_concurrency > reserved_concurrency:
+            raise ValueError("labels_provisioned_concurrency (%d) exceeds labels_reserved_concurrency (%d)"
+                             % (provisioned_concurrency, reserved_concurrency))
+        
+        lambda_policy_statements = [
+        {
+          "Effect": "Allow",
+          "Action" : [
+            "logs:*"
+          ],
+            "Resource": "arn:aws:logs:*:*:*"
+        },
+        ]
+        if db_proxy_enabled and db_proxy_iam_auth:
+            lambda_policy_statements.append({
+              "Effect": "Allow",
+              "Action" : [
+                "rds-db:connect"
+              ],
+                "Resource": "arn:aws:rds-db:%s:%s:dbuser:%s/web_user" % (
+                    core.Aws.REGION, core.Aws.ACCOUNT_ID, core.Fn.import_value("DBProxyResourceId"))
+            })
+        
         # LambdaExecutionRole
         LambdaExecutionRole = iam.CfnRole(self, "LabelsLambdaExecutionRole",
             assume_role_policy_document = {
@@ -43,6 +85,7 @@ class SnssqsStack(core.Stack):
             },
             managed_policy_arns = [
                 "arn:aws:iam::aws:policy/service-role/AWSLambdaVPCAccessExecutionRole",
+                "arn:aws:iam::aws:policy/service-role/AWSLambdaSQSQueueExecutionRole",
                 "arn:aws:iam::aws:policy/AmazonRekognitionReadOnlyAccess",
                 "arn:aws:iam::aws:policy/AmazonS3ReadOnlyAccess",
                 "arn:aws:iam::aws:policy/AWSXrayWriteOnlyAccess"
@@ -52,56 +95,94 @@ class SnssqsStack(core.Stack):
                 "policyName" : "root",
                 "policyDocument" : {
                 "Version":"2012-10-17",
-                "Statement" : [
-                {
-                  "Effect": "Allow",
-                  "Action" : [
-                    "logs:*"
-                  ],
-                    "Resource": "arn:aws:logs:*:*:*"
-                },
-                ]}
+                "Statement" : lambda_policy_statements
+                }
             }]
         )
         
         # S3 Bucket
         source_bucket = "sourcebucketname%s" % (core.Aws.ACCOUNT_ID) 
         
+        db_host = core.Fn.import_value("MyDBEndpoint")
+        db_password = db_password_parameters.value_as_string
+        if db_proxy_enabled:
+            db_host = core.Fn.import_value("MyDBProxyEndpoint")
+            db_password = "{{resolve:secretsmanager:%s:SecretString:password}}" % (core.Fn.import_value("DBProxySecretArn"))
+        
         # LabelsLambda
+        labels_code = {
+            "s3Bucket" : source_bucket,
+            "s3Key" : "lambda.zip"
+        }
+        if code_version:
+            labels_code["s3ObjectVersion"] = code_version
         LabelsLambda = lambda_.CfnFunction(self, "LabelsLambda",
             handler = "lambda_function.lambda_handler",
             role = LambdaExecutionRole.attr_arn,
-            code = {
-                "s3Bucket" : source_bucket,
-                "s3Key" : "lambda.zip"
-            },
+            code = labels_code,
             runtime = "python3.6",
             timeout = 120,
+            reserved_concurrent_executions = reserved_concurrency,
             tracing_config = {
                 "mode" : "Active"
             },
             vpc_config = {
                 "securityGroupIds" : [core.Fn.import_value("LambdaSecurityGroupOutput")],
-                "subnetIds" : [
-                    core.Fn.import_value("PrivateSubnet1"),
-                    core.Fn.import_value("PrivateSubnet2")
-                ]
+                "subnetIds" : subnet_ids("Private")
             },
             environment = {
                 "variables" : {
-                    "DATABASE_HOST" : core.Fn.import_value("MyDBEndpoint"),
+                    "DATABASE_HOST" : db_host,
                     "DATABASE_USER" : "web_user",
-                    "DATABASE_PASSWORD" : db_password_parameters.value_as_string,
-                    "DATABASE_DB_NAME" : "Photos"
+                    "DATABASE_PASSWORD" : db_password,
+                    "DATABASE_DB_NAME" : "Photos",
+                    "CACHE_HOST" : core.Fn.import_value("CacheEndpoint")
                 }
             }
         )
         
+        labels_lambda_target = LabelsLambda.ref
+        if provisioned_concurrency:
+            # LabelsLambdaVersion, publishes the current code so an alias can keep it warm.
+            # Its logical id follows the function code and configuration so that a
+            # change to them publishes a new version for the alias
+            function_hash = hashlib.sha256(json.dumps(self.resolve([
+                LabelsLambda.code, LabelsLambda.handler, LabelsLambda.runtime,
+                LabelsLambda.timeout, LabelsLambda.environment, LabelsLambda.vpc_config,
+                LabelsLambda.tracing_config
+            ]), sort_keys = True).encode()).hexdigest()[:8]
+            labels_lambda_version = lambda_.CfnVersion(self, "LabelsLambdaVersion%s" % (function_hash),
+                function_name = LabelsLambda.ref,
+                description = "LabelsLambda %s" % (function_hash)
+            )
+            
+            # LabelsLambdaAlias
+            labels_lambda_alias = lambda_.CfnAlias(self, "LabelsLambdaAlias",
+                name = "live",
+                function_name = LabelsLambda.ref,
+                function_version = labels_lambda_version.attr_version,
+                provisioned_concurrency_config = {
+                    "provisionedConcurrentExecutions" : provisioned_concurrency
+                }
+            )
+            labels_lambda_target = labels_lambda_alias.ref
+        
+        # UploadDeadLetterQueue
+        upload_dead_letter_queue = sqs.CfnQueue(self, "UploadDeadLetterQueue",
+            queue_name = "uploads-dlq",
+            message_retention_period = 1209600
+        )
+        
         # UploadQueue
         upload_queue = sqs.CfnQueue(self, "UploadQueue", 
             queue_name = "uploads-queue",
             message_retention_period = 12800,
-            visibility_timeout = 300
+            # At least six times the LabelsLambda timeout, as Lambda recommends for SQS sources
+            visibility_timeout = 720,
+            redrive_policy = {
+                "deadLetterTargetArn" : upload_dead_letter_queue.attr_arn,
+                "maxReceiveCount" : max_receive_count
+            }
         )
         
         # UploadSNSTopic
@@ -110,13 +191,18 @@ class SnssqsStack(core.Stack):
             subscription = [{
                 "endpoint" : upload_queue.attr_arn,
                 "protocol" : "sqs"
-            },
-            {
-                "endpoint" : LabelsLambda.attr_arn,
-                "protocol" : "lambda"
             }],
         )
         
+        # UploadQueueEventSourceMapping, LabelsLambda drains the queue in batches
+        upload_queue_event_source_mapping = lambda_.CfnEventSourceMapping(self, "UploadQueueEventSourceMapping",
+            event_source_arn = upload_queue.attr_arn,
+            function_name = labels_lambda_target,
+            batch_size = batch_size,
+            maximum_batching_window_in_seconds = batching_window,
+            function_response_types = ["ReportBatchItemFailures"]
+        )
+        
         # QueuePolicy
         queue_policy = sqs.CfnQueuePolicy(self, "QueuePolicy", 
             queues = [upload_queue.ref],
@@ -189,14 +275,25 @@ class SnssqsStack(core.Stack):
         image_s3_bucket.add_depends_on(upload_topic_policy)
         image_s3_bucket.apply_removal_policy(core.RemovalPolicy.DESTROY)
 
-        # ImageS3BucketPermission
-        ImageS3BucketPermission = lambda_.CfnPermission(self, "ImageS3BucketPermission",
-          action = "lambda:InvokeFunction",
-          function_name = LabelsLambda.attr_arn,
-          principal = "sns.amazonaws.com",
-          source_arn = upload_sns_topic.ref
+        # ImageS3BucketPolicy, lets CloudFront serve images without going through the web fleet
+        image_s3_bucket_policy = s3.CfnBucketPolicy(self, "ImageS3BucketPolicy",
+            bucket = image_s3_bucket.ref,
+            policy_document = {
+                "Version" : "2012-10-17",
+                "Statement" : [{
+                    "Sid" : "Allow-CloudFront-GetObject",
+                    "Effect" : "Allow",
+                    "Principal" : {
+                        "CanonicalUser" : core.Fn.import_value("MediaOriginAccessIdentity")
+                    },
+                    "Action" : [
+                        "s3:GetObject"
+                    ],
+                    "Resource" : "%s/*" % (image_s3_bucket.attr_arn)
+                }]
+            }
         )
-        
+
         # Outputs
         core.CfnOutput(self, "ImageS3BucketOutput",
             value = image_s3_bucket.ref,
@@ -204,6 +301,12 @@ class SnssqsStack(core.Stack):
             export_name = "ImageS3Bucket"
         )
         
+        core.CfnOutput(self, "UploadDeadLetterQueueOutput",
+            value = upload_dead_letter_queue.ref,
+            description = "Uploads that LabelsLambda failed to process",
+            export_name = "UploadDeadLetterQueue"
+        )
+        
         core.CfnOutput(self, "LabelsLambdaOutput",
             value = LabelsLambda.ref,
             description = "Labels Lambda",
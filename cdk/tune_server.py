@@ -0,0 +1,164 @@
+"""Scale the bundle's nginx.conf and uwsgi.conf to the instance.
+
+cfn-init installs this file on the web servers (see ``cdk/web_init.py``) and
+runs it against the copies shipped in ``deploy-app.zip``. What the app
+depends on stays exactly as the bundle has it: the uwsgi module, socket and
+options, nginx's server and location blocks. Only worker counts, backlogs,
+timeouts and buffer sizes are set, from the JSON that
+``web_tuning.server_tuning`` produces::
+
+    python3 tune_server.py tuning.json --nginx nginx.conf /etc/nginx/nginx.conf \\
+        --uwsgi uwsgi.conf /etc/init/uwsgi.conf [--systemd]
+
+nginx directives the bundle sets are rewritten in place, missing ones are
+added to the right block. uwsgi options are appended to the job's ``exec``
+line, where they override the same options given earlier on it or in an
+ini file it loads. ``--systemd`` turns the bundle's upstart job into a
+systemd unit running the same command, for Amazon Linux 2.
+"""
+import argparse
+import json
+import re
+import sys
+
+# nginx directive -> (block it goes in when the bundle lacks it, tuning key)
+NGINX_DIRECTIVES = [
+    ("worker_processes", None, "nginx_worker_processes"),
+    ("worker_rlimit_nofile", None, None),
+    ("worker_connections", "events", "nginx_worker_connections"),
+    ("keepalive_timeout", "http", "keepalive_timeout"),
+    ("client_max_body_size", "http", "client_max_body_size"),
+    ("client_body_buffer_size", "http", "client_body_buffer_size"),
+    ("uwsgi_read_timeout", "http", "uwsgi_harakiri"),
+    ("uwsgi_buffer_size", "http", "uwsgi_buffer_size"),
+    ("uwsgi_buffers", "http", "uwsgi_buffers"),
+]
+
+# uwsgi option -> tuning key
+UWSGI_OPTIONS = [
+    ("processes", "uwsgi_processes"),
+    ("threads", "uwsgi_threads"),
+    ("listen", "uwsgi_listen"),
+    ("harakiri", "uwsgi_harakiri"),
+    ("buffer-size", "uwsgi_header_buffer_size"),
+]
+
+
+def nginx_values(tuning):
+    values = {}
+    for name, _, key in NGINX_DIRECTIVES:
+        values[name] = tuning[key] if key else 2 * tuning["nginx_worker_connections"]
+    return values
+
+
+def set_directive(text, name, value, block=None):
+    """Set every ``name`` directive in ``text`` to ``value``, or add one to ``block``."""
+    pattern = re.compile(r"(^|[{;])([ \t]*)%s[ \t]+[^;]*;" % re.escape(name), re.M)
+    replacement = "%s %s;" % (name, value)
+    if pattern.search(text):
+        return pattern.sub(lambda match: match.group(1) + match.group(2) + replacement, text)
+    if block is None:
+        return "%s\n%s" % (replacement, text)
+    opening = re.search(r"(^|[;}\s])%s\s*\{" % re.escape(block), text)
+    if opening is None:
+        raise ValueError("nginx.conf has no %s block for %s" % (block, name))
+    return "%s\n    %s%s" % (text[:opening.end()], replacement, text[opening.end():])
+
+
+def tune_nginx(text, tuning):
+    values = nginx_values(tuning)
+    for name, block, _ in NGINX_DIRECTIVES:
+        text = set_directive(text, name, values[name], block)
+    return text
+
+
+def upstart_stanzas(text):
+    """``(stanza, value)`` pairs of an upstart job, continuation lines joined."""
+    stanzas = []
+    for line in re.sub(r"\\\n", " ", text).splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            stanza, _, value = line.partition(" ")
+            stanzas.append((stanza, value.strip()))
+    return stanzas
+
+
+def uwsgi_args(tuning):
+    return " ".join("--%s %s" % (option, tuning[key]) for option, key in UWSGI_OPTIONS)
+
+
+def tune_upstart(text, tuning):
+    """Append the tuned options to the ``exec`` line of the bundle's upstart job."""
+    joined = re.sub(r"\\\n", " ", text)
+    pattern = re.compile(r"^([ \t]*exec[ \t]+.*?)[ \t]*$", re.M)
+    if not pattern.search(joined):
+        raise ValueError("uwsgi.conf has no exec line")
+    return pattern.sub(lambda match: "%s %s" % (match.group(1), uwsgi_args(tuning)), joined, count=1)
+
+
+def systemd_unit(text, tuning):
+    """A systemd unit running what the bundle's upstart job ``exec``s, tuned."""
+    stanzas = upstart_stanzas(text)
+    commands = [value for stanza, value in stanzas if stanza == "exec"]
+    if not commands:
+        raise ValueError("uwsgi.conf has no exec line")
+    command = "%s %s" % (commands[0], uwsgi_args(tuning))
+    if not command.startswith("/"):
+        command = "/usr/bin/env " + command
+    service = ["Type=simple", "ExecStart=%s" % command, "Restart=always"]
+    kill_signal = "SIGQUIT"
+    for stanza, value in stanzas:
+        if stanza == "chdir":
+            service.append("WorkingDirectory=%s" % value)
+        elif stanza == "env":
+            service.append("Environment=%s" % value)
+        elif stanza == "setuid":
+            service.append("User=%s" % value)
+        elif stanza == "setgid":
+            service.append("Group=%s" % value)
+        elif stanza == "kill" and value.startswith("signal "):
+            kill_signal = value.split()[1]
+            if not kill_signal.startswith("SIG"):
+                kill_signal = "SIG" + kill_signal
+    # uwsgi reloads on SIGTERM, SIGQUIT shuts it down
+    service.append("KillSignal=%s" % kill_signal)
+    return "\n".join([
+        "[Unit]",
+        "Description=uWSGI serving the photos app",
+        "After=network.target",
+        "",
+        "[Service]",
+    ] + service + [
+        "",
+        "[Install]",
+        "WantedBy=multi-user.target",
+        ""
+    ])
+
+
+def rewrite(source, target, transform):
+    with open(source) as fp:
+        text = fp.read()
+    text = transform(text)
+    with open(target, "w") as fp:
+        fp.write(text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("tuning", help="JSON written from web_tuning.server_tuning")
+    parser.add_argument("--nginx", nargs=2, metavar=("SOURCE", "TARGET"), required=True)
+    parser.add_argument("--uwsgi", nargs=2, metavar=("SOURCE", "TARGET"), required=True)
+    parser.add_argument("--systemd", action="store_true", help="write the uwsgi job as a systemd unit")
+    args = parser.parse_args(argv)
+
+    with open(args.tuning) as fp:
+        tuning = json.load(fp)
+    rewrite(args.nginx[0], args.nginx[1], lambda text: tune_nginx(text, tuning))
+    rewrite(args.uwsgi[0], args.uwsgi[1],
+            lambda text: systemd_unit(text, tuning) if args.systemd else tune_upstart(text, tuning))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,41 @@ from aws_cdk import (
     core
     )
 from datetime import datetime
+import ipaddress
+import string
+
+from cdk.context import get_context
+
+
+def subnet_ids(tier):
+    """Subnet IDs exported by VpcStack for ``tier`` ("Public", "Private" or "Data")."""
+    return core.Fn.split(",", core.Fn.import_value("%sSubnets" % (tier)))
+
+
+def data_tier(scope):
+    """Tier that holds Aurora and ElastiCache: "Data" when VpcStack builds it, else "Private"."""
+    return "Data" if get_context(scope, "vpc_data_subnets", False) else "Private"
+
+
+def allocate_subnets(cidr, masks):
+    """Carve consecutive, aligned subnets with the given prefix lengths out of ``cidr``.
+
+    The first block of the VPC is left unused, so two AZs of /24s keep the
+    original 10.1.1.0/24 - 10.1.4.0/24 layout.
+    """
+    network = ipaddress.ip_network(cidr)
+    cursor = int(network.network_address) + 2 ** (32 - masks[0])
+    subnets = []
+    for mask in masks:
+        size = 2 ** (32 - mask)
+        cursor = (cursor + size - 1) // size * size
+        subnet = ipaddress.ip_network((cursor, mask))
+        if not subnet.subnet_of(network):
+            raise ValueError("%s does not fit %d subnets of %s" % (cidr, len(masks), masks))
+        subnets.append(str(subnet))
+        cursor += size
+    return subnets
+
 
 class VpcStack(core.Stack):
 
@@ -24,10 +59,24 @@ class VpcStack(core.Stack):
         # core.Tag.add(vpc.private_subnets[0], key = "Name", value = "edx-subnet-public-a") 
         # core.Tag.add(vpc.private_subnets[1], key = "Name", value = "edx-subnet-public-b")
         
+        # Layout (cdk -c vpc_az_count=3 -c vpc_private_subnet_mask=22)
+        vpc_cidr = get_context(self, "vpc_cidr", "10.1.0.0/16")
+        az_count = get_context(self, "vpc_az_count", 2)
+        public_mask = get_context(self, "vpc_public_subnet_mask", 24)
+        private_mask = get_context(self, "vpc_private_subnet_mask", 24)
+        # Optional third tier for Aurora and ElastiCache
+        data_subnets = get_context(self, "vpc_data_subnets", False)
+        data_mask = get_context(self, "vpc_data_subnet_mask", 24)
+        
+        tiers = [("Public", public_mask), ("Private", private_mask)]
+        if data_subnets:
+            tiers.append(("Data", data_mask))
+        cidrs = iter(allocate_subnets(vpc_cidr, [mask for tier, mask in tiers for index in range(az_count)]))
+        
         # Exercise 3
         # Create VPC
         vpc = ec2.CfnVPC(self, "VPC",
-            cidr_block = "10.1.0.0/16",
+            cidr_block = vpc_cidr,
             tags = [{
                 "key" : "Name",
                 "value" : "edx-build-aws-vpc"
@@ -48,84 +97,6 @@ class VpcStack(core.Stack):
             internet_gateway_id = internet_gateway.ref
         )
         
-        # Create EIP1
-        eip_1 = ec2.CfnEIP(self, "EIP1",
-            domain = "vpc"
-        )
-        
-        # Create Public Subnet 1
-        public_subnet_1 = ec2.CfnSubnet(self, "PublicSubnet1",
-            availability_zone = core.Fn.select(0,core.Fn.get_azs(core.Aws.REGION)),
-            cidr_block = "10.1.1.0/24",
-            vpc_id = vpc.ref,
-            map_public_ip_on_launch = True,
-            tags = [{
-                "key" : "Name",
-                "value" : "edx-subnet-public-a"
-            }]
-        )
-
-        # Create Nat Gateway 1
-        nat_gateway_1 = ec2.CfnNatGateway(self, "NatGateway1",
-            allocation_id = eip_1.attr_allocation_id, 
-            subnet_id = public_subnet_1.ref
-        )
-        
-        # Create Private Route Table 1
-        private_route_table_1 = ec2.CfnRouteTable(self, "PrivateRouteTable1",
-            vpc_id = vpc.ref,
-            tags = [{
-                "key" : "Name",
-                "value" : "edx-routetable-private1"
-            }]
-        )
-        
-        # Create Private Route 1
-        private_route_1 = ec2.CfnRoute(self, "PrivateRoute1",
-            route_table_id = private_route_table_1.ref,
-            destination_cidr_block = "0.0.0.0/0",
-            nat_gateway_id = nat_gateway_1.ref
-        )
-        
-        # Create EIP2
-        eip_2 = ec2.CfnEIP(self, "EIP2",
-            domain = "vpc"
-        )
-        
-        # Create Public Subnet 2
-        public_subnet_2 = ec2.CfnSubnet(self, "PublicSubnet2",
-            availability_zone = core.Fn.select(1,core.Fn.get_azs(core.Aws.REGION)),
-            cidr_block = "10.1.2.0/24",
-            vpc_id = vpc.ref,
-            map_public_ip_on_launch = True,
-            tags = [{
-                "key" : "Name",
-                "value" : "edx-subnet-public-b"
-            }]
-        )
-        
-        # Create Nat Gateway 2
-        nat_gateway_2 = ec2.CfnNatGateway(self, "NatGateway2",
-            allocation_id = eip_2.attr_allocation_id, 
-            subnet_id = public_subnet_2.ref
-        )
-        
-        # Create Private Route Table 2
-        private_route_table_2 = ec2.CfnRouteTable(self, "PrivateRouteTable2",
-            vpc_id = vpc.ref,
-            tags = [{
-                "key" : "Name",
-                "value" : "edx-routetable-private2"
-            }]
-        )
-        
-        # Create Private Route 2
-        private_route_2 = ec2.CfnRoute(self, "PrivateRoute2",
-            route_table_id = private_route_table_2.ref,
-            destination_cidr_block = "0.0.0.0/0",
-            nat_gateway_id = nat_gateway_2.ref
-        )
-        
         # Create Public Route Table
         public_route_table = ec2.CfnRouteTable(self, "PublicRouteTable",
         vpc_id = vpc.ref,
@@ -142,51 +113,112 @@ class VpcStack(core.Stack):
             gateway_id = internet_gateway.ref
         )
         
-        # Create Public Route Association 1
-        public_route_association_1 = ec2.CfnSubnetRouteTableAssociation(self, "PublicRouteAssociation1",
-            route_table_id = public_route_table.ref,
-            subnet_id = public_subnet_1.ref
-        )
-        
-        # Create Public Route Association 12
-        public_route_association_2 = ec2.CfnSubnetRouteTableAssociation(self, "PublicRouteAssociation2",
-            route_table_id = public_route_table.ref,
-            subnet_id = public_subnet_2.ref
-        )
-        
-        # Create Private Subnet 1
-        private_subnet_1 = ec2.CfnSubnet(self, "PrivateSubnet1",
-            availability_zone = core.Fn.select(0,core.Fn.get_azs(core.Aws.REGION)),
-            cidr_block = "10.1.3.0/24",
+        subnets = {tier: [] for tier, mask in tiers}
+        private_route_tables = []
+        for tier, mask in tiers:
+            for index in range(az_count):
+                number = index + 1
+                letter = string.ascii_lowercase[index]
+                
+                # Create <Tier> Subnet N
+                subnet = ec2.CfnSubnet(self, "%sSubnet%d" % (tier, number),
+                    availability_zone = core.Fn.select(index, core.Fn.get_azs(core.Aws.REGION)),
+                    cidr_block = next(cidrs),
+                    vpc_id = vpc.ref,
+                    map_public_ip_on_launch = True if tier == "Public" else None,
+                    tags = [{
+                        "key" : "Name",
+                        "value" : "edx-subnet-%s-%s" % (tier.lower(), letter)
+                    }]
+                )
+                subnets[tier].append(subnet)
+        
+        for index in range(az_count):
+            number = index + 1
+            
+            # Create Public Route Association N
+            public_route_association = ec2.CfnSubnetRouteTableAssociation(self, "PublicRouteAssociation%d" % (number),
+                route_table_id = public_route_table.ref,
+                subnet_id = subnets["Public"][index].ref
+            )
+            
+            # Create EIP N
+            eip = ec2.CfnEIP(self, "EIP%d" % (number),
+                domain = "vpc"
+            )
+            
+            # Create Nat Gateway N
+            nat_gateway = ec2.CfnNatGateway(self, "NatGateway%d" % (number),
+                allocation_id = eip.attr_allocation_id, 
+                subnet_id = subnets["Public"][index].ref
+            )
+            
+            # Create Private Route Table N
+            private_route_table = ec2.CfnRouteTable(self, "PrivateRouteTable%d" % (number),
+                vpc_id = vpc.ref,
+                tags = [{
+                    "key" : "Name",
+                    "value" : "edx-routetable-private%d" % (number)
+                }]
+            )
+            private_route_tables.append(private_route_table)
+            
+            # Create Private Route N
+            private_route = ec2.CfnRoute(self, "PrivateRoute%d" % (number),
+                route_table_id = private_route_table.ref,
+                destination_cidr_block = "0.0.0.0/0",
+                nat_gateway_id = nat_gateway.ref
+            )
+            
+            # Create Private (and Data) Route Association N
+            for tier in subnets:
+                if tier == "Public":
+                    continue
+                ec2.CfnSubnetRouteTableAssociation(self, "%sRouteAssociation%d" % (tier, number),
+                    route_table_id = private_route_table.ref,
+                    subnet_id = subnets[tier][index].ref
+                )
+        
+        # Create S3 Gateway Endpoint, keeps bucket traffic off the NAT gateways
+        s3_gateway_endpoint = ec2.CfnVPCEndpoint(self, "S3GatewayEndpoint",
+            service_name = "com.amazonaws.%s.s3" % (core.Aws.REGION),
+            vpc_endpoint_type = "Gateway",
             vpc_id = vpc.ref,
-            tags = [{
-                "key" : "Name",
-                "value" : "edx-subnet-private-a"
-            }]
-        )
-        
-        # Create Private Subnet 2
-        private_subnet_2 = ec2.CfnSubnet(self, "PrivateSubnet2",
-            availability_zone = core.Fn.select(1,core.Fn.get_azs(core.Aws.REGION)),
-            cidr_block = "10.1.4.0/24",
-            vpc_id = vpc.ref,
-            tags = [{
-                "key" : "Name",
-                "value" : "edx-subnet-private-b"
-            }]
-        )
-        
-        # Create Private Route Association 1
-        private_route_association_1 = ec2.CfnSubnetRouteTableAssociation(self, "PrivateRouteAssociation1",
-            route_table_id = private_route_table_1.ref,
-            subnet_id = private_subnet_1.ref
-        )
-        
-        # Create Private Route Association 2
-        private_route_association_1 = ec2.CfnSubnetRouteTableAssociation(self, "PrivateRouteAssociation2",
-            route_table_id = private_route_table_2.ref,
-            subnet_id = private_subnet_2.ref
-        )
+            route_table_ids = [route_table.ref for route_table in private_route_tables]
+        )
+        
+        # Interface endpoints for the private subnets, e.g.
+        # cdk -c vpc_interface_endpoints='["ssm", "rekognition", "logs", "xray"]'
+        interface_endpoints = get_context(self, "vpc_interface_endpoints", [])
+        if interface_endpoints:
+            # Create Endpoint Security Group
+            endpoint_security_group = ec2.CfnSecurityGroup(self, "EndpointSecurityGroup",
+                group_description = "HTTPS to VPC interface endpoints",
+                vpc_id = vpc.ref,
+                security_group_ingress = [
+                {
+                  "ipProtocol" : "tcp",
+                  "fromPort" : 443,
+                  "toPort" : 443,
+                  "cidrIp" : vpc.cidr_block
+                }
+                ],
+                tags = [{
+                    "key" : "Name",
+                    "value" : "edx-sg-endpoints"
+                }]
+            )
+            
+            for service in interface_endpoints:
+                # Create <Service> Interface Endpoint
+                ec2.CfnVPCEndpoint(self, "%sInterfaceEndpoint" % (service.title().replace("-", "")),
+                    service_name = "com.amazonaws.%s.%s" % (core.Aws.REGION, service),
+                    vpc_endpoint_type = "Interface",
+                    vpc_id = vpc.ref,
+                    private_dns_enabled = True,
+                    subnet_ids = [subnet.ref for subnet in subnets["Private"]],
+                    security_group_ids = [endpoint_security_group.ref]
+                )
         
         # Output
         core.CfnOutput(self, "VPCOutput",
@@ -194,23 +226,16 @@ class VpcStack(core.Stack):
             description = "VPC",
             export_name = "VPC"
         )
-        core.CfnOutput(self, "PublicSubnet1Output",
-            value = public_subnet_1.ref,
-            description = "PublicSubnet1",
-            export_name = "PublicSubnet1"
-        )
-        core.CfnOutput(self, "PublicSubnet2Output",
-            value = public_subnet_2.ref,
-            description = "PublicSubnet2",
-            export_name = "PublicSubnet2"
-        )
-        core.CfnOutput(self, "PrivateSubnet1Output",
-            value = private_subnet_1.ref,
-            description = "PrivateSubnet1",
-            export_name = "PrivateSubnet1"
-        )
-        core.CfnOutput(self, "PrivateSubnet2Output",
-            value = private_subnet_2.ref,
-            description = "PrivateSubnet2",
-            export_name = "PrivateSubnet2"
-        )
+        for tier in subnets:
+            for number, subnet in enumerate(subnets[tier], 1):
+                core.CfnOutput(self, "%sSubnet%dOutput" % (tier, number),
+                    value = subnet.ref,
+                    description = "%sSubnet%d" % (tier, number),
+                    export_name = "%sSubnet%d" % (tier, number)
+                )
+            # Whole tier, consumed through subnet_ids()
+            core.CfnOutput(self, "%sSubnetsOutput" % (tier),
+                value = core.Fn.join(",", [subnet.ref for subnet in subnets[tier]]),
+                description = "%s subnets, comma separated" % (tier),
+                export_name = "%sSubnets" % (tier)
+            )
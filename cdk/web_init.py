@@ -0,0 +1,313 @@
+import json
+import os
+
+from aws_cdk import core
+
+from cdk import web_tuning
+from cdk.cfn_init import CloudFormationInit, InitCommand, InitConfig, InitFile, InitService
+
+# Application bundle pulled from the source bucket
+APP_DIR = "/photos"
+APP_ARCHIVE = "deploy-app.zip"
+
+# cdk/tune_server.py and its input, installed on the instance
+TUNE_SCRIPT = "/usr/local/bin/tune-web-server"
+TUNING_FILE = "/etc/web-tuning.json"
+
+# Configs that only install software; these are what gets baked into an AMI
+BAKE_CONFIGS = ["Install", "InstallLogs", "Build"]
+
+CONFIG_SETS = {
+    "InstallAndDeploy": ["Install", "Configure", "InstallLogs", "ConfigureLogs", "Build", "Deploy"],
+    "Boot": ["Configure", "ConfigureLogs", "Start"]
+}
+
+# Amazon Linux 1 runs sysvinit and upstart and is only kept for the bundle's
+# configs as shipped; Amazon Linux 2023 runs systemd, has no awslogs and
+# does not preinstall the CloudFormation helper scripts
+PLATFORMS = {
+    "al1": {
+        "packages": ["python36", "python36-devel", "nginx", "gcc"],
+        "pip": "pip-3.6",
+        "service_manager": "sysvinit",
+        "bootstrap": "",
+        "uwsgi_job": "/etc/init/uwsgi.conf",
+        "start_uwsgi": "start uwsgi",
+        "stop_uwsgi": "stop uwsgi",
+        "enable_nginx": "chkconfig nginx on",
+        "start_nginx": "service nginx start",
+        "stop_nginx": "service nginx stop",
+        "restart_nginx": "service nginx restart"
+    },
+    "al2023": {
+        "packages": ["python3", "python3-devel", "python3-pip", "nginx", "gcc", "aws-cfn-bootstrap"],
+        "pip": "pip3",
+        "service_manager": "systemd",
+        "bootstrap": "yum install -y aws-cfn-bootstrap",
+        "uwsgi_job": "/etc/systemd/system/uwsgi.service",
+        "start_uwsgi": "systemctl start uwsgi",
+        "stop_uwsgi": "systemctl stop uwsgi",
+        "enable_nginx": "systemctl enable nginx",
+        "start_nginx": "systemctl start nginx",
+        "stop_nginx": "systemctl stop nginx",
+        "restart_nginx": "systemctl restart nginx"
+    }
+}
+
+CLOUDWATCH_AGENT_CONFIG = "/opt/aws/amazon-cloudwatch-agent/etc/web-logs.json"
+
+XRAY_RPMS = {
+    "x86_64": "aws-xray-daemon-3.x.rpm",
+    "arm64": "aws-xray-daemon-arm64-3.x.rpm"
+}
+
+LOG_FILES = [
+    ("yum", "/var/log/yum.log", "yum.log"),
+    ("messages", "/var/log/messages", "messages.log"),
+    ("cfn-hup", "/var/log/cfn-hup.log", "cfn-hup.log"),
+    ("cfn-init", "/var/log/cfn-init.log", "cfn-init.log"),
+    ("cfn-init-cmd", "/var/log/cfn-init-cmd.log", "cfn-init-cmd.log"),
+    ("cloud-init", "/var/log/cloud-init.log", "cloud-init.log"),
+    ("cloud-init-output", "/var/log/cloud-init-output.log", "cloud-init.log"),
+    ("handler", "/var/log/handler.log", "handler.log"),
+    ("uwsgi", "/var/log/uwsgi.log", "uwsgi.log"),
+    ("nginx_access", "/var/log/nginx/access.log", "nginx_access.log"),
+    ("nginx_error", "/var/log/nginx/error.log", "nginx_error.log"),
+]
+
+
+def install_config(platform="al2023", architecture="x86_64"):
+    commands = [
+        InitCommand("01_unblock_nginx", PLATFORMS[platform]["enable_nginx"]),
+        InitCommand("02_install_xray",
+            "curl https://s3.dualstack.us-east-2.amazonaws.com/aws-xray-assets.us-east-2/xray-daemon/%s -o /tmp/xray.rpm && yum install -y /tmp/xray.rpm\n" % XRAY_RPMS[architecture],
+            cwd = "/tmp", ignore_errors = True)
+    ]
+    return InitConfig(packages = PLATFORMS[platform]["packages"], commands = commands)
+
+
+def configure_config(resource, config_set, reload=True, platform="al2023"):
+    """cfn-hup, plus the hook re-running ``config_set`` in place when the metadata changes.
+
+    Without ``reload`` updates only reach the fleet through new instances.
+    """
+    files = [
+        InitFile("/etc/cfn/cfn-hup.conf", """
+            [main]
+            stack={}
+            region={}
+            interval=1
+            verbose=true""".format(core.Aws.STACK_ID, core.Aws.REGION))
+    ]
+    if reload:
+        files.append(InitFile("/etc/cfn/hooks.d/cfn-auto-reloader.conf", """
+            [cfn-auto-reloader-hook]
+            triggers=post.update
+            path=Resources.{Resource}.Metadata.AWS::CloudFormation::Init
+            action=/opt/aws/bin/cfn-init -v --stack {StackName} --resource {Resource} --configsets {ConfigSet} --region {Region}
+            runas=root""".format(Resource=resource, ConfigSet=config_set,
+                                 StackName=core.Aws.STACK_NAME, Region=core.Aws.REGION)))
+    watched = [init_file.path for init_file in files]
+    if platform != "al1":
+        # Only Amazon Linux 1 has an init script for cfn-hup
+        files.append(InitFile("/etc/systemd/system/cfn-hup.service", """
+            [Unit]
+            Description=cfn-hup daemon
+
+            [Service]
+            Type=simple
+            ExecStart=/opt/aws/bin/cfn-hup
+            Restart=always
+
+            [Install]
+            WantedBy=multi-user.target
+            """, mode = "000644"))
+    return InitConfig(
+        files = files,
+        services = [
+            InitService("nginx"),
+            InitService("cfn-hup", files = watched)
+        ],
+        service_manager = PLATFORMS[platform]["service_manager"]
+    )
+
+
+def install_logs_config(platform="al2023"):
+    if platform != "al1":
+        return InitConfig(packages = ["amazon-cloudwatch-agent"])
+    return InitConfig(
+        packages = ["awslogs"],
+        commands = [InitCommand("01_create_state_directory", "mkdir -p /var/awslogs/state")]
+    )
+
+
+def configure_logs_config(log_group_name, platform="al2023"):
+    if platform != "al1":
+        # The CloudWatch agent replaces awslogs, with the same files and streams
+        agent_config = {
+            "logs": {
+                "logs_collected": {
+                    "files": {
+                        "collect_list": [{
+                            "file_path": path,
+                            "log_group_name": log_group_name,
+                            "log_stream_name": "{hostname} - {instance_id} %s" % stream
+                        } for name, path, stream in LOG_FILES]
+                    }
+                }
+            }
+        }
+        return InitConfig(
+            files = [InitFile(CLOUDWATCH_AGENT_CONFIG, json.dumps(agent_config, indent=2) + "\n", mode = "000444")],
+            commands = [InitCommand("01_start_cloudwatch_agent",
+                "/opt/aws/amazon-cloudwatch-agent/bin/amazon-cloudwatch-agent-ctl -a fetch-config -m ec2 -s -c file:%s"
+                % CLOUDWATCH_AGENT_CONFIG)]
+        )
+    sections = ["[general]", "state_file= /var/awslogs/state/agent-state"]
+    for name, path, stream in LOG_FILES:
+        sections += [
+            "[%s]" % name,
+            "file = %s" % path,
+            "log_group_name = %s" % log_group_name,
+            "log_stream_name = {hostname} - {instance_id} %s" % stream
+        ]
+    return InitConfig(
+        files = [
+            InitFile("/etc/awslogs/awslogs.conf", "\n".join(sections) + "\n", mode = "000400"),
+            InitFile("/etc/awslogs/awscli.conf", """
+                [plugins]
+                cwlogs = cwlogs
+                [default]
+                region = {}
+                """.format(core.Aws.REGION), mode = "000444")
+        ],
+        services = [InitService("awslogs", files = ["/etc/awslogs/awslogs.conf"])],
+        service_manager = PLATFORMS[platform]["service_manager"]
+    )
+
+
+def build_config(source_bucket, platform="al2023"):
+    pip = PLATFORMS[platform]["pip"]
+    return InitConfig(
+        sources = {APP_DIR: "https://s3.amazonaws.com/{}/{}".format(source_bucket, APP_ARCHIVE)},
+        commands = [
+            InitCommand("01_pip_uwsgi", "%s install uwsgi" % pip, cwd = "/photos", ignore_errors = False),
+            InitCommand("02_pip_flask_app_requirements", "%s install -r requirements.txt" % pip,
+                cwd = "/photos/FlaskApp", ignore_errors = False)
+        ]
+    )
+
+
+def server_files(tuning):
+    """``web_tuning.server_tuning`` values, the script applying them and kernel settings."""
+    with open(os.path.join(os.path.dirname(__file__), "tune_server.py")) as fp:
+        tune_script = fp.read()
+    return [
+        InitFile(TUNING_FILE, json.dumps(tuning, indent=2, sort_keys=True) + "\n", mode = "000644"),
+        InitFile(TUNE_SCRIPT, tune_script, mode = "000755"),
+        InitFile("/etc/sysctl.d/60-web.conf", web_tuning.sysctl_conf(tuning), mode = "000644")
+    ]
+
+
+def server_config_command(key, tuning, platform, copy):
+    """Put the server configs in place: ``copy`` the bundle's, or tune them for the instance."""
+    if tuning is None:
+        return InitCommand(key, "{0} -f nginx.conf /etc/nginx/nginx.conf && {0} -f uwsgi.conf /etc/init/uwsgi.conf".format(copy),
+            cwd = "/photos/Deploy", ignore_errors = False)
+    command = "python3 %s %s --nginx nginx.conf /etc/nginx/nginx.conf --uwsgi uwsgi.conf %s" % (
+        TUNE_SCRIPT, TUNING_FILE, PLATFORMS[platform]["uwsgi_job"])
+    if platform != "al1":
+        command += " --systemd"
+    command += " && sysctl -p /etc/sysctl.d/60-web.conf"
+    if platform != "al1":
+        command += " && systemctl daemon-reload"
+    return InitCommand(key, command, cwd = "/photos/Deploy", ignore_errors = False)
+
+
+def deploy_config(tuning=None, platform="al2023"):
+    """Stop, configure and restart the app; ``tuning`` scales the bundle's
+    server configs to the instance instead of using them as shipped."""
+    return InitConfig(
+        files = server_files(tuning) if tuning is not None else [],
+        commands = [
+            InitCommand("03_stop_uwsgi", PLATFORMS[platform]["stop_uwsgi"], ignore_errors = True),
+            InitCommand("04_stop_nginx", PLATFORMS[platform]["stop_nginx"]),
+            server_config_command("05_%s_config" % ("copy" if tuning is None else "tune"), tuning, platform, "mv"),
+            InitCommand("06_create_database", "python3 database_create_tables.py",
+                cwd = "/photos/Deploy", ignore_errors = False),
+            InitCommand("07_start_uwsgi", PLATFORMS[platform]["start_uwsgi"]),
+            InitCommand("08_restart_nginx", PLATFORMS[platform]["start_nginx"])
+        ]
+    )
+
+
+def start_config(tuning=None, platform="al2023"):
+    """Boot-time steps for an instance launched from a baked AMI."""
+    return InitConfig(
+        files = server_files(tuning) if tuning is not None else [],
+        commands = [
+            server_config_command("01_%s_config" % ("copy" if tuning is None else "tune"), tuning, platform, "cp"),
+            InitCommand("02_start_uwsgi", PLATFORMS[platform]["start_uwsgi"]),
+            InitCommand("03_restart_nginx", PLATFORMS[platform]["restart_nginx"])
+        ]
+    )
+
+
+def web_server_init(source_bucket, role_name, log_group_name, baked=False, reload=True, tuning=None,
+                    platform="al2023", architecture="x86_64"):
+    """Init for a web server launched with cfn-init.
+
+    ``InstallAndDeploy`` builds the box from a stock AMI; ``Boot`` only writes
+    configuration and starts the services on an AMI produced by ImageStack.
+    ``reload`` keeps the cfn-auto-reloader hook that redeploys running
+    instances in place. ``tuning`` sets the worker, backlog and buffer values
+    of the bundle's nginx.conf and uwsgi.conf for the instance type;
+    ``platform`` is a key of PLATFORMS.
+    """
+    config_set = "Boot" if baked else "InstallAndDeploy"
+    return CloudFormationInit(
+        CONFIG_SETS,
+        {
+            "Install": install_config(platform, architecture),
+            "Configure": lambda resource: configure_config(resource, config_set, reload, platform),
+            "InstallLogs": install_logs_config(platform),
+            "ConfigureLogs": configure_logs_config(log_group_name, platform),
+            "Build": build_config(source_bucket, platform),
+            "Deploy": deploy_config(tuning, platform),
+            "Start": start_config(tuning, platform)
+        },
+        authentication = {
+            "rolebased": {
+                "type": "S3",
+                "buckets": [
+                    source_bucket
+                ],
+                "roleName": role_name
+            }
+        }
+    )
+
+
+def bake_commands(source_bucket, platform="al2023", architecture="x86_64"):
+    """Shell commands equivalent to the BAKE_CONFIGS, for an image build.
+
+    The image builder has no stack to run cfn-init against, so packages,
+    sources and commands are flattened into plain bash in config order.
+    """
+    configs = {
+        "Install": install_config(platform, architecture),
+        "InstallLogs": install_logs_config(platform),
+        "Build": build_config(source_bucket, platform),
+    }
+    commands = ["yum update -y"]
+    for name in BAKE_CONFIGS:
+        config = configs[name]
+        if config.packages:
+            commands.append("yum install -y %s" % " ".join(sorted(config.packages)))
+        for target in config.sources:
+            commands.append(
+                "aws s3 cp s3://{bucket}/{archive} /tmp/{archive} && mkdir -p {target} && unzip -o /tmp/{archive} -d {target}".format(
+                    bucket=source_bucket, archive=APP_ARCHIVE, target=target))
+        for command in sorted(config.commands, key=lambda command: command.key):
+            commands.append(command.to_bash())
+    return commands
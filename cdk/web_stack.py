@@ -1,24 +1,107 @@
+import hashlib
+import json
+
 from aws_cdk import (
     aws_ec2 as ec2,
     aws_iam as iam,
     aws_logs as logs,
+    aws_autoscaling as autoscaling,
     aws_cloudformation as cloudformation,
     aws_elasticloadbalancingv2 as elasticloadbalancingv2,
     aws_ssm as ssm,
     core
 )
 
+from cdk import lb_profile, web_init, web_tuning
+from cdk.cfn_init import InitRegistry
+from cdk.constants import ORIGIN_VERIFY_HEADER
+from cdk.context import get_context
+from cdk.vpc_stack import subnet_ids
+
 class WebStack(core.Stack):
 
     def __init__(self, scope: core.Construct, id: str, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
 
+        # Instance profile (cdk -c web_instance_profile=graviton); the
+        # instance type decides the architecture and AMI
+        profile = web_tuning.instance_profile(
+            get_context(self, "web_instance_profile", "burstable"),
+            instance_type=get_context(self, "web_instance_type"),
+            platform=get_context(self, "web_platform"),
+            cpu_credits=get_context(self, "web_cpu_credits"))
+        instance_type = profile["instance_type"]
+
         # Parameter
-        LatestAmiId = core.CfnParameter(
-            self, "LatestAmiId",
-            type="AWS::SSM::Parameter::Value<AWS::EC2::Image::Id>",
-            default="/aws/service/ami-amazon-linux-latest/amzn-ami-hvm-x86_64-gp2"
-        )
+        # An AMI baked by ImageStack (cdk -c web_ami_id=ami-...) skips the
+        # package install and app build at boot.
+        baked_ami_id = get_context(self, "web_ami_id")
+        baked = baked_ami_id is not None
+        if baked:
+            image_id = baked_ami_id
+        else:
+            LatestAmiId = core.CfnParameter(
+                self, "LatestAmiId",
+                type="AWS::SSM::Parameter::Value<AWS::EC2::Image::Id>",
+                default=profile["ami_parameter"]
+            )
+            image_id = LatestAmiId.value_as_string
+
+        # Fleet size and target-tracking settings (cdk -c web_max_capacity=8)
+        min_capacity = get_context(self, "web_min_capacity", 2)
+        max_capacity = get_context(self, "web_max_capacity", 6)
+        desired_capacity = get_context(self, "web_desired_capacity", 2)
+        request_count_target = get_context(self, "web_request_count_target", 1000)
+        cpu_target = get_context(self, "web_cpu_target", 60)
+        origin_mode = get_context(self, "cdn_origin_mode", "apigateway")
+
+        # How a new deploy-app.zip reaches the fleet:
+        #   reload    - cfn-hup re-runs cfn-init in place on every instance
+        #   rolling   - instances are replaced in batches, never dropping
+        #               below web_rolling_min_in_service
+        #   bluegreen - a group and target group per colour; flipping
+        #               web_live_color creates the other colour and moves
+        #               the listener once its instances have signalled
+        # Bump web_app_version to start a rolling or blue/green deploy of a new
+        # bundle; Init changes start one by themselves.
+        deploy_mode = get_context(self, "web_deploy_mode", "reload")
+        if deploy_mode not in ("reload", "rolling", "bluegreen"):
+            raise ValueError("web_deploy_mode must be 'reload', 'rolling' or 'bluegreen', got %r" % deploy_mode)
+        app_version = get_context(self, "web_app_version", "")
+        live_color = get_context(self, "web_live_color", "blue")
+        if live_color not in ("blue", "green"):
+            raise ValueError("web_live_color must be 'blue' or 'green', got %r" % live_color)
+        batch_size = get_context(self, "web_rolling_batch_size", 1)
+        min_in_service = get_context(self, "web_rolling_min_in_service", desired_capacity)
+        if deploy_mode == "rolling" and min_in_service + batch_size > max_capacity:
+            raise ValueError(
+                "web_rolling_min_in_service + web_rolling_batch_size (%d) must not exceed web_max_capacity (%d)"
+                % (min_in_service + batch_size, max_capacity))
+        if deploy_mode == "bluegreen":
+            target_group_id = "%sTargetGroup" % live_color.title()
+            group_id = "%sWebAutoScalingGroup" % live_color.title()
+        else:
+            target_group_id = "DefaultTargetGroup"
+            group_id = "WebAutoScalingGroup"
+        signal_timeout = 'PT5M' if baked else 'PT10M'
+
+        # The bundle's nginx/uwsgi configs with workers and buffers scaled to the
+        # instance type, or as shipped (cdk -c web_server_config=bundle)
+        server_config = get_context(self, "web_server_config", "tuned")
+        if server_config not in ("tuned", "bundle"):
+            raise ValueError("web_server_config must be 'tuned' or 'bundle', got %r" % server_config)
+        if server_config == "bundle" and profile["platform"] != "al1":
+            raise ValueError("The bundle's uwsgi.conf is an upstart job; %s needs web_server_config=tuned"
+                             % profile["platform"])
+        # Target group routing, slow start and health checks (cdk -c lb_profile=least-outstanding)
+        load_balancing = lb_profile.load_balancing_profile(self)
+
+        tuning = None
+        if server_config == "tuned":
+            # nginx must keep idle connections open longer than the ALB does
+            tuning_overrides = dict({"keepalive_timeout": max(75, load_balancing["idle_timeout"] + 5)},
+                                    **get_context(self, "web_server_tuning", {}))
+            tuning = web_tuning.server_tuning(instance_type, tuning_overrides)
         
         # S3 Bucket
         source_bucket = "sourcebucketname%s" % (core.Aws.ACCOUNT_ID)
@@ -27,500 +110,192 @@ class WebStack(core.Stack):
         CloudFormationLogs = logs.LogGroup(
             self, 'CloudFormationLogs', retention=logs.RetentionDays('ONE_WEEK'))
 
-        WebInstance1 = ec2.CfnInstance(
-            self, 'WebInstance1', additional_info=None, affinity=None,
-            iam_instance_profile=core.Fn.import_value("WebServerInstanceProfileOutput"),
-            image_id=LatestAmiId.value_as_string,
-            instance_type='t3.micro',
-            network_interfaces=[
-                {
-                    "deviceIndex":"0",
-                    "groupSet": [core.Fn.import_value("WebSecurityGroupOutput")],
-                    "subnetId": core.Fn.import_value("PrivateSubnet1")
-                }
-            ],
-            tags=[core.CfnTag(key="Name", value="WebServer1")],
-            user_data=core.Fn.base64(
+        # One copy of the Init metadata per distinct content, on the first
+        # resource that needs it; cfn-init on the others reads that copy
+        init_registry = InitRegistry()
+        web_server_init = web_init.web_server_init(
+            source_bucket,
+            role_name=core.Fn.import_value("WebServerRoleOutput"),
+            log_group_name=CloudFormationLogs.log_group_name,
+            baked=baked,
+            reload=deploy_mode == "reload",
+            tuning=tuning,
+            platform=profile["platform"],
+            architecture=profile["architecture"])
+        init_resource = init_registry.resource_for('WebLaunchTemplate', web_server_init)
+        # Without the reloader hook, Init changes only reach the fleet through new
+        # instances, so the user data carries a hash of the metadata: a change to
+        # it creates a new template version and starts the replacement
+        init_version = ""
+        if deploy_mode != "reload":
+            init_version = "# web_init %s" % hashlib.sha256(json.dumps(
+                self.resolve(web_server_init.render(init_resource)), sort_keys = True).encode()).hexdigest()[:8]
+
+        launch_template_data = {
+            "iamInstanceProfile": {
+                "name": core.Fn.import_value("WebServerInstanceProfileOutput")
+            },
+            "imageId": image_id,
+            "instanceType": instance_type,
+            "securityGroupIds": [core.Fn.import_value("WebSecurityGroupOutput")],
+            "tagSpecifications": [{
+                "resourceType": "instance",
+                "tags": [{"key": "Name", "value": "WebServer"}]
+            }],
+            "userData": core.Fn.base64(
             """#!/bin/bash -ex
-            yum update -y
-            /opt/aws/bin/cfn-init -v --stack {StackName} --resource WebInstance1 --configsets InstallAndDeploy --region {Region}
+            {Update}
+            {Bootstrap}
+            {AppVersion}
+            {InitVersion}
+            /opt/aws/bin/cfn-init -v --stack {StackName} --resource {InitResource} --configsets {ConfigSet} --region {Region}
             # Signal the status from cfn-init (via $?)
-            /opt/aws/bin/cfn-signal -e $? --stack {StackName} --resource WebInstance1 --region {Region}
-            """.format(StackName=core.Aws.STACK_NAME,Region=core.Aws.REGION)
+            /opt/aws/bin/cfn-signal -e $? --stack {StackName} --resource {GroupId} --region {Region}
+            """.format(StackName=core.Aws.STACK_NAME,Region=core.Aws.REGION,
+                       InitResource=init_resource,
+                       GroupId=group_id,
+                       AppVersion="# web_app_version %s" % app_version if app_version else "",
+                       InitVersion=init_version,
+                       Update="" if baked else "yum update -y",
+                       Bootstrap=web_init.PLATFORMS[profile["platform"]]["bootstrap"],
+                       ConfigSet="Boot" if baked else "InstallAndDeploy")
             )
-        )
-        WebInstance1.cfn_options.metadata = {
-            "AWS::CloudFormation::Authentication": {
-                "rolebased": {
-                    "type": "S3",
-                    "buckets": [
-                        source_bucket
-                    ],
-                    "roleName": core.Fn.import_value("WebServerRoleOutput")
-                }
-            },
-            "AWS::CloudFormation::Init": {
-                "configSets": {
-                    "InstallAndDeploy": [
-                        "Install",
-                        "InstallLogs",
-                        "Deploy"
-                    ]
-                },
-                "Install": {
-                    "packages": {
-                        "yum": {
-                            "python36": [],
-                            "python36-devel": [],
-                            "nginx": [],
-                            "gcc": []
-                        }
-                    },
-                    "files": {
-                        "/etc/cfn/cfn-hup.conf": {
-                            "content": """
-                                [main]
-                                stack={}
-                                region={}
-                                interval=1
-                                verbose=true""".format(core.Aws.STACK_ID, core.Aws.REGION),
-                            "mode": "000400",
-                            "owner": "root",
-                            "group": "root"
-                        },
-                        "/etc/cfn/hooks.d/cfn-auto-reloader.conf": {
-                            "content": """
-                                [cfn-auto-reloader-hook]
-                                triggers=post.update
-                                path=Resources.WebInstance1.Metadata.AWS::CloudFormation::Init
-                                action=/opt/aws/bin/cfn-init -v --stack {} --resource WebInstance1 --configsets InstallAndDeploy --region {}
-                                runas=root""".format(core.Aws.STACK_NAME, core.Aws.REGION),
-                            "mode": "000400",
-                            "owner": "root",
-                            "group": "root"
-                        }
-                    },
-                    "services": {
-                        "sysvinit": {
-                            "nginx": {
-                                "enabled": "true",
-                                "ensureRunning": "true"
-                            },
-                            "cfn-hup": {
-                                "enabled": "true",
-                                "ensureRunning": "true",
-                                "files": [
-                                    "/etc/cfn/cfn-hup.conf",
-                                    "/etc/cfn/hooks.d/cfn-auto-reloader.conf"
-                                ]
-                            }
-                        }
-                    },
-                    "commands": {
-                        "01_unblock_nginx": {
-                            "command": "chkconfig nginx on"
-                        },
-                        "02_install_xray": {
-                            "command": "curl https://s3.dualstack.us-east-2.amazonaws.com/aws-xray-assets.us-east-2/xray-daemon/aws-xray-daemon-3.x.rpm -o /tmp/xray.rpm && yum install -y /tmp/xray.rpm\n",
-                            "cwd": "/tmp",
-                            "ignoreErrors": "true"
-                        }
-                    }
-                },
-                "InstallLogs": {
-                    "packages": {
-                        "yum": {
-                            "awslogs": []
-                        }
-                    },
-                    "files": {
-                        "/etc/awslogs/awslogs.conf": {
-                            "content": """
-                            [general]
-                            state_file= /var/awslogs/state/agent-state
-                            [yum]
-                            file = /var/log/yum.log
-                            log_group_name = %s
-                            log_stream_name = {{hostname}} - {{instance_id}} yum.log
-                            [messages]
-                            file = /var/log/messages
-                            log_group_name = {CloudFormationLogs}
-                            log_stream_name = {{hostname}} - {{instance_id}} messages.log
-                            [cfn-hup]
-                            file = /var/log/cfn-hup.log
-                            log_group_name = {CloudFormationLogs}
-                            log_stream_name = {{hostname}} - {{instance_id}} cfn-hup.log
-                            [cfn-init]
-                            file = /var/log/cfn-init.log
-                            log_group_name = {CloudFormationLogs}
-                            log_stream_name = {{hostname}} - {{instance_id}} cfn-init.log
-                            [cfn-init-cmd]
-                            file = /var/log/cfn-init-cmd.log
-                            log_group_name = {CloudFormationLogs}
-                            log_stream_name = {{hostname}} - {{instance_id}} cfn-init-cmd.log
-                            [cloud-init]
-                            file = /var/log/cloud-init.log
-                            log_group_name = {CloudFormationLogs}
-                            log_stream_name = {{hostname}} - {{instance_id}} cloud-init.log
-                            [cloud-init-output]
-                            file = /var/log/cloud-init-output.log
-                            log_group_name = {CloudFormationLogs}
-                            log_stream_name = {{hostname}} - {{instance_id}} cloud-init.log
-                            [handler]
-                            file = /var/log/handler.log
-                            log_group_name = {CloudFormationLogs}
-                            log_stream_name = {{hostname}} - {{instance_id}} handler.log
-                            [uwsgi]
-                            file = /var/log/uwsgi.log
-                            log_group_name = {CloudFormationLogs}
-                            log_stream_name = {{hostname}} - {{instance_id}} uwsgi.log
-                            [nginx_access]
-                            file = /var/log/nginx/access.log
-                            log_group_name = {CloudFormationLogs}
-                            log_stream_name = {{hostname}} - {{instance_id}} nginx_access.log
-                            [nginx_error]
-                            file = /var/log/nginx/error.log
-                            log_group_name = {CloudFormationLogs}
-                            log_stream_name = {{hostname}} - {{instance_id}} nginx_error.log
-                            """.format(CloudFormationLogs=CloudFormationLogs.log_group_name),
-                            "group": "root",
-                            "owner": "root",
-                            "mode": "000400"
-                        },
-                        "/etc/awslogs/awscli.conf": {
-                            "content": """
-                                [plugins]
-                                cwlogs = cwlogs
-                                [default]
-                                region = {}
-                            """.format(core.Aws.REGION),
-                            "mode": "000444",
-                            "owner": "root",
-                            "group": "root"
-                        }
-                    },
-                    "commands": {
-                        "01_create_state_directory": {
-                            "command": "mkdir -p /var/awslogs/state"
-                        }
-                    },
-                    "services": {
-                        "sysvinit": {
-                            "awslogs": {
-                                "enabled": "true",
-                                "ensureRunning": "true",
-                                "files": [
-                                    "/etc/awslogs/awslogs.conf"
-                                ]}
-                        }
-                    }
-                },
-                "Deploy": {
-                    "sources": {
-                        "/photos": "https://s3.amazonaws.com/{}/deploy-app.zip".format(source_bucket)
-                    },
-                    "commands": {
-                        "01_pip_uwsgi": {
-                            "command": "pip-3.6 install uwsgi",
-                            "cwd": "/photos",
-                            "ignoreErrors": "false"
-                        },
-                        "02_pip_flask_app_requirements": {
-                            "command": "pip-3.6 install -r requirements.txt",
-                            "cwd": "/photos/FlaskApp",
-                            "ignoreErrors": "false"
-                        },
-                        "03_stop_uwsgi": {
-                            "command": "stop uwsgi",
-                            "ignoreErrors": "true"
-                        },
-                        "04_stop_nginx": {
-                            "command": "service nginx stop"
-                        },
-                        "05_copy_config": {
-                            "command": "mv -f nginx.conf /etc/nginx/nginx.conf && mv -f uwsgi.conf /etc/init/uwsgi.conf",
-                            "cwd": "/photos/Deploy",
-                            "ignoreErrors": "false"
-                        },
-                        "06_create_database": {
-                            "command": "python3 database_create_tables.py",
-                            "cwd": "/photos/Deploy",
-                            "ignoreErrors": "false"
-                        },
-                        "07_start_uwsgi": {
-                            "command": "start uwsgi"
-                        },
-                        "08_restart_nginx": {
-                            "command": "service nginx start"
-                        }
-                    }
-                }
-            }
         }
-        WebInstance1.cfn_options.creation_policy = core.CfnCreationPolicy(
-            resource_signal=core.CfnResourceSignal(timeout='PT10M'))
-
-        WebInstance2 = ec2.CfnInstance(
-            self, 'WebInstance2', additional_info=None, affinity=None,
-            iam_instance_profile=core.Fn.import_value("WebServerInstanceProfileOutput"),
-            image_id=LatestAmiId.value_as_string,
-            instance_type='t3.micro',
-            network_interfaces=[
-                {
-                    "deviceIndex":"0",
-                    "groupSet": [core.Fn.import_value("WebSecurityGroupOutput")],
-                    "subnetId": core.Fn.import_value("PrivateSubnet2")
-                }
-            ],
-            tags=[core.CfnTag(key="Name", value="WebServer2")],
-            user_data=core.Fn.base64(
-            """#!/bin/bash -ex
-              yum update -y
-              /opt/aws/bin/cfn-init -v --stack {StackName} --resource WebInstance2 --configsets InstallAndDeploy --region {Region}
-              # Signal the status from cfn-init (via $?)
-              /opt/aws/bin/cfn-signal -e $? --stack {StackName} --resource WebInstance2 --region {Region}
-            """.format(StackName=core.Aws.STACK_NAME,Region=core.Aws.REGION)
-            )
+        # Burstable types only
+        if profile["cpu_credits"]:
+            launch_template_data["creditSpecification"] = {"cpuCredits": profile["cpu_credits"]}
+        WebLaunchTemplate = ec2.CfnLaunchTemplate(
+            self, 'WebLaunchTemplate',
+            launch_template_data=launch_template_data
         )
-        WebInstance2.cfn_options.metadata = {
-            "AWS::CloudFormation::Authentication": {
-                "rolebased": {
-                    "type": "S3",
-                    "buckets": [
-                        source_bucket
-                    ],
-                    "roleName": core.Fn.import_value("WebServerRoleOutput")
-                }
-            },
-            "AWS::CloudFormation::Init": {
-                "configSets": {
-                    "InstallAndDeploy": [
-                        "Install",
-                        "InstallLogs",
-                        "Deploy"
-                    ]
-                },
-                "Install": {
-                    "packages": {
-                        "yum": {
-                            "python36": [],
-                            "python36-devel": [],
-                            "nginx": [],
-                            "gcc": []
-                        }
-                    },
-                    "files": {
-                        "/etc/cfn/cfn-hup.conf": {
-                            "content": """
-                                [main]
-                                stack={}
-                                region={}
-                                interval=1
-                                verbose=true""".format(core.Aws.STACK_ID, core.Aws.REGION),
-                            "mode": "000400",
-                            "owner": "root",
-                            "group": "root"
-                        },
-                        "/etc/cfn/hooks.d/cfn-auto-reloader.conf": {
-                            "content": """
-                                [cfn-auto-reloader-hook]
-                                triggers=post.update
-                                path=Resources.WebInstance1.Metadata.AWS::CloudFormation::Init
-                                action=/opt/aws/bin/cfn-init -v --stack {} --resource WebInstance2 --configsets InstallAndDeploy --region {}
-                                runas=root""".format(core.Aws.STACK_NAME, core.Aws.REGION),
-                            "mode": "000400",
-                            "owner": "root",
-                            "group": "root"
-                        }
-                    },
-                    "services": {
-                        "sysvinit": {
-                            "nginx": {
-                                "enabled": "true",
-                                "ensureRunning": "true"
-                            },
-                            "cfn-hup": {
-                                "enabled": "true",
-                                "ensureRunning": "true",
-                                "files": [
-                                    "/etc/cfn/cfn-hup.conf",
-                                    "/etc/cfn/hooks.d/cfn-auto-reloader.conf"
-                                ]
-                            }
-                        }
-                    },
-                    "commands": {
-                        "01_unblock_nginx": {
-                            "command": "chkconfig nginx on"
-                        },
-                        "02_install_xray": {
-                            "command": "curl https://s3.dualstack.us-east-2.amazonaws.com/aws-xray-assets.us-east-2/xray-daemon/aws-xray-daemon-3.x.rpm -o /tmp/xray.rpm && yum install -y /tmp/xray.rpm\n",
-                            "cwd": "/tmp",
-                            "ignoreErrors": "true"
-                        }
-                    }
-                },
-                "InstallLogs": {
-                    "packages": {
-                        "yum": {
-                            "awslogs": []
-                        }
-                    },
-                    "files": {
-                        "/etc/awslogs/awslogs.conf": {
-                            "content": """
-                            [general]
-                            state_file= /var/awslogs/state/agent-state
-                            [yum]
-                            file = /var/log/yum.log
-                            log_group_name = %s
-                            log_stream_name = {{hostname}} - {{instance_id}} yum.log
-                            [messages]
-                            file = /var/log/messages
-                            log_group_name = {CloudFormationLogs}
-                            log_stream_name = {{hostname}} - {{instance_id}} messages.log
-                            [cfn-hup]
-                            file = /var/log/cfn-hup.log
-                            log_group_name = {CloudFormationLogs}
-                            log_stream_name = {{hostname}} - {{instance_id}} cfn-hup.log
-                            [cfn-init]
-                            file = /var/log/cfn-init.log
-                            log_group_name = {CloudFormationLogs}
-                            log_stream_name = {{hostname}} - {{instance_id}} cfn-init.log
-                            [cfn-init-cmd]
-                            file = /var/log/cfn-init-cmd.log
-                            log_group_name = {CloudFormationLogs}
-                            log_stream_name = {{hostname}} - {{instance_id}} cfn-init-cmd.log
-                            [cloud-init]
-                            file = /var/log/cloud-init.log
-                            log_group_name = {CloudFormationLogs}
-                            log_stream_name = {{hostname}} - {{instance_id}} cloud-init.log
-                            [cloud-init-output]
-                            file = /var/log/cloud-init-output.log
-                            log_group_name = {CloudFormationLogs}
-                            log_stream_name = {{hostname}} - {{instance_id}} cloud-init.log
-                            [handler]
-                            file = /var/log/handler.log
-                            log_group_name = {CloudFormationLogs}
-                            log_stream_name = {{hostname}} - {{instance_id}} handler.log
-                            [uwsgi]
-                            file = /var/log/uwsgi.log
-                            log_group_name = {CloudFormationLogs}
-                            log_stream_name = {{hostname}} - {{instance_id}} uwsgi.log
-                            [nginx_access]
-                            file = /var/log/nginx/access.log
-                            log_group_name = {CloudFormationLogs}
-                            log_stream_name = {{hostname}} - {{instance_id}} nginx_access.log
-                            [nginx_error]
-                            file = /var/log/nginx/error.log
-                            log_group_name = {CloudFormationLogs}
-                            log_stream_name = {{hostname}} - {{instance_id}} nginx_error.log
-                            """.format(CloudFormationLogs=CloudFormationLogs.log_group_name),
-                            "group": "root",
-                            "owner": "root",
-                            "mode": "000400"
-                        },
-                        "/etc/awslogs/awscli.conf": {
-                            "content": """
-                                [plugins]
-                                cwlogs = cwlogs
-                                [default]
-                                region = {}
-                            """.format(core.Aws.REGION),
-                            "mode": "000444",
-                            "owner": "root",
-                            "group": "root"
-                        }
-                    },
-                    "commands": {
-                        "01_create_state_directory": {
-                            "command": "mkdir -p /var/awslogs/state"
-                        }
-                    },
-                    "services": {
-                        "sysvinit": {
-                            "awslogs": {
-                                "enabled": "true",
-                                "ensureRunning": "true",
-                                "files": [
-                                    "/etc/awslogs/awslogs.conf"
-                                ]}
-                        }
-                    }
-                },
-                "Deploy": {
-                    "sources": {
-                        "/photos": "https://s3.amazonaws.com/{}/deploy-app.zip".format(source_bucket)
-                    },
-                    "commands": {
-                        "01_pip_uwsgi": {
-                            "command": "pip-3.6 install uwsgi",
-                            "cwd": "/photos",
-                            "ignoreErrors": "false"
-                        },
-                        "02_pip_flask_app_requirements": {
-                            "command": "pip-3.6 install -r requirements.txt",
-                            "cwd": "/photos/FlaskApp",
-                            "ignoreErrors": "false"
-                        },
-                        "03_stop_uwsgi": {
-                            "command": "stop uwsgi",
-                            "ignoreErrors": "true"
-                        },
-                        "04_stop_nginx": {
-                            "command": "service nginx stop"
-                        },
-                        "05_copy_config": {
-                            "command": "mv -f nginx.conf /etc/nginx/nginx.conf && mv -f uwsgi.conf /etc/init/uwsgi.conf",
-                            "cwd": "/photos/Deploy",
-                            "ignoreErrors": "false"
-                        },
-                        "06_create_database": {
-                            "command": "python3 database_create_tables.py",
-                            "cwd": "/photos/Deploy",
-                            "ignoreErrors": "false"
-                        },
-                        "07_start_uwsgi": {
-                            "command": "start uwsgi"
-                        },
-                        "08_restart_nginx": {
-                            "command": "service nginx start"
-                        }
-                    }
-                }
-            }
-        }
-
-        WebInstance2.cfn_options.creation_policy = core.CfnCreationPolicy(
-            resource_signal=core.CfnResourceSignal(timeout='PT10M'))
+        init_registry.attach(WebLaunchTemplate, web_server_init)
 
         DefaultTargetGroup = elasticloadbalancingv2.CfnTargetGroup(
-            self, 'DefaultTargetGroup',
-            health_check_interval_seconds=15,
+            self, target_group_id,
+            health_check_interval_seconds=load_balancing["health_check_interval"],
             health_check_path="/",
             health_check_protocol="HTTP",
-            health_check_timeout_seconds=10,
-            healthy_threshold_count=2,
-            unhealthy_threshold_count=2,
+            health_check_timeout_seconds=load_balancing["health_check_timeout"],
+            healthy_threshold_count=load_balancing["healthy_threshold"],
+            unhealthy_threshold_count=load_balancing["unhealthy_threshold"],
             matcher={'httpCode': '200-299'},
             port=80,
             protocol="HTTP",
             vpc_id=core.Fn.import_value("VPC"),
-            target_group_attributes=[
-                {"key": "deregistration_delay.timeout_seconds",
-                 "value": "30"}],
-            targets=[
-                {"id":WebInstance1.ref,"port":80},
-                {"id":WebInstance2.ref,"port":80}
-            ]
+            target_group_attributes=lb_profile.target_group_attributes(load_balancing)
         )
 
-        HttpListener = elasticloadbalancingv2.CfnListener(
-            self, 'HttpListener',
-            default_actions=[{
+        if origin_mode == "alb":
+            # CloudFront talks to the ALB directly; anything without the
+            # shared secret header did not come through the distribution.
+            # The value is resolved from CdnStack's OriginVerifySecret.
+            origin_verify_value = "{{resolve:secretsmanager:%s:SecretString}}" % core.Fn.import_value(
+                "OriginVerifySecretArn")
+            default_actions = [{
+                "type": "fixed-response",
+                "fixedResponseConfig": {"statusCode": "403"}
+            }]
+        else:
+            default_actions = [{
                 "type": "forward",
                 "targetGroupArn": DefaultTargetGroup.ref
-            }],
+            }]
+
+        HttpListener = elasticloadbalancingv2.CfnListener(
+            self, 'HttpListener',
+            default_actions=default_actions,
             load_balancer_arn=core.Fn.import_value("LoadBalancerArn"),
             port=80,
-            protocol="HTTP")
\ No newline at end of file
+            protocol="HTTP")
+
+        if origin_mode == "alb":
+            OriginVerifyRule = elasticloadbalancingv2.CfnListenerRule(
+                self, 'OriginVerifyRule',
+                listener_arn=HttpListener.ref,
+                priority=1,
+                conditions=[{
+                    "field": "http-header",
+                    "httpHeaderConfig": {
+                        "httpHeaderName": ORIGIN_VERIFY_HEADER,
+                        "values": [origin_verify_value]
+                    }
+                }],
+                actions=[{
+                    "type": "forward",
+                    "targetGroupArn": DefaultTargetGroup.ref
+                }])
+
+        WebAutoScalingGroup = autoscaling.CfnAutoScalingGroup(
+            self, group_id,
+            min_size=str(min_capacity),
+            max_size=str(max_capacity),
+            desired_capacity=str(desired_capacity),
+            launch_template={
+                "launchTemplateId": WebLaunchTemplate.ref,
+                "version": WebLaunchTemplate.attr_latest_version_number
+            },
+            vpc_zone_identifier=subnet_ids("Private"),
+            target_group_arns=[DefaultTargetGroup.ref],
+            health_check_type="ELB",
+            health_check_grace_period=60 if baked else 300,
+            tags=[{"key": "Name", "value": "WebServer", "propagateAtLaunch": True}]
+        )
+        WebAutoScalingGroup.cfn_options.creation_policy = core.CfnCreationPolicy(
+            resource_signal=core.CfnResourceSignal(
+                count=desired_capacity, timeout=signal_timeout))
+        if deploy_mode == "rolling":
+            # Old instances leave through the target group's deregistration delay
+            WebAutoScalingGroup.cfn_options.update_policy = core.CfnUpdatePolicy(
+                auto_scaling_rolling_update=core.CfnAutoScalingRollingUpdate(
+                    min_instances_in_service=min_in_service,
+                    max_batch_size=batch_size,
+                    pause_time=signal_timeout,
+                    wait_on_resource_signals=True,
+                    suspend_processes=["HealthCheck", "ReplaceUnhealthy", "AZRebalance",
+                                       "AlarmNotification", "ScheduledActions"]))
+        elif deploy_mode == "bluegreen":
+            # The listener only moves to the new colour once its group has
+            # signalled; the old group is deleted afterwards and drains
+            HttpListener.add_depends_on(WebAutoScalingGroup)
+            if origin_mode == "alb":
+                OriginVerifyRule.add_depends_on(WebAutoScalingGroup)
+
+        # Target tracking on ALB requests per instance and on CPU
+        RequestCountScalingPolicy = autoscaling.CfnScalingPolicy(
+            self, 'RequestCountScalingPolicy',
+            auto_scaling_group_name=WebAutoScalingGroup.ref,
+            policy_type="TargetTrackingScaling",
+            target_tracking_configuration={
+                "predefinedMetricSpecification": {
+                    "predefinedMetricType": "ALBRequestCountPerTarget",
+                    "resourceLabel": core.Fn.join("/", [
+                        core.Fn.import_value("LoadBalancerFullName"),
+                        DefaultTargetGroup.attr_target_group_full_name
+                    ])
+                },
+                "targetValue": request_count_target
+            }
+        )
+        # The request-count metric only exists once the group is behind a listener
+        RequestCountScalingPolicy.add_depends_on(HttpListener)
+        if origin_mode == "alb":
+            RequestCountScalingPolicy.add_depends_on(OriginVerifyRule)
+
+        CpuScalingPolicy = autoscaling.CfnScalingPolicy(
+            self, 'CpuScalingPolicy',
+            auto_scaling_group_name=WebAutoScalingGroup.ref,
+            policy_type="TargetTrackingScaling",
+            target_tracking_configuration={
+                "predefinedMetricSpecification": {
+                    "predefinedMetricType": "ASGAverageCPUUtilization"
+                },
+                "targetValue": cpu_target
+            }
+        )
+
+        # Output
+        core.CfnOutput(self, "WebAutoScalingGroupOutput",
+            value = WebAutoScalingGroup.ref,
+            description = "Web Auto Scaling Group",
+            export_name = "WebAutoScalingGroup"
+        )
\ No newline at end of file
@@ -0,0 +1,135 @@
+"""Web instance profiles, and nginx/uwsgi settings derived from the instance type.
+
+A profile names an instance type and its CPU credit mode. The type decides
+the architecture, and the architecture the AMI. Every profile runs Amazon
+Linux 2023; Amazon Linux 1 (x86_64 only, end of life) is left as an opt-in
+for running the bundle's server configs as shipped.
+
+The photos app is I/O bound (S3, Rekognition, the database), so uwsgi runs
+two processes per vCPU with a few threads each, capped by memory. nginx
+gets one worker per vCPU. Any value can be pinned with the
+``web_server_tuning`` context dict. The values are applied on the instance
+by ``cdk/tune_server.py``, on top of the bundle's own nginx.conf and
+uwsgi.conf.
+"""
+import re
+
+# Instance type -> (vCPUs, memory GiB)
+INSTANCE_SIZES = {
+    "t3.micro": (2, 1),
+    "t3.small": (2, 2),
+    "t3.medium": (2, 4),
+    "t3.large": (2, 8),
+    "t3.xlarge": (4, 16),
+    "t3.2xlarge": (8, 32),
+    "t4g.micro": (2, 1),
+    "t4g.small": (2, 2),
+    "t4g.medium": (2, 4),
+    "t4g.large": (2, 8),
+    "t4g.xlarge": (4, 16),
+    "c5.large": (2, 4),
+    "c5.xlarge": (4, 8),
+    "c5.2xlarge": (8, 16),
+    "c5.4xlarge": (16, 32),
+    "c6g.large": (2, 4),
+    "c6g.xlarge": (4, 8),
+    "c6g.2xlarge": (8, 16),
+    "c6g.4xlarge": (16, 32),
+    "m5.large": (2, 8),
+    "m5.xlarge": (4, 16),
+    "m6g.large": (2, 8),
+    "m6g.xlarge": (4, 16),
+    "a1.medium": (1, 2),
+    "a1.large": (2, 4),
+    "a1.xlarge": (4, 8),
+    "a1.2xlarge": (8, 16),
+}
+
+# Named choices for web_instance_profile; cpu_credits only applies to burstable types
+INSTANCE_PROFILES = {
+    "burstable": {"instance_type": "t3.micro", "cpu_credits": "unlimited"},
+    "burstable-graviton": {"instance_type": "t4g.small", "cpu_credits": "unlimited"},
+    "compute": {"instance_type": "c5.large"},
+    "graviton": {"instance_type": "c6g.large"},
+}
+
+# Latest Amazon Linux AMI per platform, by architecture
+AMI_PARAMETERS = {
+    "al2023": {
+        "x86_64": "/aws/service/ami-amazon-linux-latest/al2023-ami-kernel-default-x86_64",
+        "arm64": "/aws/service/ami-amazon-linux-latest/al2023-ami-kernel-default-arm64"
+    },
+    "al1": {"x86_64": "/aws/service/ami-amazon-linux-latest/amzn-ami-hvm-x86_64-gp2"}
+}
+
+# Resident memory of one uwsgi worker, and the share of RAM workers may use
+WORKER_MEMORY_MB = 100
+WORKER_MEMORY_SHARE = 0.6
+
+
+def architecture(instance_type):
+    """Graviton families carry a ``g`` after the generation, e.g. c6g, t4g, m6gd,
+    except the first generation ``a1``."""
+    return "arm64" if re.match(r"^(a1\.|[a-z]+\d+g)", instance_type) else "x86_64"
+
+
+def instance_profile(name, instance_type=None, platform=None, cpu_credits=None):
+    """Resolve a profile from INSTANCE_PROFILES, with optional overrides.
+
+    Returns a dict with ``instance_type``, ``architecture``, ``platform``,
+    ``ami_parameter`` and ``cpu_credits`` (None for non-burstable types).
+    """
+    if name not in INSTANCE_PROFILES:
+        raise ValueError("web_instance_profile must be one of %s, got %r"
+                         % (", ".join(sorted(INSTANCE_PROFILES)), name))
+    profile = INSTANCE_PROFILES[name]
+    instance_type = instance_type or profile["instance_type"]
+    if instance_type not in INSTANCE_SIZES:
+        raise ValueError("Unknown instance type %r, add it to INSTANCE_SIZES" % instance_type)
+    arch = architecture(instance_type)
+    platform = platform or "al2023"
+    if arch not in AMI_PARAMETERS.get(platform, {}):
+        raise ValueError("No %s AMI for platform %r (%s)" % (arch, platform, instance_type))
+    burstable = instance_type.startswith("t")
+    return {
+        "instance_type": instance_type,
+        "architecture": arch,
+        "platform": platform,
+        "ami_parameter": AMI_PARAMETERS[platform][arch],
+        "cpu_credits": (cpu_credits or profile.get("cpu_credits", "standard")) if burstable else None
+    }
+
+
+def server_tuning(instance_type, overrides=None):
+    """Return the nginx/uwsgi settings for ``instance_type``."""
+    if instance_type not in INSTANCE_SIZES:
+        raise ValueError("No size known for instance type %r, add it to INSTANCE_SIZES" % instance_type)
+    vcpus, memory_gib = INSTANCE_SIZES[instance_type]
+    memory_cap = max(1, int(memory_gib * 1024 * WORKER_MEMORY_SHARE / WORKER_MEMORY_MB))
+    processes = min(vcpus * 2, memory_cap)
+    tuning = {
+        "nginx_worker_processes": vcpus,
+        "nginx_worker_connections": 1024,
+        "keepalive_timeout": 75,
+        "client_max_body_size": "20m",
+        "client_body_buffer_size": "128k",
+        "uwsgi_buffer_size": "16k",
+        "uwsgi_buffers": "8 16k",
+        "uwsgi_processes": processes,
+        "uwsgi_threads": 4,
+        "uwsgi_listen": min(128 * processes, 4096),
+        "uwsgi_harakiri": 60,
+        "uwsgi_header_buffer_size": 32768,
+    }
+    unknown = set(overrides or {}) - set(tuning)
+    if unknown:
+        raise ValueError("Unknown web_server_tuning keys: %s" % ", ".join(sorted(unknown)))
+    tuning.update(overrides or {})
+    return tuning
+
+
+def sysctl_conf(tuning):
+    """uwsgi refuses a listen backlog above net.core.somaxconn."""
+    return """
+        net.core.somaxconn = %d
+        """ % max(tuning["uwsgi_listen"], 128)
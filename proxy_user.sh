@@ -0,0 +1,25 @@
+#!/bin/bash
+# Give web_user the password DBStack generated for the RDS Proxy. Run it from
+# the Cloud9 environment, which can reach the cluster, after deploying DBStack
+# with -c db_proxy_enabled=true.
+
+export_value() {
+  aws cloudformation list-exports --query "Exports[?Name=='$1'].Value | [0]" --output text
+}
+
+SECRET_ARN=$(export_value DBProxySecretArn)
+DB_HOST=$(export_value MyDBClusterEndpoint)
+if [ -z "$SECRET_ARN" ] || [ "$SECRET_ARN" == "None" ]; then
+  echo "DBProxySecretArn is not exported, deploy DBStack with -c db_proxy_enabled=true first"
+  exit 1
+fi
+WEB_PASSWORD=$(aws secretsmanager get-secret-value --secret-id "$SECRET_ARN" --query SecretString --output text \
+  | python3 -c 'import json, sys; print(json.load(sys.stdin)["password"])')
+
+echo -e "\033[36mSet the web_user password on $DB_HOST, enter the master DBPassword\033[0m"
+mysql -h "$DB_HOST" -u master -p <<SQL
+CREATE USER IF NOT EXISTS 'web_user'@'%' IDENTIFIED BY '$WEB_PASSWORD';
+ALTER USER 'web_user'@'%' IDENTIFIED BY '$WEB_PASSWORD';
+GRANT ALL PRIVILEGES ON Photos.* TO 'web_user'@'%';
+SQL
+echo -e "\033[35mEND\033[0m"
@@ -8,12 +8,6 @@ echo -e "\033[36mInstall requirements other_requirements.txt\033[0m"
 pip install -r other_requirements.txt
 echo -e "\033[36mInstall requirements requirements.txt\033[0m"
 pip install -r requirements.txt
-echo -e "\033[36mCDK synth\033[0m"
-cdk synth
-echo -e "\033[36mCDK deploy VpcStack IAMStack ParametesStack CognitoStack\033[0m"
-cdk deploy VpcStack IAMStack ParametersStack CognitoStack
-echo -e "\033[36mCDK deploy SecurityStack Cloud9Stack\033[0m"
-cdk deploy SecurityStack Cloud9Stack 
-echo -e "\033[36mCDK deploy CdnStack DBStack\033[0m"
-cdk deploy CdnStack DBStack  
+echo -e "\033[36mCDK synth and deploy all stacks in dependency order\033[0m"
+python -m tools.deploy deploy --exclude cdk
 echo -e "\033[35mEND\033[0m"
@@ -0,0 +1,35 @@
+"""Small in-memory templates shaped like the app's stacks."""
+
+
+def stack_template(exports=(), imports=(), resources=None):
+    """A template exporting ``exports`` and importing ``imports`` by name."""
+    template = {"Resources": resources or {"Topic": {"Type": "AWS::SNS::Topic"}}}
+    if exports:
+        template["Outputs"] = {name: {"Value": {"Ref": "Topic"}, "Export": {"Name": name}}
+                               for name in exports}
+    if imports:
+        template["Resources"]["Imports"] = {
+            "Type": "AWS::SSM::Parameter",
+            "Properties": {"Type": "String", "Value": {"Fn::Join": [",", [{"Fn::ImportValue": name}
+                                                                          for name in imports]]}}
+        }
+    return template
+
+
+def app_templates():
+    """VpcStack <- SecurityStack <- WebStack, CacheStack; WebStack also imports VPC."""
+    return {
+        "VpcStack": stack_template(exports=["VPC"]),
+        "SecurityStack": stack_template(exports=["WebSg", "CacheSg"], imports=["VPC"]),
+        "WebStack": stack_template(imports=["VPC", "WebSg"]),
+        "CacheStack": stack_template(imports=["CacheSg"]),
+    }
+
+
+def app_dependencies():
+    return {
+        "VpcStack": set(),
+        "SecurityStack": {"VpcStack"},
+        "WebStack": {"VpcStack", "SecurityStack"},
+        "CacheStack": {"SecurityStack"},
+    }
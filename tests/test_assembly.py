@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from tools import assembly
+from tests.templates import app_dependencies, app_templates, stack_template
+
+
+def test_dependency_graph_matches_imports_to_exports():
+    templates = app_templates()
+    templates["CacheStack"] = stack_template(imports=["CacheSg", "Missing"])
+    dependencies, dangling = assembly.dependency_graph(templates)
+    assert dependencies == app_dependencies()
+    assert dangling == {"CacheStack": {"Missing"}}
+
+
+def test_own_exports_are_not_a_dependency():
+    template = stack_template(exports=["VPC"], imports=["VPC"])
+    assert assembly.dependency_graph({"VpcStack": template}) == ({"VpcStack": set()}, {})
+
+
+def test_export_declared_twice():
+    with pytest.raises(ValueError):
+        assembly.index_exports({"A": stack_template(exports=["VPC"]), "B": stack_template(exports=["VPC"])})
+
+
+def test_topological_waves():
+    assert assembly.topological_waves(app_dependencies()) == [
+        ["VpcStack"], ["SecurityStack"], ["CacheStack", "WebStack"]]
+
+
+def test_topological_waves_ignore_edges_outside_the_graph():
+    assert assembly.topological_waves({"WebStack": {"VpcStack"}}) == [["WebStack"]]
+
+
+def test_topological_waves_reject_a_cycle():
+    with pytest.raises(ValueError, match="cycle"):
+        assembly.topological_waves({"A": {"B"}, "B": {"A"}, "C": set()})
+
+
+def test_restrict_drops_edges_to_other_stacks():
+    assert assembly.restrict(app_dependencies(), ["WebStack", "SecurityStack"]) == {
+        "WebStack": {"SecurityStack"}, "SecurityStack": set()}
+    with pytest.raises(KeyError):
+        assembly.restrict(app_dependencies(), ["DBStack"])
+
+
+def test_reverse_destroys_consumers_first():
+    reversed_graph = assembly.reverse(app_dependencies())
+    assert reversed_graph["VpcStack"] == {"SecurityStack", "WebStack"}
+    assert assembly.topological_waves(reversed_graph) == [
+        ["CacheStack", "WebStack"], ["SecurityStack"], ["VpcStack"]]
+
+
+def test_load_templates_from_the_manifest(tmp_path):
+    (tmp_path / "VpcStack.template.json").write_text(json.dumps(stack_template(exports=["VPC"])))
+    (tmp_path / "Ignored.template.json").write_text("{}")
+    (tmp_path / "manifest.json").write_text(json.dumps({"artifacts": {
+        "VpcStack": {"type": "aws:cloudformation:stack", "properties": {"templateFile": "VpcStack.template.json"}},
+        "Tree": {"type": "cdk:tree"},
+    }}))
+    assert list(assembly.load_templates(str(tmp_path))) == ["VpcStack"]
+
+
+def test_load_templates_without_a_synth(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        assembly.load_templates(str(tmp_path))
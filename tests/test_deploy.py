@@ -0,0 +1,103 @@
+import threading
+import time
+
+from tools import deploy
+from tests.templates import app_dependencies
+
+
+class Runner:
+    """Stands in for ``deploy.run_stack``, failing the stacks in ``failing``.
+
+    A stack in ``after_start`` returns only once the stack it maps to has
+    started, so both are running at the same time. Stacks that do not fail
+    take ``seconds``.
+    """
+
+    def __init__(self, failing=(), after_start=None, seconds=0):
+        self.failing = set(failing)
+        self.after_start = after_start or {}
+        self.seconds = seconds
+        self.calls = []
+        self.started = {}
+
+    def __call__(self, action, stack, assembly_dir, extra_args, log_dir):
+        self.calls.append((stack, extra_args))
+        self.started.setdefault(stack, threading.Event()).set()
+        if stack in self.after_start:
+            assert self.started.setdefault(self.after_start[stack], threading.Event()).wait(5)
+        if stack not in self.failing:
+            time.sleep(self.seconds)
+        return stack not in self.failing, 1.0
+
+
+def test_plan_deploy_and_destroy():
+    dependencies = app_dependencies()
+    assert deploy.plan("deploy", dependencies) == [["VpcStack"], ["SecurityStack"], ["CacheStack", "WebStack"]]
+    assert deploy.plan("deploy", dependencies, ["WebStack", "VpcStack"]) == [["VpcStack"], ["WebStack"]]
+    assert deploy.plan("deploy", dependencies, exclude=["VpcStack"]) == [["SecurityStack"], ["CacheStack", "WebStack"]]
+    assert deploy.plan("destroy", dependencies) == [["CacheStack", "WebStack"], ["SecurityStack"], ["VpcStack"]]
+
+
+def test_skip_unchanged_drops_empty_waves():
+    waves = [["VpcStack"], ["SecurityStack"], ["CacheStack", "WebStack"]]
+    assert deploy.skip_unchanged(waves, {"VpcStack", "WebStack"}) == [["VpcStack"], ["WebStack"]]
+    assert deploy.skip_unchanged(waves, set()) == []
+
+
+def test_split_context_args():
+    context, rest = deploy.split_context_args(
+        ["-c", "web_deploy_mode=rolling", "--parameters", "WebStack:A=1", "--context", "db_proxy_enabled=true",
+         "--context=stacks=WebStack", "--verbose"])
+    assert context == ["-c", "web_deploy_mode=rolling", "--context", "db_proxy_enabled=true",
+                       "--context=stacks=WebStack"]
+    assert rest == ["--parameters", "WebStack:A=1", "--verbose"]
+
+
+def test_cdk_command():
+    assert deploy.cdk_command("deploy", "WebStack", "cdk.out", ["--verbose"]) == [
+        "cdk", "deploy", "WebStack", "--app", "cdk.out", "--exclusively", "--require-approval", "never", "--verbose"]
+    assert deploy.cdk_command("destroy", "WebStack", "cdk.out", [])[-1] == "--force"
+
+
+def test_execute_runs_every_wave_with_its_arguments(tmp_path):
+    runner = Runner()
+    results = deploy.execute("deploy", [["VpcStack"], ["SecurityStack", "WebStack"]], str(tmp_path),
+                             ["--verbose"], runner=runner, stack_args={"WebStack": ["--tags", "a=b"]})
+    assert results == {"VpcStack": (True, 1.0), "SecurityStack": (True, 1.0), "WebStack": (True, 1.0)}
+    assert runner.calls[0] == ("VpcStack", ["--verbose"])
+    assert dict(runner.calls)["WebStack"] == ["--verbose", "--tags", "a=b"]
+    assert (tmp_path / "deploy-logs").is_dir()
+
+
+def test_execute_fail_fast_lets_running_stacks_finish_and_starts_nothing_new(tmp_path):
+    # VpcStack fails while SecurityStack is running
+    runner = Runner(failing=["VpcStack"], after_start={"VpcStack": "SecurityStack"})
+    results = deploy.execute("deploy", [["VpcStack", "SecurityStack"], ["WebStack"]], str(tmp_path),
+                             concurrency=2, runner=runner)
+    assert results == {"VpcStack": (False, 1.0), "SecurityStack": (True, 1.0)}
+    assert "WebStack" not in dict(runner.calls)
+
+
+def test_execute_fail_fast_cancels_queued_stacks(tmp_path):
+    runner = Runner(failing=["A"], seconds=0.05)
+    waves = [["A"] + ["Queued%d" % number for number in range(20)], ["Next"]]
+    results = deploy.execute("deploy", waves, str(tmp_path), concurrency=1, runner=runner)
+    assert results["A"] == (False, 1.0)
+    # At most the stack the worker picked up before the cancel went out
+    assert len(results) <= 2
+    assert "Next" not in results
+
+
+def test_execute_without_fail_fast_finishes_the_wave(tmp_path):
+    runner = Runner(failing=["A"])
+    results = deploy.execute("deploy", [["A", "B", "C"], ["Next"]], str(tmp_path),
+                             concurrency=1, fail_fast=False, runner=runner)
+    assert set(results) == {"A", "B", "C"}
+
+
+def test_write_timings_keeps_successful_stacks(tmp_path):
+    path = str(tmp_path / "timings.json")
+    deploy.write_timings(path, "deploy", {"VpcStack": (True, 12.34), "WebStack": (False, 3.0)})
+    deploy.write_timings(path, "destroy", {"VpcStack": (True, 5.0)})
+    assert (tmp_path / "timings.json").read_text().count("VpcStack") == 2
+    assert "WebStack" not in (tmp_path / "timings.json").read_text()
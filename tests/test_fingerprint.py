@@ -0,0 +1,83 @@
+import json
+
+from tools import fingerprint
+from tests.templates import app_templates, stack_template
+
+
+def test_compute_chains_through_imports(tmp_path):
+    templates = app_templates()
+    before = fingerprint.compute(templates, str(tmp_path))
+    templates["VpcStack"]["Resources"]["Extra"] = {"Type": "AWS::SNS::Topic"}
+    after = fingerprint.compute(templates, str(tmp_path))
+    # Every stack importing from VpcStack, directly or not, moves with it
+    assert all(before[stack] != after[stack] for stack in templates)
+
+    templates["CacheStack"]["Resources"]["Extra"] = {"Type": "AWS::SNS::Topic"}
+    again = fingerprint.compute(templates, str(tmp_path))
+    assert again["CacheStack"] != after["CacheStack"]
+    assert {stack: again[stack] for stack in again if stack != "CacheStack"} == \
+        {stack: after[stack] for stack in after if stack != "CacheStack"}
+
+
+def test_compute_includes_the_stack_parameters(tmp_path):
+    templates = app_templates()
+    plain = fingerprint.compute(templates, str(tmp_path))
+    with_parameter = fingerprint.compute(templates, str(tmp_path), ["--parameters", "WebStack:LatestAmiId=/aws/x"])
+    assert plain["WebStack"] != with_parameter["WebStack"]
+    assert plain["CacheStack"] == with_parameter["CacheStack"]
+
+
+def test_compute_hashes_assets(tmp_path):
+    (tmp_path / "asset.lambda").mkdir()
+    (tmp_path / "asset.lambda" / "index.py").write_text("print(1)")
+    (tmp_path / "manifest.json").write_text(json.dumps({"artifacts": {"VpcStack": {"metadata": {
+        "/VpcStack/Function": [{"type": "aws:cdk:asset", "data": {"path": "asset.lambda"}}]}}}}))
+    templates = {"VpcStack": stack_template()}
+    before = fingerprint.compute(templates, str(tmp_path))
+    (tmp_path / "asset.lambda" / "index.py").write_text("print(2)")
+    assert fingerprint.compute(templates, str(tmp_path)) != before
+
+
+def test_stack_parameters():
+    args = ["--parameters", "WebStack:LatestAmiId=ami", "--parameters=Shared=1", "--parameters", "DBStack:X=2"]
+    assert fingerprint.stack_parameters("WebStack", args) == {"LatestAmiId": "ami", "Shared": "1"}
+    assert fingerprint.stack_parameters("DBStack", args) == {"X": "2", "Shared": "1"}
+
+
+def test_local_store_is_keyed_by_environment(tmp_path):
+    path = str(tmp_path / "fingerprints.json")
+    store = fingerprint.LocalStore(path, "111111111111/us-east-1")
+    store.put("WebStack", "abc")
+    assert json.loads((tmp_path / "fingerprints.json").read_text()) == {"111111111111/us-east-1/WebStack": "abc"}
+    assert fingerprint.LocalStore(path, "111111111111/us-east-1").get("WebStack") == "abc"
+    assert fingerprint.LocalStore(path, "111111111111/eu-west-1").get("WebStack") is None
+    store.delete("WebStack")
+    assert fingerprint.LocalStore(path, "111111111111/us-east-1").get("WebStack") is None
+
+
+def test_local_store_without_an_environment(tmp_path, monkeypatch):
+    monkeypatch.setattr(fingerprint, "current_environment", lambda: None)
+    store = fingerprint.LocalStore(str(tmp_path / "fingerprints.json"))
+    store.put("WebStack", "abc")
+    assert store.get("WebStack") is None
+    assert not (tmp_path / "fingerprints.json").exists()
+
+
+class MemoryStore:
+    def __init__(self, data):
+        self.data = data
+
+    def get(self, stack):
+        return self.data.get(stack)
+
+
+def test_changed():
+    fingerprints = {"VpcStack": "a", "WebStack": "b", "CacheStack": "c"}
+    store = MemoryStore({"VpcStack": "a", "WebStack": "old", "CacheStack": "c"})
+
+    def deployed(stack):
+        return stack != "CacheStack"
+
+    assert fingerprint.changed(fingerprints, store, exists=deployed) == {"WebStack", "CacheStack"}
+    assert fingerprint.changed(fingerprints, store, ["VpcStack", "WebStack"], exists=deployed) == {"WebStack"}
+    assert fingerprint.changed(fingerprints, store, exists=lambda stack: True) == {"WebStack"}
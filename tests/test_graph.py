@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from tools import graph
+from tests.templates import app_dependencies, app_templates, stack_template
+
+DURATIONS = {"VpcStack": 60.0, "SecurityStack": 30.0, "WebStack": 300.0, "CacheStack": 600.0}
+
+
+def test_critical_path():
+    assert graph.critical_path(app_dependencies(), DURATIONS) == (690.0, ["VpcStack", "SecurityStack", "CacheStack"])
+    assert graph.critical_path({}, {}) == (0.0, [])
+
+
+def test_wave_time_waits_for_the_slowest_stack_of_each_wave():
+    assert graph.wave_time(app_dependencies(), DURATIONS) == 690.0
+    assert graph.wave_time({"A": set(), "B": set(), "C": {"A"}}, {"A": 10.0, "B": 50.0, "C": 10.0}) == 60.0
+
+
+def test_upstream():
+    assert graph.upstream(app_dependencies(), ["CacheStack"]) == {"SecurityStack", "VpcStack"}
+
+
+def test_merge_sums_the_durations():
+    merged, weights = graph.merge(app_dependencies(), DURATIONS, ["VpcStack", "SecurityStack"])
+    assert merged == {"SecurityStack+VpcStack": set(),
+                      "WebStack": {"SecurityStack+VpcStack"},
+                      "CacheStack": {"SecurityStack+VpcStack"}}
+    assert weights["SecurityStack+VpcStack"] == 90.0
+    assert graph.critical_path(merged, weights)[0] == 690.0
+
+
+def test_merge_rejects_a_stack_in_between():
+    with pytest.raises(ValueError, match="SecurityStack"):
+        graph.merge(app_dependencies(), DURATIONS, ["VpcStack", "CacheStack"])
+    with pytest.raises(ValueError, match="unknown"):
+        graph.merge(app_dependencies(), DURATIONS, ["VpcStack", "DBStack"])
+
+
+def test_split_shares_the_work():
+    split, weights = graph.split(app_dependencies(), DURATIONS, "CacheStack", 3)
+    assert split["CacheStack#2"] == {"SecurityStack"}
+    assert weights["CacheStack#2"] == 200.0
+    assert "CacheStack" not in split
+    assert graph.critical_path(split, weights) == (390.0, ["VpcStack", "SecurityStack", "WebStack"])
+
+
+def test_split_updates_consumers():
+    split, _ = graph.split(app_dependencies(), DURATIONS, "SecurityStack", 2)
+    assert split["CacheStack"] == {"SecurityStack#1", "SecurityStack#2"}
+
+
+def test_split_rejects_bad_arguments():
+    with pytest.raises(ValueError):
+        graph.split(app_dependencies(), DURATIONS, "DBStack", 2)
+    with pytest.raises(ValueError):
+        graph.split(app_dependencies(), DURATIONS, "WebStack", 0)
+
+
+def test_estimate_durations_prefers_measured_timings(tmp_path):
+    timings = tmp_path / "timings.json"
+    timings.write_text(json.dumps({"deploy": {"VpcStack": 42.0}}))
+    durations, estimated = graph.estimate_durations(app_templates(), str(timings))
+    assert durations["VpcStack"] == 42.0
+    assert durations["WebStack"] == graph.BASE_SECONDS + 2 * graph.SECONDS_PER_RESOURCE
+    assert estimated == {"SecurityStack", "WebStack", "CacheStack"}
+
+
+def test_registry_drift():
+    registry = [("VpcStack", "", "", []), ("WebStack", "", "", ["VpcStack"]),
+                ("CacheStack", "", "", ["SecurityStack", "DBStack"])]
+    assert graph.registry_drift(app_dependencies(), registry) == {
+        "WebStack": {"SecurityStack"}, "SecurityStack": {"VpcStack"}}
+
+
+def test_registry_matches_the_app_imports():
+    from cdk import registry
+    listed = {stack_id for stack_id, _, _, _ in registry.STACKS}
+    for stack_id, _, _, dependencies in registry.STACKS:
+        assert set(dependencies) <= listed
+    assert graph.registry_drift({"cdk": {"VpcStack", "Cloud9Stack"}}) == {}
+
+
+def test_main_fails_on_dangling_imports_and_drift(tmp_path, capsys):
+    def write(templates):
+        for stack, template in templates.items():
+            (tmp_path / ("%s.template.json" % stack)).write_text(json.dumps(template))
+
+    arguments = ["--app", str(tmp_path), "--timings", str(tmp_path / "none.json")]
+    write(app_templates())
+    assert graph.main(arguments) == 0
+    assert "Critical path  165.0s  VpcStack -> SecurityStack -> CacheStack" in capsys.readouterr().out
+
+    write({"IAMStack": stack_template(imports=["VPC"])})
+    assert graph.main(arguments) == 1
+    assert "IAMStack imports from VpcStack, which cdk/registry.py does not list" in capsys.readouterr().out
+    assert graph.main(arguments + ["--exclude", "IAMStack"]) == 0
+
+    (tmp_path / "IAMStack.template.json").unlink()
+    write({"ImageStack": stack_template(imports=["Missing"])})
+    assert graph.main(arguments) == 1
+    assert "ImageStack imports Missing, which no stack exports" in capsys.readouterr().out
@@ -0,0 +1,97 @@
+import pytest
+
+from tools import template_size
+
+
+def padded(resource_type, properties=None, padding=0):
+    resource = {"Type": resource_type, "Properties": dict(properties or {})}
+    if padding:
+        resource["Properties"]["Description"] = "x" * padding
+    return resource
+
+
+@pytest.fixture
+def template():
+    return {
+        "Parameters": {
+            "SubnetIds": {"Type": "List<AWS::EC2::Subnet::Id>"},
+            "Secret": {"Type": "String", "NoEcho": True},
+            "Unused": {"Type": "String"},
+        },
+        "Conditions": {"IsProd": {"Fn::Equals": ["a", "b"]}},
+        "Resources": {
+            "Table": padded("AWS::DynamoDB::Table", padding=3000),
+            "Alarm": padded("AWS::CloudWatch::Alarm", {
+                "AlarmDescription": {"Fn::Sub": "${Table.Arn} in ${AWS::Region}"},
+                "Subnets": {"Ref": "SubnetIds"},
+                "Password": {"Ref": "Secret"},
+            }),
+            "Queue": padded("AWS::SQS::Queue", padding=2000),
+            "QueuePolicy": padded("AWS::SQS::QueuePolicy", {"Queues": [{"Ref": "Queue"}]}),
+            "Topic": dict(padded("AWS::SNS::Topic", padding=1000), Condition="IsProd"),
+            "Subscription": dict(padded("AWS::SNS::Subscription"), DependsOn="Topic"),
+            "CDKMetadata": {"Type": "AWS::CDK::Metadata", "Properties": {"Analytics": "v2"}},
+        },
+        "Outputs": {
+            "TableArn": {"Value": {"Fn::GetAtt": ["Table", "Arn"]}, "Export": {"Name": "TableArn"}},
+            "QueueUrl": {"Value": {"Ref": "Queue"}},
+        },
+    }
+
+
+def test_find_references():
+    node = {"A": {"Ref": "X"}, "B": [{"Fn::GetAtt": "Y.Arn"}],
+            "C": {"Fn::Sub": ["${Z.Arn}/${AWS::Region}/${Var}", {"Var": {"Ref": "W"}}]}}
+    assert set(template_size.find_references(node)) == {"X", "Y", "Z", "AWS::Region", "W"}
+
+
+def test_components_follow_references_and_depends_on(template):
+    assert template_size.components(template) == [
+        {"Table", "Alarm"}, {"Queue", "QueuePolicy"}, {"Topic", "Subscription"}, {"CDKMetadata"}]
+
+
+def test_movable(template):
+    assert template_size.movable(template, {"Table", "Alarm"})
+    assert not template_size.movable(template, {"Topic", "Subscription"})
+    assert not template_size.movable(template, {"CDKMetadata"})
+
+
+def test_check(template):
+    assert template_size.check({"Stack": template}) == {}
+    problems = template_size.check({"Stack": template}, limit=1000, resource_limit=5)
+    assert len(problems["Stack"]) == 2
+
+
+def test_plan_split_moves_the_largest_movable_groups(template):
+    limit = template_size.size(template) - 1000
+    assert template_size.plan_split(template, limit) == [{"Table", "Alarm"}]
+    # Groups share a nested stack while it stays within the limits
+    assert template_size.plan_split(template, resource_limit=4) == [{"Table", "Alarm", "Queue", "QueuePolicy"}]
+    assert template_size.plan_split(template, resource_limit=3) == [{"Table", "Alarm"}, {"Queue", "QueuePolicy"}]
+    # Groups bigger than a nested stack stay put
+    assert template_size.plan_split(template, 2500) == [{"Queue", "QueuePolicy"}]
+
+
+def test_split_rewrites_the_parent(template):
+    parent, nested_templates = template_size.split("Web-Stack", template, [{"Table", "Alarm"}])
+    assert list(nested_templates) == ["Web-Stack.nested1.template.json"]
+    nested = nested_templates["Web-Stack.nested1.template.json"]
+
+    assert set(nested["Resources"]) == {"Table", "Alarm"}
+    assert nested["Parameters"] == {"SubnetIds": {"Type": "CommaDelimitedList"},
+                                    "Secret": {"Type": "String", "NoEcho": True}}
+    assert nested["Outputs"] == {"TableArn": {"Value": {"Fn::GetAtt": ["Table", "Arn"]}}}
+
+    assert "Table" not in parent["Resources"] and "Queue" in parent["Resources"]
+    stack = parent["Resources"]["WebStackNested1"]
+    assert stack["Type"] == "AWS::CloudFormation::Stack"
+    assert stack["Properties"]["TemplateURL"] == {
+        "Fn::Sub": "https://sourcebucketname${AWS::AccountId}.s3.amazonaws.com/Web-Stack.nested1.template.json"}
+    assert stack["Properties"]["Parameters"] == {"SubnetIds": {"Fn::Join": [",", {"Ref": "SubnetIds"}]},
+                                                 "Secret": {"Ref": "Secret"}}
+    # The export stays in the parent, reading the nested output
+    assert parent["Outputs"]["TableArn"] == {"Value": {"Fn::GetAtt": ["WebStackNested1", "Outputs.TableArn"]},
+                                             "Export": {"Name": "TableArn"}}
+    assert parent["Outputs"]["QueueUrl"] == {"Value": {"Ref": "Queue"}}
+    # The input is left alone
+    assert "Table" in template["Resources"]
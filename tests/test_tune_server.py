@@ -0,0 +1,111 @@
+import json
+
+import pytest
+
+from cdk import tune_server, web_tuning
+
+NGINX_CONF = """\
+user nginx;
+worker_processes 1;
+error_log /var/log/nginx/error.log;
+
+events {
+    worker_connections 1024;
+}
+
+http {
+    include /etc/nginx/mime.types;
+    keepalive_timeout 65;
+
+    server {
+        listen 80;
+        location /static {
+            alias /photos/FlaskApp/static;
+        }
+        location / {
+            include uwsgi_params;
+            uwsgi_pass unix:/tmp/uwsgi.sock;
+        }
+    }
+}
+"""
+
+UPSTART_JOB = """\
+description "uWSGI server"
+start on runlevel [2345]
+stop on runlevel [!2345]
+respawn
+chdir /photos/FlaskApp
+env LANG=en_US.UTF-8
+exec /usr/local/bin/uwsgi --socket /tmp/uwsgi.sock \\
+    --module application:application --processes 2
+"""
+
+
+@pytest.fixture
+def tuning():
+    return web_tuning.server_tuning("c5.xlarge")
+
+
+def test_nginx_keeps_the_bundle_and_sets_the_tuned_values(tuning):
+    text = tune_server.tune_nginx(NGINX_CONF, tuning)
+    assert "worker_processes 4;" in text
+    assert "worker_processes 1;" not in text
+    assert "worker_connections 1024;" in text
+    assert "keepalive_timeout 75;" in text and "keepalive_timeout 65;" not in text
+    assert "worker_rlimit_nofile 2048;" in text
+    # Added inside http, everything the app routes on is untouched
+    http = text.index("http {")
+    assert text.index("client_max_body_size 20m;") > http
+    assert text.index("uwsgi_read_timeout 60;") > http
+    assert "alias /photos/FlaskApp/static;" in text
+    assert "uwsgi_pass unix:/tmp/uwsgi.sock;" in text
+
+
+def test_nginx_directive_on_one_line_with_its_block(tuning):
+    text = tune_server.tune_nginx("events { worker_connections 512; }\nhttp {\n}\n", tuning)
+    assert text.count("worker_connections") == 1
+    assert "{ worker_connections 1024;" in text
+
+
+def test_nginx_without_a_block_for_a_missing_directive(tuning):
+    with pytest.raises(ValueError):
+        tune_server.tune_nginx("worker_processes 1;\n", tuning)
+
+
+def test_upstart_job_gets_the_options_appended(tuning):
+    text = tune_server.tune_upstart(UPSTART_JOB, tuning)
+    exec_line = [line for line in text.splitlines() if line.startswith("exec")][0]
+    assert "--module application:application --processes 2" in exec_line
+    assert exec_line.endswith("--processes 8 --threads 4 --listen 1024 --harakiri 60 --buffer-size 32768")
+    assert "chdir /photos/FlaskApp" in text
+
+
+def test_systemd_unit_runs_the_upstart_command(tuning):
+    unit = tune_server.systemd_unit(UPSTART_JOB, tuning)
+    assert "ExecStart=/usr/local/bin/uwsgi --socket /tmp/uwsgi.sock" in unit
+    assert "--processes 8 --threads 4" in unit
+    assert "WorkingDirectory=/photos/FlaskApp" in unit
+    assert "Environment=LANG=en_US.UTF-8" in unit
+    assert "KillSignal=SIGQUIT" in unit
+
+
+def test_job_without_exec(tuning):
+    with pytest.raises(ValueError):
+        tune_server.tune_upstart("respawn\n", tuning)
+    with pytest.raises(ValueError):
+        tune_server.systemd_unit("respawn\n", tuning)
+
+
+def test_main_rewrites_the_targets(tmp_path, tuning):
+    (tmp_path / "tuning.json").write_text(json.dumps(tuning))
+    (tmp_path / "nginx.conf").write_text(NGINX_CONF)
+    (tmp_path / "uwsgi.conf").write_text(UPSTART_JOB)
+    assert tune_server.main([
+        str(tmp_path / "tuning.json"),
+        "--nginx", str(tmp_path / "nginx.conf"), str(tmp_path / "nginx.out"),
+        "--uwsgi", str(tmp_path / "uwsgi.conf"), str(tmp_path / "uwsgi.service"),
+        "--systemd",
+    ]) == 0
+    assert "worker_processes 4;" in (tmp_path / "nginx.out").read_text()
+    assert "[Service]" in (tmp_path / "uwsgi.service").read_text()
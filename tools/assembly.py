@@ -0,0 +1,124 @@
+"""Read the synthesized templates of a cloud assembly (``cdk.out``).
+
+Stacks in this app are wired together only through ``CfnOutput`` export
+names and ``Fn::ImportValue``, so the deploy order has to be recovered
+from the templates themselves.
+"""
+import glob
+import json
+import os
+
+DEFAULT_ASSEMBLY = "cdk.out"
+
+
+def load_templates(assembly_dir=DEFAULT_ASSEMBLY):
+    """Return ``{stack name: template dict}`` for every stack in the assembly."""
+    manifest_path = os.path.join(assembly_dir, "manifest.json")
+    template_files = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as fp:
+            manifest = json.load(fp)
+        for name, artifact in manifest.get("artifacts", {}).items():
+            if artifact.get("type") == "aws:cloudformation:stack":
+                template_files[name] = artifact["properties"]["templateFile"]
+    else:
+        for path in glob.glob(os.path.join(assembly_dir, "*.template.json")):
+            file_name = os.path.basename(path)
+            template_files[file_name[:-len(".template.json")]] = file_name
+
+    if not template_files:
+        raise FileNotFoundError("No stack templates found in %s, run `cdk synth` first" % assembly_dir)
+
+    templates = {}
+    for name, file_name in template_files.items():
+        with open(os.path.join(assembly_dir, file_name)) as fp:
+            templates[name] = json.load(fp)
+    return templates
+
+
+def find_imports(node):
+    """Yield every literal export name passed to ``Fn::ImportValue`` under ``node``."""
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == "Fn::ImportValue" and isinstance(value, str):
+                yield value
+            else:
+                yield from find_imports(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from find_imports(value)
+
+
+def find_exports(template):
+    """Return ``{export name: output logical id}`` for the template's outputs."""
+    exports = {}
+    for logical_id, output in template.get("Outputs", {}).items():
+        name = output.get("Export", {}).get("Name")
+        if isinstance(name, str):
+            exports[name] = logical_id
+    return exports
+
+
+def index_exports(templates):
+    """Return ``{export name: stack name}`` across all templates."""
+    index = {}
+    for stack, template in templates.items():
+        for name in find_exports(template):
+            if name in index:
+                raise ValueError("Export %r is declared by both %s and %s" % (name, index[name], stack))
+            index[name] = stack
+    return index
+
+
+def dependency_graph(templates):
+    """Match imports to exports.
+
+    Returns ``(dependencies, dangling)`` where ``dependencies`` maps each
+    stack to the set of stacks it imports from and ``dangling`` maps each
+    stack to the import names no template exports.
+    """
+    exports = index_exports(templates)
+    dependencies = {stack: set() for stack in templates}
+    dangling = {}
+    for stack, template in templates.items():
+        for name in set(find_imports(template)):
+            producer = exports.get(name)
+            if producer is None:
+                dangling.setdefault(stack, set()).add(name)
+            elif producer != stack:
+                dependencies[stack].add(producer)
+    return dependencies, dangling
+
+
+def topological_waves(dependencies):
+    """Group stacks into waves whose members only depend on earlier waves."""
+    remaining = {stack: set(deps) & set(dependencies) for stack, deps in dependencies.items()}
+    waves = []
+    while remaining:
+        wave = sorted(stack for stack, deps in remaining.items() if not deps)
+        if not wave:
+            raise ValueError("Dependency cycle between stacks: %s" % ", ".join(sorted(remaining)))
+        waves.append(wave)
+        for stack in wave:
+            del remaining[stack]
+        for deps in remaining.values():
+            deps.difference_update(wave)
+    return waves
+
+
+def restrict(dependencies, stacks):
+    """Sub-graph of ``dependencies`` limited to ``stacks``; edges to other stacks are dropped."""
+    stacks = set(stacks)
+    unknown = stacks - set(dependencies)
+    if unknown:
+        raise KeyError("Unknown stacks: %s" % ", ".join(sorted(unknown)))
+    return {stack: dependencies[stack] & stacks for stack in stacks}
+
+
+def reverse(dependencies):
+    """Invert the edges, e.g. to destroy consumers before producers."""
+    reversed_graph = {stack: set() for stack in dependencies}
+    for stack, deps in dependencies.items():
+        for dep in deps:
+            reversed_graph[dep].add(stack)
+    return reversed_graph
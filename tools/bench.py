@@ -0,0 +1,163 @@
+"""Synth benchmarks for app.py with a stored performance budget.
+
+Every measurement runs in a fresh interpreter, so jsii start-up is counted
+the way ``cdk synth`` pays it:
+
+* cold import: each ``cdk.*_stack`` module with an empty bytecode cache
+* warm import: the same module with ``__pycache__`` already populated
+* construct: time spent in each stack's constructor
+* synth: ``app.synth()`` for the whole app, plus the bytes of each template
+
+::
+
+    python -m tools.bench --save             # record benchmarks/baseline.json
+    python -m tools.bench                    # compare, exit 1 on regression
+    python -m tools.bench --threshold 0.1 --repeat 5
+"""
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from cdk.registry import STACKS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+
+# Timings below this many seconds are treated as noise when comparing
+MIN_SECONDS = 0.05
+
+
+def worker_import(module):
+    started = time.perf_counter()
+    importlib.import_module(module)
+    return {"seconds": time.perf_counter() - started}
+
+
+def worker_synth(outdir):
+    from aws_cdk import core
+
+    started = time.perf_counter()
+    modules = {module: importlib.import_module(module) for _, module, _, _ in STACKS}
+    import_seconds = time.perf_counter() - started
+
+    app = core.App(outdir=outdir)
+    construct = {}
+    for stack_id, module, class_name, _ in STACKS:
+        started = time.perf_counter()
+        getattr(modules[module], class_name)(app, stack_id)
+        construct[stack_id] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    app.synth()
+    synth_seconds = time.perf_counter() - started
+
+    template_bytes = {}
+    for stack_id, _, _, _ in STACKS:
+        path = os.path.join(outdir, "%s.template.json" % stack_id)
+        if os.path.exists(path):
+            template_bytes[stack_id] = os.path.getsize(path)
+    return {"import": import_seconds, "construct": construct, "synth": synth_seconds,
+            "template_bytes": template_bytes}
+
+
+def spawn(args, env=None):
+    """Run a worker in a fresh interpreter and return its JSON result."""
+    result = subprocess.run([sys.executable, "-m", "tools.bench", "--worker"] + args,
+                            cwd=ROOT, env=env, stdout=subprocess.PIPE, check=True)
+    return json.loads(result.stdout.decode().splitlines()[-1])
+
+
+def measure(repeat=3):
+    results = {"import_cold": {}, "import_warm": {}, "construct": {}, "synth": {}, "template_bytes": {}}
+    samples = {}
+
+    def sample(key, value):
+        samples.setdefault(key, []).append(value)
+
+    for _ in range(repeat):
+        for _, module, _, _ in STACKS:
+            with tempfile.TemporaryDirectory() as cache:
+                env = dict(os.environ, PYTHONPYCACHEPREFIX=cache)
+                sample(("import_cold", module), spawn(["import", module], env)["seconds"])
+            sample(("import_warm", module), spawn(["import", module])["seconds"])
+        with tempfile.TemporaryDirectory() as outdir:
+            synth = spawn(["synth", outdir])
+        for stack_id, seconds in synth["construct"].items():
+            sample(("construct", stack_id), seconds)
+        sample(("synth", "import"), synth["import"])
+        sample(("synth", "synth"), synth["synth"])
+        sample(("synth", "total"), synth["import"] + sum(synth["construct"].values()) + synth["synth"])
+        results["template_bytes"] = synth["template_bytes"]
+
+    for (group, name), values in samples.items():
+        results[group][name] = round(statistics.median(values), 4)
+    return results
+
+
+def compare(baseline, current, threshold):
+    """Return a list of ``(metric, baseline, current)`` that grew beyond ``threshold``."""
+    regressions = []
+    for group, values in current.items():
+        for name, value in values.items():
+            before = baseline.get(group, {}).get(name)
+            if before is None:
+                continue
+            slack = 0 if group == "template_bytes" else MIN_SECONDS
+            if value > before * (1 + threshold) + slack:
+                regressions.append(("%s.%s" % (group, name), before, value))
+    return regressions
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if argv and argv[0] == "--worker":
+        kind, arg = argv[1], argv[2]
+        result = worker_import(arg) if kind == "import" else worker_synth(arg)
+        print(json.dumps(result))
+        return 0
+
+    parser = argparse.ArgumentParser(prog="python -m tools.bench", description=__doc__.split("\n")[0])
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed relative growth before a metric counts as a regression")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per metric, the median is kept")
+    parser.add_argument("--output", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    current = measure(args.repeat)
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(current, fp, indent=2, sort_keys=True)
+
+    for group in sorted(current):
+        print(group)
+        for name, value in sorted(current[group].items()):
+            print("  %-28s %s" % (name, value))
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as fp:
+            json.dump(current, fp, indent=2, sort_keys=True)
+        print("Saved %s" % args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline at %s, run with --save first" % args.baseline, file=sys.stderr)
+        return 1
+    with open(args.baseline) as fp:
+        baseline = json.load(fp)
+    regressions = compare(baseline, current, args.threshold)
+    for metric, before, after in regressions:
+        print("REGRESSION %s: %s -> %s" % (metric, before, after))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""Deploy or destroy the app's stacks in dependency order, in parallel.
+
+The dependency graph is rebuilt from the synthesized templates by matching
+every ``Fn::ImportValue`` to the stack exporting that name. Stacks in the
+same topological wave do not depend on each other and run concurrently::
+
+    python -m tools.deploy deploy --concurrency 4 --exclude cdk
+    python -m tools.deploy destroy --exclude cdk
+    python -m tools.deploy deploy WebStack -- --parameters WebStack:LatestAmiId=/aws/service/...
+    python -m tools.deploy deploy --skip-unchanged
+
+Arguments after ``--`` are passed to every ``cdk`` invocation, except
+``-c``/``--context`` values, which only ``cdk synth`` reads::
+
+    python -m tools.deploy deploy -- -c web_deploy_mode=rolling
+
+Deployed
+stacks have their fingerprint recorded (see ``tools.fingerprint``), and
+``--skip-unchanged`` leaves out stacks whose fingerprint has not moved.
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import subprocess
+import sys
+import time
+
+from tools import assembly, fingerprint
+
+DEFAULT_TIMINGS = "deploy-timings.json"
+
+
+def cdk_command(action, stack, assembly_dir, extra_args):
+    command = ["cdk", action, stack, "--app", assembly_dir, "--exclusively"]
+    if action == "deploy":
+        command += ["--require-approval", "never"]
+    else:
+        command += ["--force"]
+    return command + list(extra_args)
+
+
+def split_context_args(extra_args):
+    """Split ``extra_args`` into ``(context args for cdk synth, the rest)``.
+
+    ``cdk deploy --app cdk.out`` reads an assembly that is already
+    synthesized, so context given to it would be ignored.
+    """
+    context, rest = [], []
+    args = iter(extra_args)
+    for arg in args:
+        if arg in ("-c", "--context"):
+            context += [arg, next(args, "")]
+        elif arg.startswith("--context="):
+            context.append(arg)
+        else:
+            rest.append(arg)
+    return context, rest
+
+
+def run_stack(action, stack, assembly_dir, extra_args, log_dir):
+    """Run one ``cdk`` call, logging to ``log_dir/<stack>.log``; returns (ok, seconds)."""
+    log_path = os.path.join(log_dir, "%s.log" % stack)
+    started = time.monotonic()
+    with open(log_path, "w") as log:
+        result = subprocess.run(cdk_command(action, stack, assembly_dir, extra_args),
+                                stdout=log, stderr=subprocess.STDOUT)
+    return result.returncode == 0, time.monotonic() - started
+
+
+def plan(action, dependencies, stacks=None, exclude=()):
+    graph = dependencies
+    selected = set(stacks or graph) - set(exclude)
+    graph = assembly.restrict(graph, selected)
+    if action == "destroy":
+        graph = assembly.reverse(graph)
+    return assembly.topological_waves(graph)
+
+
+def skip_unchanged(waves, pending):
+    """Drop stacks not in ``pending`` from ``waves``, and any wave left empty."""
+    waves = [[stack for stack in wave if stack in pending] for wave in waves]
+    return [wave for wave in waves if wave]
+
+
+def execute(action, waves, assembly_dir, extra_args=(), concurrency=4, fail_fast=True,
+            runner=run_stack, stack_args=None):
+    """Run ``waves`` in order; returns ``{stack: (ok, seconds)}`` for every stack started.
+
+    ``stack_args`` maps a stack to extra ``cdk`` arguments for that stack only.
+    """
+    stack_args = stack_args or {}
+    log_dir = os.path.join(assembly_dir, "deploy-logs")
+    os.makedirs(log_dir, exist_ok=True)
+    results = {}
+    failed = False
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for number, wave in enumerate(waves, 1):
+            print("Wave %d: %s" % (number, ", ".join(wave)), flush=True)
+            futures = {pool.submit(runner, action, stack, assembly_dir,
+                                   list(extra_args) + stack_args.get(stack, []), log_dir): stack
+                       for stack in wave}
+            for future in concurrent.futures.as_completed(futures):
+                if future.cancelled():
+                    continue
+                stack = futures[future]
+                ok, seconds = future.result()
+                results[stack] = (ok, seconds)
+                print("  %-8s %-20s %7.1fs" % ("ok" if ok else "FAILED", stack, seconds), flush=True)
+                if not ok:
+                    failed = True
+                    print("  see %s" % os.path.join(log_dir, "%s.log" % stack), flush=True)
+                    if fail_fast:
+                        # Stacks already running in this wave finish; nothing new starts
+                        for pending in futures:
+                            pending.cancel()
+            if failed:
+                break
+    return results
+
+
+def write_timings(path, action, results):
+    timings = {}
+    if os.path.exists(path):
+        with open(path) as fp:
+            timings = json.load(fp)
+    section = timings.setdefault(action, {})
+    for stack, (ok, seconds) in results.items():
+        if ok:
+            section[stack] = round(seconds, 1)
+    with open(path, "w") as fp:
+        json.dump(timings, fp, indent=2, sort_keys=True)
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    extra_args = []
+    if "--" in argv:
+        extra_args = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+
+    parser = argparse.ArgumentParser(prog="python -m tools.deploy", description=__doc__.split("\n")[0])
+    parser.add_argument("action", choices=["deploy", "destroy"])
+    parser.add_argument("stacks", nargs="*", help="limit to these stacks (default: all)")
+    parser.add_argument("--app", default=assembly.DEFAULT_ASSEMBLY, help="cloud assembly directory")
+    parser.add_argument("--exclude", action="append", default=[], help="stack to leave out, repeatable")
+    parser.add_argument("--concurrency", type=int, default=4, help="maximum stacks in flight")
+    parser.add_argument("--no-fail-fast", dest="fail_fast", action="store_false",
+                        help="finish the current wave's stacks after a failure instead of stopping")
+    parser.add_argument("--no-synth", dest="synth", action="store_false", help="reuse the existing assembly")
+    parser.add_argument("--dry-run", action="store_true", help="print the waves and exit")
+    parser.add_argument("--timings", default=DEFAULT_TIMINGS, help="file recording per-stack durations")
+    parser.add_argument("--skip-unchanged", action="store_true",
+                        help="only deploy stacks whose fingerprint differs from the last deploy")
+    parser.add_argument("--fingerprint-store", choices=["local", "tag"], default="local",
+                        help="keep deployed fingerprints in %s or in a stack tag" % fingerprint.DEFAULT_STORE)
+    args = parser.parse_args(argv)
+    context_args, extra_args = split_context_args(extra_args)
+
+    if args.synth and not args.dry_run:
+        subprocess.run(["cdk", "synth", "--quiet", "--output", args.app] + context_args, check=True)
+    elif context_args:
+        print("warning: %s ignored, the assembly in %s is not synthesized again"
+              % (" ".join(context_args), args.app), file=sys.stderr)
+
+    templates = assembly.load_templates(args.app)
+    dependencies, dangling = assembly.dependency_graph(templates)
+    for stack, names in sorted(dangling.items()):
+        print("warning: %s imports %s, not exported by any stack in %s"
+              % (stack, ", ".join(sorted(names)), args.app), file=sys.stderr)
+    waves = plan(args.action, dependencies, args.stacks, args.exclude)
+
+    fingerprints = fingerprint.compute(templates, args.app, extra_args)
+    store = fingerprint.open_store(args.fingerprint_store)
+    stack_args = {}
+    if args.action == "deploy":
+        if args.skip_unchanged:
+            pending = fingerprint.changed(fingerprints, store)
+            unchanged = sorted(set(fingerprints) & {stack for wave in waves for stack in wave} - pending)
+            if unchanged:
+                print("Unchanged, skipped: %s" % ", ".join(unchanged))
+            waves = skip_unchanged(waves, pending)
+        if args.fingerprint_store == "tag":
+            stack_args = {stack: fingerprint.TagStore.deploy_args(fingerprints[stack]) for stack in fingerprints}
+
+    if args.dry_run:
+        for number, wave in enumerate(waves, 1):
+            print("Wave %d: %s" % (number, ", ".join(wave)))
+        return 0
+
+    started = time.monotonic()
+    results = execute(args.action, waves, args.app, extra_args, args.concurrency, args.fail_fast,
+                      stack_args=stack_args)
+    write_timings(args.timings, args.action, results)
+    for stack, (ok, seconds) in results.items():
+        if ok and args.action == "deploy":
+            store.put(stack, fingerprints[stack])
+        elif ok:
+            store.delete(stack)
+    print("Total %.1fs" % (time.monotonic() - started))
+    planned = sum(len(wave) for wave in waves)
+    ok = all(ok for ok, seconds in results.values()) and len(results) == planned
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""Content fingerprints of synthesized stacks, to skip unchanged deploys.
+
+A stack's fingerprint hashes its template, the ``--parameters`` passed for
+it, the files of its assets and the fingerprints of every stack whose
+exports it imports, so a changed producer invalidates its consumers.
+The last deployed fingerprints live in ``.cdk-fingerprints.json``, keyed by
+account, region and stack, or in a ``cdk-fingerprint`` stack tag read back
+with the AWS CLI. A stack only counts as unchanged while ``describe-stacks``
+still shows it deployed::
+
+    python -m tools.fingerprint               # show changed/unchanged stacks
+    python -m tools.deploy deploy --skip-unchanged
+"""
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+
+from tools import assembly
+
+DEFAULT_STORE = ".cdk-fingerprints.json"
+TAG_KEY = "cdk-fingerprint"
+
+# Stack statuses whose template is the last one deployed successfully
+DEPLOYED_STATUSES = ("CREATE_COMPLETE", "UPDATE_COMPLETE", "IMPORT_COMPLETE")
+
+
+def aws(*args):
+    """Output of an AWS CLI call, or None when it fails."""
+    try:
+        result = subprocess.run(["aws"] + list(args) + ["--output", "text"],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+    value = result.stdout.decode().strip()
+    return value if result.returncode == 0 and value not in ("", "None") else None
+
+
+def current_environment():
+    """``account/region`` the AWS CLI deploys to, or None when it cannot tell."""
+    account = aws("sts", "get-caller-identity", "--query", "Account")
+    region = (os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION")
+              or aws("configure", "get", "region"))
+    return "%s/%s" % (account, region) if account and region else None
+
+
+def stack_exists(stack):
+    """Whether ``stack`` is deployed, not missing, rolled back or mid-update."""
+    return aws("cloudformation", "describe-stacks", "--stack-name", stack,
+               "--query", "Stacks[0].StackStatus") in DEPLOYED_STATUSES
+
+
+def stack_parameters(stack, extra_args):
+    """``--parameters`` values from the cdk arguments that apply to ``stack``."""
+    parameters = {}
+    for index, arg in enumerate(extra_args):
+        if arg == "--parameters" and index + 1 < len(extra_args):
+            value = extra_args[index + 1]
+        elif arg.startswith("--parameters="):
+            value = arg[len("--parameters="):]
+        else:
+            continue
+        key, _, setting = value.partition("=")
+        if ":" in key:
+            target, _, key = key.partition(":")
+            if target != stack:
+                continue
+        parameters[key] = setting
+    return parameters
+
+
+def hash_path(digest, path):
+    """Feed a file, or every file under a directory, into ``digest``."""
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                digest.update(os.path.relpath(file_path, path).encode())
+                hash_path(digest, file_path)
+    elif os.path.exists(path):
+        with open(path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(65536), b""):
+                digest.update(chunk)
+
+
+def stack_assets(assembly_dir):
+    """Return ``{stack: [asset paths]}`` from the assembly manifest."""
+    manifest_path = os.path.join(assembly_dir, "manifest.json")
+    assets = {}
+    if not os.path.exists(manifest_path):
+        return assets
+    with open(manifest_path) as fp:
+        manifest = json.load(fp)
+    for stack, artifact in manifest.get("artifacts", {}).items():
+        for entries in artifact.get("metadata", {}).values():
+            for entry in entries:
+                if entry.get("type") == "aws:cdk:asset" and "path" in entry.get("data", {}):
+                    assets.setdefault(stack, []).append(os.path.join(assembly_dir, entry["data"]["path"]))
+    return assets
+
+
+def compute(templates, assembly_dir, extra_args=()):
+    """Return ``{stack: fingerprint}`` for every template."""
+    dependencies, _ = assembly.dependency_graph(templates)
+    assets = stack_assets(assembly_dir)
+    fingerprints = {}
+    for wave in assembly.topological_waves(dependencies):
+        for stack in wave:
+            digest = hashlib.sha256()
+            digest.update(json.dumps(templates[stack], sort_keys=True, separators=(",", ":")).encode())
+            digest.update(json.dumps(stack_parameters(stack, extra_args), sort_keys=True).encode())
+            for path in sorted(assets.get(stack, [])):
+                hash_path(digest, path)
+            for producer in sorted(dependencies[stack]):
+                digest.update(("%s=%s" % (producer, fingerprints[producer])).encode())
+            fingerprints[stack] = digest.hexdigest()
+    return fingerprints
+
+
+class LocalStore:
+    """Deployed fingerprints kept in a JSON file next to the app.
+
+    Entries are keyed ``account/region/stack`` so switching credentials or
+    region does not reuse another environment's fingerprints. When the
+    environment cannot be determined nothing counts as deployed.
+    """
+
+    def __init__(self, path=DEFAULT_STORE, environment=None):
+        self.path = path
+        self.environment = environment or current_environment()
+        self.data = {}
+        if os.path.exists(path):
+            with open(path) as fp:
+                self.data = json.load(fp)
+
+    def key(self, stack):
+        return "%s/%s" % (self.environment, stack)
+
+    def get(self, stack):
+        return self.data.get(self.key(stack)) if self.environment else None
+
+    def put(self, stack, fingerprint):
+        if self.environment:
+            self.data[self.key(stack)] = fingerprint
+            self.save()
+
+    def delete(self, stack):
+        self.data.pop(self.key(stack), None)
+        self.save()
+
+    def save(self):
+        with open(self.path, "w") as fp:
+            json.dump(self.data, fp, indent=2, sort_keys=True)
+
+
+class TagStore:
+    """Deployed fingerprints read from the ``cdk-fingerprint`` stack tag.
+
+    Writing happens through ``deploy_args``: the tag is passed to
+    ``cdk deploy``, so it only lands when the deploy succeeds.
+    """
+
+    def get(self, stack):
+        return aws("cloudformation", "describe-stacks", "--stack-name", stack,
+                   "--query", "Stacks[0].Tags[?Key=='%s'].Value | [0]" % TAG_KEY)
+
+    def put(self, stack, fingerprint):
+        pass
+
+    def delete(self, stack):
+        pass
+
+    @staticmethod
+    def deploy_args(fingerprint):
+        return ["--tags", "%s=%s" % (TAG_KEY, fingerprint)]
+
+
+def open_store(kind, path=DEFAULT_STORE):
+    return TagStore() if kind == "tag" else LocalStore(path)
+
+
+def changed(fingerprints, store, stacks=None, exists=stack_exists):
+    """Stacks among ``stacks`` (default all) to deploy.
+
+    A stack is changed when its fingerprint differs from the store, or when
+    it matches but the stack is no longer deployed (deleted outside this
+    tool, or its last update rolled back).
+    """
+    return {stack for stack in (stacks or fingerprints)
+            if store.get(stack) != fingerprints[stack] or not exists(stack)}
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    extra_args = []
+    if "--" in argv:
+        extra_args = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+
+    parser = argparse.ArgumentParser(prog="python -m tools.fingerprint", description=__doc__.split("\n")[0])
+    parser.add_argument("--app", default=assembly.DEFAULT_ASSEMBLY, help="cloud assembly directory")
+    parser.add_argument("--store", choices=["local", "tag"], default="local", help="where deployed fingerprints live")
+    parser.add_argument("--store-file", default=DEFAULT_STORE, help="file used by the local store")
+    args = parser.parse_args(argv)
+
+    fingerprints = compute(assembly.load_templates(args.app), args.app, extra_args)
+    store = open_store(args.store, args.store_file)
+    pending = changed(fingerprints, store)
+    for stack in sorted(fingerprints):
+        print("  %-9s %-20s %s" % ("changed" if stack in pending else "unchanged", stack, fingerprints[stack][:12]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+"""Report the cross-stack export/import graph of a synthesized app.
+
+Prints which stack exports every name and who imports it, flags imports
+nothing exports or that ``cdk/registry.py`` does not list, and shows the
+critical path that bounds deploy wall-clock
+time. Stack durations come from ``deploy-timings.json`` (written by
+``tools.deploy``) or, for stacks never deployed, an estimate from their
+resource count. ``--merge`` and ``--split`` estimate how restructuring
+stacks would move the critical path::
+
+    python -m tools.graph
+    python -m tools.graph --merge IAMStack,SecurityStack --split WebStack=2
+    python -m tools.graph --dot > stacks.dot
+"""
+import argparse
+import json
+import os
+import sys
+
+from cdk import registry
+from tools import assembly
+from tools.deploy import DEFAULT_TIMINGS
+
+# Rough CloudFormation cost of a stack never timed by tools.deploy
+BASE_SECONDS = 30.0
+SECONDS_PER_RESOURCE = 15.0
+
+
+def estimate_durations(templates, timings_path=DEFAULT_TIMINGS):
+    """Return ``({stack: seconds}, {stacks that were estimated})``."""
+    measured = {}
+    if os.path.exists(timings_path):
+        with open(timings_path) as fp:
+            measured = json.load(fp).get("deploy", {})
+    durations, estimated = {}, set()
+    for stack, template in templates.items():
+        if stack in measured:
+            durations[stack] = float(measured[stack])
+        else:
+            durations[stack] = BASE_SECONDS + SECONDS_PER_RESOURCE * len(template.get("Resources", {}))
+            estimated.add(stack)
+    return durations, estimated
+
+
+def critical_path(dependencies, durations):
+    """Longest duration-weighted chain through the graph; returns ``(seconds, [stacks])``."""
+    finish, previous = {}, {}
+    for wave in assembly.topological_waves(dependencies):
+        for stack in wave:
+            start, before = 0.0, None
+            for dep in dependencies[stack]:
+                if finish[dep] > start:
+                    start, before = finish[dep], dep
+            finish[stack] = start + durations[stack]
+            previous[stack] = before
+    if not finish:
+        return 0.0, []
+    stack = max(finish, key=finish.get)
+    total, path = finish[stack], []
+    while stack is not None:
+        path.append(stack)
+        stack = previous[stack]
+    return total, list(reversed(path))
+
+
+def wave_time(dependencies, durations):
+    """Wall clock of ``tools.deploy``, which waits for a whole wave before the next."""
+    return sum(max(durations[stack] for stack in wave)
+               for wave in assembly.topological_waves(dependencies))
+
+
+def upstream(dependencies, stacks):
+    """Every stack that ``stacks`` depend on, directly or not."""
+    seen, pending = set(), list(stacks)
+    while pending:
+        for dep in dependencies[pending.pop()]:
+            if dep not in seen:
+                seen.add(dep)
+                pending.append(dep)
+    return seen
+
+
+def merge(dependencies, durations, stacks):
+    """Fold ``stacks`` into one node whose duration is their sum.
+
+    Raises ValueError for unknown stacks, or when another stack sits between
+    two of them (A <- B <- C), since the merged node would depend on itself.
+    """
+    stacks = set(stacks)
+    unknown = stacks - set(dependencies)
+    if unknown:
+        raise ValueError("cannot merge unknown stacks: %s" % ", ".join(sorted(unknown)))
+    between = {stack for stack in upstream(dependencies, stacks) - stacks
+               if upstream(dependencies, [stack]) & stacks}
+    if between:
+        raise ValueError("cannot merge %s: %s depends on one of them and is a dependency of another"
+                         % (", ".join(sorted(stacks)), ", ".join(sorted(between))))
+    name = "+".join(sorted(stacks))
+    graph, weights = {}, {}
+    for stack, deps in dependencies.items():
+        if stack in stacks:
+            continue
+        graph[stack] = {name if dep in stacks else dep for dep in deps}
+        weights[stack] = durations[stack]
+    graph[name] = {dep for stack in stacks for dep in dependencies[stack]} - stacks
+    weights[name] = sum(durations[stack] for stack in stacks)
+    return graph, weights
+
+
+def split(dependencies, durations, stack, parts):
+    """Replace ``stack`` by ``parts`` independent stacks sharing its work evenly."""
+    if stack not in dependencies:
+        raise ValueError("cannot split unknown stack: %s" % stack)
+    if parts < 1:
+        raise ValueError("cannot split %s into %d parts" % (stack, parts))
+    names = ["%s#%d" % (stack, number) for number in range(1, parts + 1)]
+    graph, weights = {}, {}
+    for other, deps in dependencies.items():
+        if other == stack:
+            continue
+        graph[other] = set(deps)
+        if stack in deps:
+            graph[other].discard(stack)
+            graph[other].update(names)
+        weights[other] = durations[other]
+    for name in names:
+        graph[name] = set(dependencies[stack])
+        weights[name] = durations[stack] / parts
+    return graph, weights
+
+
+def registry_drift(dependencies, stacks=registry.STACKS):
+    """Imports found in the templates that the registry entries leave out.
+
+    Returns ``{stack: set of missing dependencies}``; a stack the registry
+    does not know maps to all of its dependencies. Registry dependencies
+    the templates do not show are fine, they may be context dependent.
+    """
+    listed = {stack_id: set(deps) for stack_id, _, _, deps in stacks}
+    drift = {}
+    for stack, deps in dependencies.items():
+        missing = deps - listed.get(stack, set())
+        if missing or stack not in listed:
+            drift[stack] = missing
+    return drift
+
+
+def to_dot(dependencies, path):
+    on_path = set(zip(path, path[1:]))
+    lines = ["digraph stacks {", "  rankdir=LR;"]
+    for stack in sorted(dependencies):
+        lines.append('  "%s";' % stack)
+        for dep in sorted(dependencies[stack]):
+            style = " [color=red]" if (dep, stack) in on_path else ""
+            lines.append('  "%s" -> "%s"%s;' % (dep, stack, style))
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def report(templates, dependencies, dangling, drift, durations, estimated):
+    exports = assembly.index_exports(templates)
+    imported = {}
+    for stack, template in templates.items():
+        for name in set(assembly.find_imports(template)):
+            imported.setdefault(name, set()).add(stack)
+
+    print("Stacks")
+    for stack in sorted(templates):
+        print("  %-20s %7.1fs%s  <- %s" % (
+            stack, durations[stack], " (est.)" if stack in estimated else "",
+            ", ".join(sorted(dependencies[stack])) or "-"))
+
+    print("\nExports")
+    for name in sorted(exports):
+        print("  %-32s %-16s -> %s" % (name, exports[name], ", ".join(sorted(imported.get(name, ()))) or "(unused)"))
+
+    if dangling:
+        print("\nDangling imports")
+        for stack in sorted(dangling):
+            for name in sorted(dangling[stack]):
+                print("  %s imports %s, which no stack exports" % (stack, name))
+
+    if drift:
+        print("\nRegistry drift")
+        for stack in sorted(drift):
+            if drift[stack]:
+                print("  %s imports from %s, which cdk/registry.py does not list"
+                      % (stack, ", ".join(sorted(drift[stack]))))
+            else:
+                print("  %s is not in cdk/registry.py" % stack)
+
+    total, path = critical_path(dependencies, durations)
+    print("\nCritical path  %.1fs  %s" % (total, " -> ".join(path)))
+    print("Wave schedule  %.1fs" % wave_time(dependencies, durations))
+    print("Serial         %.1fs" % sum(durations.values()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m tools.graph", description=__doc__.split("\n")[0])
+    parser.add_argument("--app", default=assembly.DEFAULT_ASSEMBLY, help="cloud assembly directory")
+    parser.add_argument("--timings", default=DEFAULT_TIMINGS, help="durations recorded by tools.deploy")
+    parser.add_argument("--exclude", action="append", default=[], help="stack to leave out, repeatable")
+    parser.add_argument("--merge", action="append", default=[], metavar="A,B",
+                        help="estimate merging these stacks into one, repeatable")
+    parser.add_argument("--split", action="append", default=[], metavar="STACK=N",
+                        help="estimate splitting a stack into N independent stacks, repeatable")
+    parser.add_argument("--dot", action="store_true", help="print the graph in Graphviz format")
+    args = parser.parse_args(argv)
+
+    # Excluded stacks still export to the others, so drop them from the full graph
+    templates = assembly.load_templates(args.app)
+    dependencies, dangling = assembly.dependency_graph(templates)
+    drift = {stack: deps for stack, deps in registry_drift(dependencies).items() if stack not in args.exclude}
+    dependencies = assembly.restrict(dependencies, set(templates) - set(args.exclude))
+    templates = {stack: templates[stack] for stack in dependencies}
+    dangling = {stack: names for stack, names in dangling.items() if stack in dependencies}
+    durations, estimated = estimate_durations(templates, args.timings)
+
+    if args.dot:
+        print(to_dot(dependencies, critical_path(dependencies, durations)[1]))
+        return 0
+
+    report(templates, dependencies, dangling, drift, durations, estimated)
+
+    if args.merge or args.split:
+        graph, weights = dependencies, durations
+        try:
+            for spec in args.merge:
+                graph, weights = merge(graph, weights, spec.split(","))
+            for spec in args.split:
+                stack, _, parts = spec.partition("=")
+                if not parts.isdigit():
+                    raise ValueError("--split expects STACK=N, got %r" % spec)
+                graph, weights = split(graph, weights, stack, int(parts))
+        except ValueError as error:
+            parser.error(str(error))
+        before, after = critical_path(dependencies, durations)[0], critical_path(graph, weights)
+        print("\nWhat-if        %.1fs  %s" % (after[0], " -> ".join(after[1])))
+        print("  critical path %+.1fs, wave schedule %+.1fs" % (
+            after[0] - before, wave_time(graph, weights) - wave_time(dependencies, durations)))
+
+    return 1 if dangling or drift else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
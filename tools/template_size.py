@@ -0,0 +1,256 @@
+"""Template size and resource-count guard for a synthesized app.
+
+Reports the bytes of every stack and of its largest resources against the
+CloudFormation limits, and exits 1 when a stack crosses one. For a stack
+over the limit it plans how to move groups of resources into nested stacks,
+the same way ``CdkStack`` points ``CfnStack`` at ``VpcStack.template.json``.
+A group is a connected component of the ``Ref``/``Fn::GetAtt``/``DependsOn``
+graph, so no reference crosses the parent/nested boundary except through
+nested stack parameters and outputs::
+
+    python -m tools.template_size                 # report and plan
+    python -m tools.template_size --limit 40000   # plan against a tighter budget
+    python -m tools.template_size --apply         # write the split templates
+
+``--apply`` rewrites the parent templates in the assembly and writes the
+nested ones next to them; upload those to the source bucket before running
+``python -m tools.deploy deploy --no-synth``.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+
+from tools import assembly
+
+# CloudFormation quotas
+BODY_LIMIT = 51200
+S3_LIMIT = 1048576
+RESOURCE_LIMIT = 500
+
+DEFAULT_TEMPLATE_URL = "https://sourcebucketname${AWS::AccountId}.s3.amazonaws.com/%s"
+
+SUB_REFERENCE = re.compile(r"\$\{([A-Za-z0-9:]+)(?:\.[A-Za-z0-9.]+)?\}")
+
+
+def size(node):
+    """Bytes of ``node`` as ``cdk synth`` writes it."""
+    return len(json.dumps(node, indent=1))
+
+
+def find_references(node):
+    """Yield every logical id referenced by ``Ref``, ``Fn::GetAtt`` or ``Fn::Sub`` under ``node``."""
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == "Ref" and isinstance(value, str):
+                yield value
+            elif key == "Fn::GetAtt":
+                yield value[0] if isinstance(value, list) else value.split(".")[0]
+            elif key == "Fn::Sub":
+                text, variables = (value, {}) if isinstance(value, str) else (value[0], value[1])
+                for name in SUB_REFERENCE.findall(text):
+                    if name not in variables:
+                        yield name
+                yield from find_references(variables)
+            else:
+                yield from find_references(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from find_references(value)
+
+
+def resource_references(resource):
+    references = set(find_references(resource))
+    depends_on = resource.get("DependsOn", [])
+    references.update([depends_on] if isinstance(depends_on, str) else depends_on)
+    return references
+
+
+def components(template):
+    """Connected components of the template's resources, largest first."""
+    resources = template.get("Resources", {})
+    neighbours = {logical_id: set() for logical_id in resources}
+    for logical_id, resource in resources.items():
+        for other in resource_references(resource) & set(resources):
+            neighbours[logical_id].add(other)
+            neighbours[other].add(logical_id)
+    seen, groups = set(), []
+    for logical_id in sorted(resources):
+        if logical_id in seen:
+            continue
+        group, stack = set(), [logical_id]
+        while stack:
+            current = stack.pop()
+            if current not in group:
+                group.add(current)
+                stack.extend(neighbours[current] - group)
+        seen |= group
+        groups.append(group)
+    return sorted(groups, key=lambda group: -sum(size(resources[name]) for name in group))
+
+
+def uses_conditions(node):
+    if isinstance(node, dict):
+        return "Fn::If" in node or "Condition" in node or any(uses_conditions(value) for value in node.values())
+    if isinstance(node, list):
+        return any(uses_conditions(value) for value in node)
+    return False
+
+
+def movable(template, group):
+    """Resources tied to the parent's conditions, and CDK metadata, stay in the parent."""
+    resources = template["Resources"]
+    return all(not uses_conditions(resources[name]) and resources[name]["Type"] != "AWS::CDK::Metadata"
+               for name in group)
+
+
+def check(templates, limit=BODY_LIMIT, resource_limit=RESOURCE_LIMIT):
+    """Return ``{stack: [problems]}`` for stacks over a limit."""
+    problems = {}
+    for stack, template in templates.items():
+        stack_bytes, count = size(template), len(template.get("Resources", {}))
+        if stack_bytes > limit:
+            problems.setdefault(stack, []).append("%d bytes > %d" % (stack_bytes, limit))
+        if count > resource_limit:
+            problems.setdefault(stack, []).append("%d resources > %d" % (count, resource_limit))
+    return problems
+
+
+def plan_split(template, limit=BODY_LIMIT, resource_limit=RESOURCE_LIMIT):
+    """Pick components to move until the parent fits; returns a list of nested groups.
+
+    Groups are packed first-fit into nested stacks that stay within the same
+    limits. A component that does not fit a nested stack by itself is left
+    in the parent.
+    """
+    resources = template["Resources"]
+    parent_bytes, parent_count = size(template), len(resources)
+    nested = []
+    for group in components(template):
+        if parent_bytes <= limit and parent_count <= resource_limit:
+            break
+        if not movable(template, group):
+            continue
+        group_bytes = sum(size(resources[name]) for name in group)
+        if group_bytes > limit or len(group) > resource_limit:
+            continue
+        for target in nested:
+            if target["bytes"] + group_bytes <= limit and len(target["resources"]) + len(group) <= resource_limit:
+                break
+        else:
+            target = {"resources": set(), "bytes": 0}
+            nested.append(target)
+        target["resources"] |= group
+        target["bytes"] += group_bytes
+        parent_bytes -= group_bytes
+        parent_count -= len(group)
+    return [target["resources"] for target in nested]
+
+
+def nested_parameter(parameter):
+    """Parameter declaration for a value the parent passes down already resolved."""
+    declaration = {"Type": "CommaDelimitedList" if "List" in parameter["Type"] else "String"}
+    if parameter.get("NoEcho"):
+        declaration["NoEcho"] = True
+    return declaration
+
+
+def split(stack, template, groups, template_url=DEFAULT_TEMPLATE_URL):
+    """Return ``(parent template, {file name: nested template})`` for the planned ``groups``."""
+    parent = json.loads(json.dumps(template))
+    resources = parent["Resources"]
+    parameters = parent.get("Parameters", {})
+    nested_templates = {}
+    for number, group in enumerate(groups, 1):
+        nested_id = "%sNested%d" % (re.sub(r"[^A-Za-z0-9]", "", stack), number)
+        file_name = "%s.nested%d.template.json" % (stack, number)
+        body = {name: resources.pop(name) for name in sorted(group)}
+        used = set()
+        for resource in body.values():
+            used |= resource_references(resource)
+        nested = {"Resources": body}
+        passed = sorted(name for name in used if name in parameters)
+        if passed:
+            nested["Parameters"] = {name: nested_parameter(parameters[name]) for name in passed}
+
+        # Parent outputs that read a moved resource go through a nested output
+        for logical_id, output in parent.get("Outputs", {}).items():
+            if set(find_references(output["Value"])) & group:
+                nested.setdefault("Outputs", {})[logical_id] = {"Value": output["Value"]}
+                output["Value"] = {"Fn::GetAtt": [nested_id, "Outputs.%s" % logical_id]}
+
+        stack_resource = {
+            "Type": "AWS::CloudFormation::Stack",
+            "Properties": {
+                "TemplateURL": {"Fn::Sub": template_url % file_name},
+                "TimeoutInMinutes": 30
+            }
+        }
+        if passed:
+            stack_resource["Properties"]["Parameters"] = {
+                name: ({"Fn::Join": [",", {"Ref": name}]} if nested["Parameters"][name]["Type"] == "CommaDelimitedList"
+                       else {"Ref": name})
+                for name in passed}
+        resources[nested_id] = stack_resource
+        nested_templates[file_name] = nested
+    return parent, nested_templates
+
+
+def report(templates, limit, resource_limit, top):
+    print("%-20s %9s %6s %9s" % ("Stack", "bytes", "body%", "resources"))
+    for stack in sorted(templates, key=lambda name: -size(templates[name])):
+        template = templates[stack]
+        stack_bytes = size(template)
+        print("%-20s %9d %5.0f%% %9d" % (stack, stack_bytes, 100.0 * stack_bytes / BODY_LIMIT,
+                                         len(template.get("Resources", {}))))
+        resources = template.get("Resources", {})
+        for logical_id in sorted(resources, key=lambda name: -size(resources[name]))[:top]:
+            print("  %-34s %7d  %s" % (logical_id, size(resources[logical_id]), resources[logical_id]["Type"]))
+    print("\nLimits: %d bytes per body (%d via S3), %d resources; budget %d bytes"
+          % (BODY_LIMIT, S3_LIMIT, RESOURCE_LIMIT, limit))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m tools.template_size", description=__doc__.split("\n")[0])
+    parser.add_argument("--app", default=assembly.DEFAULT_ASSEMBLY, help="cloud assembly directory")
+    parser.add_argument("--limit", type=int, default=BODY_LIMIT, help="template bytes allowed per stack")
+    parser.add_argument("--resource-limit", type=int, default=RESOURCE_LIMIT, help="resources allowed per stack")
+    parser.add_argument("--top", type=int, default=3, help="largest resources listed per stack")
+    parser.add_argument("--template-url", default=DEFAULT_TEMPLATE_URL,
+                        help="Fn::Sub pattern of the nested template URL, %%s is the file name")
+    parser.add_argument("--apply", action="store_true", help="write the split templates into the assembly")
+    args = parser.parse_args(argv)
+
+    templates = assembly.load_templates(args.app)
+    report(templates, args.limit, args.resource_limit, args.top)
+
+    problems = check(templates, args.limit, args.resource_limit)
+    for stack in sorted(problems):
+        template = templates[stack]
+        print("\n%s over the limit: %s" % (stack, "; ".join(problems[stack])))
+        groups = plan_split(template, args.limit, args.resource_limit)
+        if not groups:
+            print("  no movable resource group fits a nested stack")
+            continue
+        parent, nested_templates = split(stack, template, groups, args.template_url)
+        for (file_name, nested), group in zip(sorted(nested_templates.items()), groups):
+            print("  %s (%d bytes): %s" % (file_name, size(nested), ", ".join(sorted(group))))
+        print("  %s.template.json would shrink to %d bytes" % (stack, size(parent)))
+        still_over = check({stack: parent}, args.limit, args.resource_limit)
+        if still_over:
+            print("  still over the limit: %s" % "; ".join(still_over[stack]))
+
+        if args.apply:
+            with open(os.path.join(args.app, "%s.template.json" % stack), "w") as fp:
+                json.dump(parent, fp, indent=1)
+            for file_name, nested in nested_templates.items():
+                with open(os.path.join(args.app, file_name), "w") as fp:
+                    json.dump(nested, fp, indent=1)
+                print("  wrote %s, upload it to the source bucket" % os.path.join(args.app, file_name))
+
+    return 1 if problems and not args.apply else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())